@@ -0,0 +1,208 @@
+"""Benchmark of the wire codecs on realistic Spotnet messages.
+
+Run with::
+
+    $ python -m backend.benchmarks.wire_codecs --slaves=4 --tracks=100
+
+For each available codec, this reports the mean frame size and the mean
+time to encode and decode a message, for full state snapshots and for a
+stream of small state patches. The deflate codecs keep their compression
+context across messages, so each scenario is run as one continuous stream
+through a single encoder and a single decoder, as on a real connection.
+
+"""
+
+import datetime
+import random
+import string
+import sys
+import time
+import uuid
+
+from argparse import ArgumentParser, RawTextHelpFormatter
+
+from ..utils.wire_codecs import available_codecs, get_codec
+
+
+_ID_CHARS = string.ascii_letters + string.digits
+
+
+def get_parsed_args(args=None):
+    """Get the parsed args.
+
+    Args:
+        args (List[str]): The list of command line args to parse; if left as
+            None, sys.argv will be used.
+
+    Returns:
+        Namespace: The Namespace object returned by ArgumentParser.parse_args
+
+    """
+    parser = ArgumentParser(
+        prog='wire_codecs.py',
+        description='Benchmark of the Spotnet wire codecs.',
+        formatter_class=RawTextHelpFormatter)
+
+    parser.add_argument(
+        '--slaves',
+        dest='slaves',
+        action='store',
+        type=int,
+        required=False,
+        default=4,
+        help='The number of slaves in each state snapshot.')
+
+    parser.add_argument(
+        '--tracks',
+        dest='tracks',
+        action='store',
+        type=int,
+        required=False,
+        default=100,
+        help='The number of queued tracks on each slave.')
+
+    parser.add_argument(
+        '--messages',
+        dest='messages',
+        action='store',
+        type=int,
+        required=False,
+        default=200,
+        help='The number of messages in each benchmarked stream.')
+
+    if args is None:
+        args = sys.argv[1:]
+
+    return parser.parse_args(args)
+
+
+def make_track(rng):
+    """Return a queued track dict with a random Spotify id."""
+    track_id = ''.join(rng.choice(_ID_CHARS) for _ in range(22))
+    return {'id': track_id, 'uri': 'spotify:track:' + track_id}
+
+
+def make_slave_state(rng, num_tracks):
+    """Return a slave state dict shaped like ``get_state`` output."""
+    return {
+        'uuid': str(uuid.uuid1()),
+        'version': rng.randint(1, 10000),
+        'name': 'living-room-pi',
+        'is-connected': True,
+        'is-paused': False,
+        'counted-votes-for-skip': 0,
+        'first-connected-at': datetime.datetime.now().isoformat(),
+        'track-queue': [make_track(rng) for _ in range(num_tracks)]
+    }
+
+
+def make_state_messages(rng, num_slaves, num_tracks, num_messages):
+    """Return a stream of ``send-state`` messages of slowly changing state."""
+    slaves = [make_slave_state(rng, num_tracks) for _ in range(num_slaves)]
+
+    messages = []
+    for _ in range(num_messages):
+        slave = rng.choice(slaves)
+        slave['version'] += 1
+        slave['track-queue'] = (slave['track-queue'][1:] +
+                                [make_track(rng)])
+        messages.append({
+            'status': 'send-state',
+            'sender': 'master',
+            'data': {
+                'voting-enabled': False,
+                'votes-for-skip': 5,
+                'slaves': [dict(s) for s in slaves]
+            }})
+
+    return messages
+
+
+def make_patch_messages(rng, num_slaves, num_messages):
+    """Return a stream of ``send-slave-patches`` messages."""
+    uuids = [str(uuid.uuid1()) for _ in range(num_slaves)]
+
+    messages = []
+    for version in range(1, num_messages + 1):
+        if rng.random() < 0.5:
+            patch = {'op': 'queue-insert',
+                     'position': rng.randint(0, 50),
+                     'track': make_track(rng)}
+        elif rng.random() < 0.5:
+            patch = {'op': 'queue-remove', 'position': 0}
+        else:
+            patch = {'op': 'set-field', 'field': 'is-paused',
+                     'value': rng.random() < 0.5}
+        patch['version'] = version
+
+        messages.append({
+            'status': 'send-slave-patches',
+            'sender': 'master',
+            'data': {
+                'uuid': rng.choice(uuids),
+                'patches': [patch]
+            }})
+
+    return messages
+
+
+def run_stream(codec_name, messages):
+    """Encode and decode a stream of messages with a fresh codec pair.
+
+    Returns:
+        Tuple(float,float,float): The mean frame size in bytes, and the mean
+            encode and decode times in microseconds.
+
+    """
+    encoder = get_codec(codec_name)
+    decoder = get_codec(codec_name)
+
+    start = time.perf_counter()
+    frames = [encoder.encode(msg) for msg in messages]
+    encode_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    decoded = [decoder.decode(frame) for frame in frames]
+    decode_time = time.perf_counter() - start
+
+    if decoded != messages:
+        raise RuntimeError('Codec "{}" did not round-trip the messages.'
+                           .format(codec_name))
+
+    size = sum(len(frame.encode('utf-8') if isinstance(frame, str) else
+                   frame) for frame in frames)
+    n = len(messages)
+    return size / n, encode_time / n * 1e6, decode_time / n * 1e6
+
+
+def main():
+    """The main routine to run the benchmark.
+
+    Returns:
+        int: The status code of the routine.
+
+    """
+    opts = get_parsed_args()
+    rng = random.Random(0)
+
+    scenarios = [
+        ('state ({0} slaves x {1} tracks)'.format(opts.slaves, opts.tracks),
+         make_state_messages(rng, opts.slaves, opts.tracks, opts.messages)),
+        ('patches', make_patch_messages(rng, opts.slaves, opts.messages))
+    ]
+
+    row = '{:<34} {:<16} {:>12} {:>12} {:>12}'
+    print(row.format('scenario', 'codec', 'bytes/msg', 'encode us',
+                     'decode us'))
+    for scenario, messages in scenarios:
+        for codec_name in available_codecs():
+            size, encode_us, decode_us = run_stream(codec_name, messages)
+            print(row.format(scenario, codec_name, '{:.0f}'.format(size),
+                             '{:.1f}'.format(encode_us),
+                             '{:.1f}'.format(decode_us)))
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -5,6 +5,8 @@ import sys
 
 from argparse import ArgumentParser, RawTextHelpFormatter
 
+from ..utils import configure_logging
+from .persistence import JournalStateStore
 from .server import SpotnetMasterServer
 
 
@@ -59,6 +61,55 @@ def get_parsed_args(args=None):
         default=5,
         help='The number of votes required to skip a track.')
 
+    parser.add_argument(
+        '--lookahead',
+        dest='lookahead',
+        action='store',
+        type=int,
+        required=False,
+        default=0,
+        help='The number of upcoming tracks to pre-load on each slave,\n'
+             'for gapless transitions between tracks.')
+
+    parser.add_argument(
+        '--state-dir',
+        dest='state_dir',
+        action='store',
+        required=False,
+        default=None,
+        help='Optional directory in which to persist the state of the\n'
+             'slaves, so that it survives restarts of the master.')
+
+    parser.add_argument(
+        '--metrics-port',
+        dest='metrics_port',
+        action='store',
+        type=int,
+        required=False,
+        default=None,
+        help='Optional port on which to serve metrics over HTTP, at\n'
+             '/metrics in the Prometheus text format.')
+
+    parser.add_argument(
+        '--slow-trace-ms',
+        dest='slow_trace_ms',
+        action='store',
+        type=float,
+        required=False,
+        default=None,
+        help='Optional number of milliseconds beyond which the full trace\n'
+             'of a web client request is logged.')
+
+    parser.add_argument(
+        '--log-format',
+        dest='log_format',
+        action='store',
+        choices=['text', 'json'],
+        required=False,
+        default='text',
+        help='The format of log output: plain text, or one JSON object\n'
+             'per line.')
+
     if args is None:
         args = sys.argv[1:]
 
@@ -72,14 +123,22 @@ def main():
     """
     try:
         opts = get_parsed_args()
+        configure_logging(json_lines=opts.log_format == 'json')
 
         port = opts.port
         do_advertise = opts.do_advertise
         voting_enabled = opts.voting_enabled
         votes_for_skip = opts.votes_for_skip
+        lookahead = opts.lookahead
+        state_store = (None if opts.state_dir is None else
+                       JournalStateStore(opts.state_dir))
+        slow_trace_threshold = (None if opts.slow_trace_ms is None else
+                                opts.slow_trace_ms / 1000)
 
         server = SpotnetMasterServer(port, do_advertise,
-                                     voting_enabled, votes_for_skip)
+                                     voting_enabled, votes_for_skip,
+                                     lookahead, state_store,
+                                     opts.metrics_port, slow_trace_threshold)
 
         run_forever = server.get_run_forever_coro()
         asyncio.get_event_loop().run_until_complete(run_forever)
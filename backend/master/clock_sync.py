@@ -0,0 +1,113 @@
+"""NTP-style estimation of the clock offset between master and a slave."""
+
+import collections
+import math
+
+
+class ClockOffsetEstimator(object):
+
+    """Estimates a slave's clock offset from timestamped ping exchanges.
+
+    Each exchange yields four timestamps: ``t0`` when the master sent the
+    ping, ``t1`` when the slave received it, ``t2`` when the slave replied,
+    and ``t3`` when the master received the reply. As in NTP, the offset of
+    the slave clock is ``((t1 - t0) + (t2 - t3)) / 2`` and the round trip
+    delay is ``(t3 - t0) - (t2 - t1)``; the sample with the smallest delay
+    in the recent window is the least distorted by queuing, and its offset
+    is used.
+
+    Attributes:
+        last_start_error (float): The difference, in seconds, between the
+            master time at which the slave last started scheduled playback
+            and the time it was scheduled for; None until the first
+            scheduled start.
+
+    Args:
+        window (int): The number of recent samples to keep.
+
+    """
+
+    def __init__(self, window=8):
+        self.last_start_error = None
+
+        # (master receive time, offset, delay) for each recent exchange
+        self._samples = collections.deque(maxlen=window)
+
+    @property
+    def is_synced(self):
+        """bool: Whether at least one exchange has completed."""
+        return bool(self._samples)
+
+    @property
+    def offset(self):
+        """float: The slave clock minus the master clock, in seconds."""
+        return self._best()[1] if self._samples else 0.0
+
+    @property
+    def rtt(self):
+        """float: The smallest recent round trip delay, in seconds."""
+        return self._best()[2] if self._samples else 0.0
+
+    @property
+    def jitter(self):
+        """float: The RMS deviation of recent offsets, in seconds."""
+        if len(self._samples) < 2:
+            return 0.0
+
+        offset = self.offset
+        return math.sqrt(sum((o - offset) ** 2 for _, o, _ in self._samples) /
+                         (len(self._samples) - 1))
+
+    @property
+    def drift(self):
+        """float: The least-squares drift of the offset, in seconds/second."""
+        if len(self._samples) < 2:
+            return 0.0
+
+        n = len(self._samples)
+        mean_t = sum(t for t, _, _ in self._samples) / n
+        mean_o = sum(o for _, o, _ in self._samples) / n
+        var_t = sum((t - mean_t) ** 2 for t, _, _ in self._samples)
+        if not var_t:
+            return 0.0
+
+        return sum((t - mean_t) * (o - mean_o)
+                   for t, o, _ in self._samples) / var_t
+
+    def add_sample(self, t0, t1, t2, t3):
+        """Record the timestamps of a completed ping exchange.
+
+        Args:
+            t0 (float): Master time at which the ping was sent.
+            t1 (float): Slave time at which the ping was received.
+            t2 (float): Slave time at which the reply was sent.
+            t3 (float): Master time at which the reply was received.
+
+        """
+        offset = ((t1 - t0) + (t2 - t3)) / 2
+        delay = (t3 - t0) - (t2 - t1)
+        self._samples.append((t3, offset, max(delay, 0.0)))
+
+    def to_slave_time(self, master_time):
+        """Convert a master clock time to the slave's clock."""
+        return master_time + self.offset
+
+    def to_master_time(self, slave_time):
+        """Convert a slave clock time to the master's clock."""
+        return slave_time - self.offset
+
+    def get_stats(self):
+        """Return the current estimates as a JSON-like dict, in ms."""
+        return {
+            'is-synced': self.is_synced,
+            'offset-ms': self.offset * 1000,
+            'jitter-ms': self.jitter * 1000,
+            'rtt-ms': self.rtt * 1000,
+            'drift-ppm': self.drift * 1e6,
+            'last-start-error-ms': (None if self.last_start_error is None
+                                    else self.last_start_error * 1000)
+        }
+
+    def _best(self):
+        """Return the recent sample with the smallest round trip delay."""
+        return min(self._samples, key=lambda sample: sample[2])
@@ -2,3 +2,62 @@
 
 
 SPOTNET_MASTER_LOGGER_NAME = 'SPOTNET MASTER'
+
+# the maximum number of commands that may be waiting on a single slave
+SLAVE_COMMAND_QUEUE_SIZE = 32
+
+# the number of seconds a slave whose connection dropped may resume its
+# session before it is removed
+SESSION_RESUME_TIMEOUT = 60.0
+
+# the number of seconds a single slave command may run before it is abandoned
+SLAVE_COMMAND_TIMEOUT = 5.0
+
+# the number of seconds to wait for a slave to acknowledge a directive
+SLAVE_ACK_TIMEOUT = 3.0
+
+# the default number of seconds a group command waits on its slaves before
+# reporting the ones that have not finished as timed out
+GROUP_COMMAND_TIMEOUT = 5.0
+
+# the number of seconds between clock synchronization pings to each slave
+CLOCK_SYNC_INTERVAL = 2.0
+
+# the number of recent clock synchronization samples kept per slave
+CLOCK_SYNC_WINDOW = 8
+
+# the number of seconds, beyond the slowest slave's round trip, by which a
+# synchronized group play is scheduled ahead so that every slave gets the
+# directive before the start time
+SYNC_PLAY_MARGIN = 0.25
+
+# the maximum number of messages waiting to be written to a single web
+# client; a web client that falls further behind is resynced from a snapshot
+WEB_CLIENT_OUTBOX_SIZE = 256
+
+# the number of seconds the host web client has to answer a ping when
+# another web client asks for the host role; a host that does not answer is
+# disconnected and the role passed on
+HOST_PING_TIMEOUT = 5.0
+
+# the number of tracks at the front of each slave's queue included in state
+# snapshots; web clients request the rest with "get-queue-range"
+QUEUE_WINDOW_SIZE = 50
+
+# the most tracks returned for a single "get-queue-range" request
+MAX_QUEUE_RANGE = 500
+
+# the number of seconds over which skip votes are batched before the updated
+# tallies are sent to web clients
+VOTE_FLUSH_INTERVAL = 0.5
+
+# the number of seconds over which journal records of slave state are
+# batched before being written and synced to disk
+JOURNAL_FLUSH_INTERVAL = 1.0
+
+# the number of finished request traces kept for web clients to fetch
+TRACE_BUFFER_SIZE = 256
+
+# the number of journal records after which a snapshot of slave state is
+# written and the journal is compacted
+JOURNAL_SNAPSHOT_RECORDS = 50000
@@ -0,0 +1,312 @@
+"""Crash-safe persistence of slave state as snapshots plus a journal."""
+
+import asyncio
+import json
+import os
+
+from ..utils import get_codec, get_configured_logger
+from .config import (JOURNAL_FLUSH_INTERVAL, JOURNAL_SNAPSHOT_RECORDS,
+                     SPOTNET_MASTER_LOGGER_NAME)
+from .track_queue import TrackQueue
+
+
+SNAPSHOT_PREFIX = 'snapshot-'
+JOURNAL_PREFIX = 'journal-'
+
+
+def new_slave_state(uuid, first_connected_at):
+    """Return the persisted state of a slave that has just been added.
+
+    Persisted states are JSON-like dicts of the form::
+
+        {
+            'uuid': str,
+            'first-connected-at': str,
+            'name': str,
+            'version': int,
+            'queue-version': int,
+            'track-queue': TrackQueue
+        }
+
+    """
+    return {
+        'uuid': uuid,
+        'first-connected-at': first_connected_at,
+        'name': None,
+        'version': 0,
+        'queue-version': 0,
+        'track-queue': TrackQueue()
+    }
+
+
+def apply_patch(state, patch):
+    """Apply a patch recorded by a ``SpotnetSlaveClient`` to a persisted
+    slave state."""
+    op = patch['op']
+    queue = state['track-queue']
+
+    if op == 'queue-insert':
+        queue.insert(patch['position'], patch['track'])
+    elif op == 'queue-insert-many':
+        queue.insert_many(patch['position'], patch['tracks'])
+    elif op == 'queue-remove':
+        queue.pop(patch['position'])
+    elif op == 'set-field':
+        if patch['field'] in state:
+            state[patch['field']] = patch['value']
+    else:
+        raise ValueError('Invalid patch op "{}".'.format(op))
+
+    state['version'] = patch['version']
+    if 'queue-version' in patch:
+        state['queue-version'] = patch['queue-version']
+
+
+class StateStore(object):
+
+    """A store for the state of slaves across master restarts.
+
+    Slaves are identified by their ``node-id``, which, unlike their UUID,
+    stays the same across connections. This base store keeps nothing, so
+    every master starts out with no slave state; subclasses persist it.
+
+    """
+
+    def load(self):
+        """Return the persisted states of slaves, keyed by node id.
+
+        Returns:
+            Dict{str:dict}: Persisted states, as in ``new_slave_state``.
+
+        """
+        return {}
+
+    def add_slave(self, node_id, uuid, first_connected_at):
+        """Record a slave that was seen for the first time."""
+
+    def append_patches(self, node_id, patches):
+        """Record patches popped from the slave with the given node id."""
+
+    @property
+    def needs_snapshot(self):
+        """bool: Whether ``write_snapshot`` should be called to compact."""
+        return False
+
+    def write_snapshot(self, states):
+        """Replace everything recorded so far with a snapshot of states.
+
+        Args:
+            states (Dict{str:dict}): The persisted state of every known
+                slave, keyed by node id.
+
+        """
+
+
+class JournalStateStore(StateStore):
+
+    """Persists slave state as a snapshot file plus an append-only journal.
+
+    Every patch is appended to the journal as a line of compact JSON. Lines
+    are buffered and written, then fsynced, in a batch at most
+    ``flush_interval`` seconds after the first of them, so a crash loses at
+    most that much of the latest state. The writes run in the event loop's
+    default executor.
+
+    Once ``snapshot_records`` lines have been appended, the store asks for a
+    snapshot, which starts a new generation: the snapshot is written to a
+    temporary file and atomically renamed into place, after which the
+    journal of the new generation is appended to and the files of older
+    generations are deleted. Loading reads the newest snapshot and replays
+    its journal, so replay never covers more than ``snapshot_records``
+    patches. A line torn by a crash at the end of the journal is truncated
+    away on load, so that later records are not appended onto it.
+
+    Attributes:
+        directory (str): The directory holding the snapshot and journal.
+        flush_interval (float): See the class description.
+        snapshot_records (int): See the class description.
+        logger (logging.Logger): A logger instance for this store.
+
+    """
+
+    def __init__(self, directory, flush_interval=JOURNAL_FLUSH_INTERVAL,
+                 snapshot_records=JOURNAL_SNAPSHOT_RECORDS):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.snapshot_records = snapshot_records
+        self.logger = get_configured_logger(SPOTNET_MASTER_LOGGER_NAME)
+
+        self._codec = get_codec('json')
+        self._generation = 0
+        self._records = 0
+        self._lines = []
+        self._flush = None
+        self._write_lock = asyncio.Lock()
+
+    @property
+    def needs_snapshot(self):
+        return self._records >= self.snapshot_records
+
+    def load(self):
+        os.makedirs(self.directory, exist_ok=True)
+
+        generations = [int(name[len(SNAPSHOT_PREFIX):].split('.')[0])
+                       for name in os.listdir(self.directory)
+                       if name.startswith(SNAPSHOT_PREFIX) and
+                       name.endswith('.json')]
+        self._generation = max(generations, default=0)
+
+        states = {}
+        snapshot_path = self._path(SNAPSHOT_PREFIX, '.json')
+        if os.path.exists(snapshot_path):
+            with open(snapshot_path, 'rb') as f:
+                snapshot = self._codec.decode(f.read())
+            for node_id, state in snapshot['slaves'].items():
+                state['track-queue'] = TrackQueue(state['track-queue'])
+                states[node_id] = state
+
+        journal_path = self._path(JOURNAL_PREFIX, '.log')
+        if os.path.exists(journal_path):
+            with open(journal_path, 'rb+') as f:
+                data = f.read()
+                end = data.rfind(b'\n') + 1
+                if end < len(data):
+                    self.logger.warn('Truncating a torn record of {} bytes '
+                                     'from the end of the journal.'.format(
+                                         len(data) - end))
+                    f.truncate(end)
+                    f.flush()
+                    os.fsync(f.fileno())
+            lines = data[:end].splitlines()
+
+            for i, line in enumerate(lines):
+                try:
+                    self._replay(states, self._codec.decode(line))
+                except (IndexError, KeyError, ValueError):
+                    self.logger.warn('Skipping invalid journal record {0} '
+                                     'of {1}.'.format(i + 1, len(lines)))
+            self._records = len(lines)
+
+        return states
+
+    def add_slave(self, node_id, uuid, first_connected_at):
+        self._append(['slave', node_id, uuid, first_connected_at])
+
+    def append_patches(self, node_id, patches):
+        for patch in patches:
+            self._append(['patch', node_id, patch])
+
+    def write_snapshot(self, states):
+        payload = json.dumps({
+            'generation': self._generation + 1,
+            'slaves': {node_id: dict(state, **{
+                'track-queue': state['track-queue'].to_list()})
+                for node_id, state in states.items()}
+        }, separators=(',', ':'))
+
+        # lines not yet written belong to the generation being replaced, and
+        # are written to its journal in case the snapshot never lands
+        lines = self._lines
+        self._lines = []
+        self._generation += 1
+        self._records = 0
+
+        asyncio.ensure_future(self._write(
+            self._write_snapshot, self._generation, payload, lines))
+
+    def _append(self, record):
+        """Buffer a journal record, scheduling a flush of the buffer."""
+        self._lines.append(json.dumps(record, separators=(',', ':')))
+        self._records += 1
+
+        if self._flush is None:
+            self._flush = asyncio.ensure_future(self._flush_later())
+
+    @asyncio.coroutine
+    def _flush_later(self):
+        """Coroutine to write the buffered records after a delay."""
+        yield from asyncio.sleep(self.flush_interval)
+        self._flush = None
+
+        lines = self._lines
+        self._lines = []
+        if lines:
+            yield from self._write(self._write_journal, self._generation,
+                                   lines)
+
+    @asyncio.coroutine
+    def _write(self, func, *args):
+        """Coroutine to run a blocking write in the executor, in order."""
+        yield from self._write_lock.acquire()
+        try:
+            yield from asyncio.get_event_loop().run_in_executor(
+                None, func, *args)
+        except OSError as e:
+            self.logger.error('Failed to persist slave state: ' + repr(e))
+        finally:
+            self._write_lock.release()
+
+    def _write_journal(self, generation, lines):
+        """Append lines to the journal of a generation and fsync it."""
+        with open(self._path(JOURNAL_PREFIX, '.log', generation), 'a') as f:
+            f.write(''.join(line + '\n' for line in lines))
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _write_snapshot(self, generation, payload, lines):
+        """Atomically write the snapshot of a generation, then delete the
+        files of older generations."""
+        if lines:
+            self._write_journal(generation - 1, lines)
+
+        path = self._path(SNAPSHOT_PREFIX, '.json', generation)
+        with open(path + '.tmp', 'w') as f:
+            f.write(payload)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + '.tmp', path)
+        self._fsync_directory()
+
+        for name in os.listdir(self.directory):
+            for prefix in (SNAPSHOT_PREFIX, JOURNAL_PREFIX):
+                if (name.startswith(prefix) and
+                        int(name[len(prefix):].split('.')[0]) < generation):
+                    os.remove(os.path.join(self.directory, name))
+
+        self.logger.info('Wrote slave state snapshot {} and compacted the '
+                         'journal.'.format(generation))
+
+    def _fsync_directory(self):
+        """Make a rename in the store's directory durable, where possible."""
+        try:
+            fd = os.open(self.directory, os.O_RDONLY)
+        except OSError:
+            return
+
+        try:
+            os.fsync(fd)
+        except OSError:
+            pass
+        finally:
+            os.close(fd)
+
+    def _path(self, prefix, ext, generation=None):
+        """Return the path of a file of the current or given generation."""
+        if generation is None:
+            generation = self._generation
+        return os.path.join(self.directory,
+                            '{0}{1:08d}{2}'.format(prefix, generation, ext))
+
+    @staticmethod
+    def _replay(states, record):
+        """Apply a journal record to the loaded states."""
+        if record[0] == 'slave':
+            _, node_id, uuid, first_connected_at = record
+            states[node_id] = new_slave_state(uuid, first_connected_at)
+        elif record[0] == 'patch':
+            # a snapshot can include patches that were journaled after it,
+            # which carry versions it is already at
+            _, node_id, patch = record
+            if (node_id in states and
+                    patch['version'] > states[node_id]['version']):
+                apply_patch(states[node_id], patch)
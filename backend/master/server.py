@@ -2,14 +2,47 @@
 
 import asyncio
 import json
+import time
 import websockets
 
 from websockets.exceptions import ConnectionClosed
 
-from ..utils import get_configured_logger
-from .config import SPOTNET_MASTER_LOGGER_NAME
+from ..utils import (get_codec, get_configured_logger, negotiate_codec,
+                     REGISTRY, serve_metrics)
+from .config import (GROUP_COMMAND_TIMEOUT, HOST_PING_TIMEOUT,
+                     MAX_QUEUE_RANGE, SESSION_RESUME_TIMEOUT,
+                     SPOTNET_MASTER_LOGGER_NAME, SYNC_PLAY_MARGIN,
+                     TRACE_BUFFER_SIZE, VOTE_FLUSH_INTERVAL)
+from .persistence import StateStore
 from .slave_client import SpotnetSlaveClient
-from .web_client import SpotnetWebClient
+from .tracing import TraceCollector
+from .voting import SkipVoteCounter
+from .web_client import (ALL_TOPICS, HOST_ROLE, parse_topic, queue_topic,
+                         QUEUE_TOPIC_PREFIX, slave_state_message, slave_topic,
+                         SLAVE_TOPIC_PREFIX, SpotnetWebClient, state_message,
+                         SUMMARY_TOPIC, summary_message, WebClientRegistry)
+
+
+_CONNECTIONS = REGISTRY.counter(
+    'spotnet_connections_total',
+    'WebSocket connections accepted by the master, by sender.', ('sender',))
+_REQUEST_SECONDS = REGISTRY.histogram(
+    'spotnet_request_seconds',
+    'Time taken by the master to handle a request, by the kind of peer that '
+    'sent it and its status.', ('sender', 'status'))
+_COMMAND_SECONDS = REGISTRY.histogram(
+    'spotnet_slave_command_seconds',
+    'Time from submitting a slave command to its completion, including its '
+    'wait in the slave\'s queue, by command.', ('command',))
+_COMMAND_FAILURES = REGISTRY.counter(
+    'spotnet_slave_command_failures_total',
+    'Slave commands that did not complete, by command and reason.',
+    ('command', 'reason'))
+
+# the web client requests that are traced through to the slaves' mopidy
+_TRACED_STATUSES = frozenset((
+    'send-credentials', 'add-track', 'add-tracks', 'remove-track',
+    'play-audio', 'pause-audio', 'group-command', 'vote-skip'))
 
 
 class SpotnetMasterServer(object):
@@ -26,31 +59,98 @@ class SpotnetMasterServer(object):
             the voting of tracks.
         votes_for_skip (int): The number of votes required to
             skip a song.
+        skip_votes (SkipVoteCounter): The votes cast by web clients to skip
+            the current track of each slave.
+        state_store (StateStore): The store that slave state is persisted
+            to, so that it survives restarts of the master.
+        detached_states (Dict{str:dict}): The persisted states of slaves
+            that are not connected, keyed by node id; a slave that connects
+            with one of these node ids takes its state over.
+        lookahead (int): The number of upcoming tracks each slave keeps
+            pre-loaded in mopidy, for gapless transitions between tracks.
+        metrics_port (int): The port on which to serve metrics over HTTP,
+            in the Prometheus text format; None to not serve them.
         slave_dict_by_uuid (Dict{str:SpotnetSlaveClient}): A dict mapping
             slave UUIDs to the appropriate client.
         slave_dict_by_ws (Dict{WebSocketServerProtocol:SpotnetSlaveClient}):
             Similar to the ``slave_dict_by_uuid`` attribute, but keyed by
             open WebSocket connections.
-        web_client_host_ws (WebSocketServerProtocol): The WebSocket
-            representing the current connection from the host of the
-            application; i.e., the user that has unlimited privileges for
-            modifying data. There may only be one of these connections per
-            time with the master server, so this object also acts as a kind of
-            lock.
+        slave_dict_by_token (Dict{str:SpotnetSlaveClient}): Similar to the
+            ``slave_dict_by_uuid`` attribute, but keyed by session token. A
+            slave whose connection drops stays in it, and in
+            ``slave_dict_by_uuid``, for ``SESSION_RESUME_TIMEOUT`` seconds,
+            so that it can resume its session.
+        web_clients (WebClientRegistry): The connected web clients. At most
+            one of them, the host of the application, has unlimited
+            privileges for modifying data; the rest are read-only guests.
+            State updates are broadcast to the web clients subscribed to
+            topics that carry them.
+        last_start_skew (float): The spread, in seconds, between the
+            earliest and latest start of the last synchronized group play;
+            None until one has run on at least two slaves.
+        traces (TraceCollector): The traces of recent web client requests
+            that acted on slaves. Each such request is given a correlation
+            id, or keeps the ``trace-id`` the web client sent with it, which
+            is carried on the directives sent to slaves on its behalf; web
+            clients fetch the finished traces with ``get-traces`` requests.
         logger (logging.Logger): A logger instance for this server.
 
     """
 
     def __init__(self, port, do_advertise, voting_enabled,
-                 votes_for_skip):
+                 votes_for_skip, lookahead=0, state_store=None,
+                 metrics_port=None, slow_trace_threshold=None):
         self.port = port
+        self.metrics_port = metrics_port
         self.do_advertise = do_advertise
         self.voting_enabled = voting_enabled
         self.votes_for_skip = votes_for_skip
+        self.lookahead = lookahead
         self.slave_dict_by_uuid = {}
         self.slave_dict_by_ws = {}
-        self.web_client_host_ws = None
+        self.slave_dict_by_token = {}
+        self.web_clients = WebClientRegistry()
+        self.last_start_skew = None
+        self.skip_votes = SkipVoteCounter(votes_for_skip)
+        self.state_store = StateStore() if state_store is None else state_store
         self.logger = get_configured_logger(SPOTNET_MASTER_LOGGER_NAME)
+        self.traces = TraceCollector(TRACE_BUFFER_SIZE, slow_trace_threshold,
+                                     self.logger)
+
+        started = time.perf_counter()
+        self.detached_states = self.state_store.load()
+        if self.detached_states:
+            self.logger.info('Restored the state of {0} slave(s) in {1:.1f} '
+                             'ms.'.format(len(self.detached_states),
+                                          (time.perf_counter() - started) *
+                                          1000))
+
+        # the pending task that publishes the changed skip vote tallies
+        self._vote_flush = None
+
+        # session token -> task that removes the suspended slave
+        self._session_expiries = {}
+
+        REGISTRY.gauge_callback(
+            'spotnet_slaves_connected', 'Slaves with a live connection.',
+            lambda: len(self.slave_dict_by_ws))
+        REGISTRY.gauge_callback(
+            'spotnet_slaves_suspended',
+            'Slaves whose dropped sessions may still be resumed.',
+            lambda: len(self._session_expiries))
+        REGISTRY.gauge_callback(
+            'spotnet_web_clients_connected', 'Connected web clients.',
+            lambda: len(self.web_clients))
+        REGISTRY.gauge_callback(
+            'spotnet_slave_command_backlog',
+            'Commands waiting to run, summed over every slave.',
+            lambda: sum(slave.command_backlog for slave in
+                        self.slave_dict_by_uuid.values()))
+        REGISTRY.gauge_callback(
+            'spotnet_web_client_outbox_depth',
+            'Messages waiting to be written, summed over every web client.',
+            lambda: sum(web_client.outbox_depth for web_client in
+                        self.web_clients))
 
     def get_run_forever_coro(self):
         """Get a Task to run this server."""
@@ -65,6 +165,13 @@ class SpotnetMasterServer(object):
             self.logger.info('Skipping service advertisement.')
             run_forever_coro = asyncio.async(ws_coro)
 
+        if self.metrics_port is not None:
+            self.logger.info('Serving metrics on port {}.'
+                             .format(self.metrics_port))
+            run_forever_coro = asyncio.gather(
+                run_forever_coro,
+                asyncio.async(serve_metrics(self.metrics_port)))
+
         return run_forever_coro
 
     @asyncio.coroutine
@@ -74,10 +181,28 @@ class SpotnetMasterServer(object):
             data = yield from ws.recv()
             json_dict = json.loads(data)
             sender = json_dict.get('sender')
+            if sender in ('slave', 'web-client'):
+                _CONNECTIONS.labels(sender).inc()
+
+            # peers that list the codecs they support are told which one to
+            # switch to; older peers list none and stay on plain JSON
+            codec = negotiate_codec(json_dict.get('codecs'))
+            if 'codecs' in json_dict:
+                yield from ws.send(json.dumps({
+                    'status': 'codec-selected',
+                    'sender': 'master',
+                    'data': {
+                        'codec': codec
+                    }}))
+                self.logger.info('Selected "{}" codec for new connection.'
+                                 .format(codec))
+
             if sender == 'slave':
-                yield from self._handle_slave_connection(ws, json_dict)
+                yield from self._handle_slave_connection(
+                    ws, json_dict, codec)
             elif sender == 'web-client':
-                yield from self._handle_web_client_connection(ws, json_dict)
+                yield from self._handle_web_client_connection(
+                    ws, json_dict, codec)
             elif sender is None:
                 raise ValueError('No "sender" entry in request.')
             else:
@@ -90,25 +215,30 @@ class SpotnetMasterServer(object):
             self.logger.error('Received unexpected error: ' + repr(e))
         finally:
             if ws in self.slave_dict_by_ws:
-                ws_uuid = self.slave_dict_by_ws[ws].uuid
+                slave = self.slave_dict_by_ws.pop(ws)
 
-                self.logger.info('Cleaning up slave WebSocket with uuid {}.'
-                                 .format(ws_uuid))
+                self.logger.info('Suspending session of slave with uuid {0} '
+                                 'for {1} seconds.'.format(
+                                     slave.uuid, SESSION_RESUME_TIMEOUT))
 
-                self.slave_dict_by_ws.pop(ws, None)
-                self.slave_dict_by_uuid.pop(ws_uuid, None)
-
-                if self.web_client_host_ws is not None:
-                    # we need to notify the web client of the disonnected slave
-                    yield from self.web_client_host_ws.remove_slave(ws_uuid)
-                    self.logger.info('Sent web client notice to remove slave '
-                                     'with uuid {}.'.format(ws_uuid))
+                slave.suspend()
+                self._session_expiries[slave.session_token] = (
+                    asyncio.ensure_future(self._expire_session(slave)))
             else:
-                self.logger.info('Web client WebSocket disconnected.')
-                self.web_client_host_ws = None
+                web_client = self.web_clients.remove(ws)
+                if web_client is not None:
+                    self.logger.info(
+                        'Web client WebSocket with role "{0}" disconnected; '
+                        '{1} web client(s) remain.'
+                        .format(web_client.role, len(self.web_clients)))
+
+                promoted = self.web_clients.promote_host()
+                if promoted is not None:
+                    self.logger.info('Promoted a guest web client to host.')
+                    yield from promoted.send_role(HOST_ROLE)
 
     @asyncio.coroutine
-    def _handle_web_client_connection(self, ws, json_dict):
+    def _handle_web_client_connection(self, ws, json_dict, codec):
         """Coroutine to handle a WebSocket connection from the web client.
 
         Args:
@@ -116,112 +246,194 @@ class SpotnetMasterServer(object):
                 slave WebSocket connection.
             json_dict (dict): The JSON-like dict that was sent when this
                 connection was initially open (on the first recv).
+            codec (str): The name of the codec negotiated for the connection.
+
+        Web clients receive the full stream of state updates unless they
+        list narrower ``topics`` in their first message, or later send
+        ``subscribe`` and ``unsubscribe`` requests. A snapshot of each topic
+        is sent when it is subscribed to.
+
+        Requests that act on slaves are traced; their trace is finished
+        once the request and every slave command it submitted are done.
 
         """
-        self.logger.info('Received connection from web client.')
+        topics = json_dict.get('topics', [ALL_TOPICS])
+        for topic in topics:
+            parse_topic(topic)
+
+        requested_role = json_dict.get('role', HOST_ROLE)
+        if requested_role == HOST_ROLE and self.web_clients.host is not None:
+            yield from self._check_host()
+
+        role = self.web_clients.assign_role(requested_role)
+        self.logger.info('Received connection from web client; assigning '
+                         'role "{}".'.format(role))
 
-        self.web_client_host_ws = SpotnetWebClient(ws)
+        web_client = SpotnetWebClient(ws, role, self._get_snapshots, topics,
+                                      requested_role)
+        web_client.codec = get_codec(codec)
+        self.web_clients.add(web_client)
 
-        state_json = self._get_state()
-        yield from self.web_client_host_ws.send_state(state_json)
+        yield from web_client.send_role(role)
+        for snapshot in self._get_snapshots(web_client):
+            yield from web_client.send_json(snapshot)
 
-        self.logger.info('Sent system state to web client.')
+        self.logger.info('Sent snapshots of topics {} to web client.'
+                         .format(sorted(web_client.topics)))
 
         while True:
-            resp = yield from self.web_client_host_ws.recv_json()
+            resp = yield from web_client.recv_json()
+            started = time.perf_counter()
             status = resp.get('status')
             data = resp.get('data')
 
+            # the traces of ignored requests are never finished, so they are
+            # not kept
+            trace = None
+            if status in _TRACED_STATUSES:
+                trace = self.traces.start('web-client:' + status,
+                                          resp.get('trace-id'))
+
             if status is None:
                 raise ValueError('No "status" key on web client request.')
+            elif status == 'request-state':
+                # a web client that detects a gap in a slave's patch versions
+                # resyncs through snapshots of its topics
+                for snapshot in self._get_snapshots(web_client):
+                    yield from web_client.send_json(snapshot)
+                self.logger.info('Re-sent topic snapshots to web client.')
+            elif status in ('subscribe', 'unsubscribe'):
+                yield from self._update_subscription(
+                    web_client, status, (data or {}).get('topics', []))
+            elif status == 'request-sync-stats':
+                yield from web_client.send_sync_stats(self._get_sync_stats())
+            elif status == 'get-queue-range':
+                yield from self._send_queue_range(web_client, data or {})
+            elif status == 'get-traces':
+                data = data or {}
+                yield from web_client.send_traces(self.traces.get_traces(
+                    data.get('trace-id'), data.get('limit')))
+            elif status == 'vote-skip':
+                self._cast_skip_vote(web_client, data or {}, trace)
+            elif web_client.role != HOST_ROLE:
+                # ignored requests are not timed, so that guests cannot add
+                # metrics for made-up statuses
+                self.logger.warn('Ignoring "{}" request from guest web '
+                                 'client.'.format(status))
+                yield from web_client.send_request_denied(
+                    status, 'Only the host web client may send "{}" '
+                    'requests.'.format(status))
+                continue
             elif data is None:
                 raise ValueError('No "data" key on web client request.')
-            elif status == 'send-credentials':
-                uuid = data['uuid']
-                slave = self.slave_dict_by_uuid[uuid]
-
-                yield from slave.send_credentials(
-                    data['name'], data['username'], data['password'])
-
+            elif status == 'group-command':
                 self.logger.info(
-                    'Sent credentials to slave with UUID {0}, assigning '
-                    'name {1}.'.format(uuid, slave.name))
+                    'Received "group-command" request from web client for '
+                    '"{}" command.'.format(data['command']))
+
+                task = asyncio.ensure_future(self._run_group_command(
+                    web_client, data, trace))
+                trace.hold()
+                task.add_done_callback(
+                    lambda _, trace=trace: trace.release())
+            elif status == 'send-credentials':
+                slave = self.slave_dict_by_uuid[data['uuid']]
+                self._submit_slave_command(
+                    slave, status, self._send_credentials, slave,
+                    data['name'], data['username'], data['password'],
+                    trace=trace)
             elif status == 'add-track':
-                uuid = data['uuid']
-                slave = self.slave_dict_by_uuid[uuid]
+                slave = self.slave_dict_by_uuid[data['uuid']]
 
                 self.logger.info(
                     'Received "add-track" request from web client for slave '
-                    'with UUID {}.'.format(uuid))
-
-                position = data['position']
-                track = data['track']
+                    'with UUID {}.'.format(slave.uuid))
 
-                yield from slave.add_track(track, position)
+                self._submit_slave_command(
+                    slave, status, self._add_track, slave, data['track'],
+                    data['position'], trace=trace)
+            elif status == 'add-tracks':
+                slave = self.slave_dict_by_uuid[data['uuid']]
 
                 self.logger.info(
-                    'Added track with uri "{0}" on slave with UUID {1}.'
-                    .format(track['uri'], uuid))
+                    'Received "add-tracks" request from web client for {0} '
+                    'tracks on slave with UUID {1}.'
+                    .format(len(data['tracks']), slave.uuid))
 
-                yield from self._send_slave_state(uuid)
+                self._submit_slave_command(
+                    slave, status, self._add_tracks, slave, data['tracks'],
+                    data['position'], trace=trace)
             elif status == 'remove-track':
-                uuid = data['uuid']
-                slave = self.slave_dict_by_uuid[uuid]
+                slave = self.slave_dict_by_uuid[data['uuid']]
 
                 self.logger.info(
-                    'Received "remove-track" request from web client for slave '
-                    'with UUID {}.'.format(uuid))
-
-                position = data['position']
-                if position >= len(slave.track_queue):
-                    self.logger.warn(
-                        'Received invalid "position" value {0} from web '
-                        'client when attempting to remove track on slave '
-                        'with UUID {1}.'.format(position, uuid))
-                else:
-                    yield from slave.remove_track(position)
-                    self.logger.info('Sent "remove-track" request to slave '
-                                     'with UUID {}.'.format(uuid))
+                    'Received "remove-track" request from web client for '
+                    'slave with UUID {}.'.format(slave.uuid))
 
-                yield from self._send_slave_state(uuid)
+                self._submit_slave_command(
+                    slave, status, self._remove_track, slave,
+                    data['position'], trace=trace)
             elif status == 'play-audio':
-                uuid = data['uuid']
-                slave = self.slave_dict_by_uuid[uuid]
+                slave = self.slave_dict_by_uuid[data['uuid']]
 
                 self.logger.info('Received "play-audio" request from web '
-                                 'client with UUID {}.'.format(uuid))
-
-                yield from slave.send_play()
+                                 'client with UUID {}.'.format(slave.uuid))
 
-                self.logger.info('Sent play request to slave with UUID {}'
-                                 .format(uuid))
-
-                slave.is_paused = False
-                yield from self._send_slave_state(uuid)
-
-                self.logger.info('Sent slave state for UUID {} back to web '
-                                 'client'.format(uuid))
+                self._submit_slave_command(
+                    slave, status, self._play_audio, slave, trace=trace)
+            elif status == 'get-slave-log':
+                asyncio.ensure_future(self._send_slave_log(web_client, data))
             elif status == 'pause-audio':
-                uuid = data['uuid']
-                slave = self.slave_dict_by_uuid[uuid]
+                slave = self.slave_dict_by_uuid[data['uuid']]
 
                 self.logger.info('Received "pause-audio" request from web '
-                                 'client with UUID {}.'.format(uuid))
-
-                yield from slave.send_pause()
+                                 'client with UUID {}.'.format(slave.uuid))
 
-                self.logger.info('Sent pause request to slave UUID {} back '
-                                 'to web client'.format(uuid))
-
-                slave.is_paused = True
-                yield from self._send_slave_state(uuid)
+                self._submit_slave_command(
+                    slave, status, self._pause_audio, slave, trace=trace)
             else:
                 raise ValueError(
                     'Invalid "status" key "{}" received from web client.'
                     .format(status))
 
+            _REQUEST_SECONDS.labels('web-client', status).observe(
+                time.perf_counter() - started)
+
+            if trace is not None:
+                trace.add_span('master:request', trace.started_at,
+                               asyncio.get_event_loop().time())
+                trace.release()
+
+    @asyncio.coroutine
+    def _check_host(self):
+        """Coroutine to disconnect the host web client if it does not
+        answer a ping within ``HOST_PING_TIMEOUT`` seconds.
+
+        A host whose connection is half-open would otherwise keep the host
+        role until TCP gives up on it.
+
+        """
+        host = self.web_clients.host
+
+        @asyncio.coroutine
+        def ping():
+            pong = yield from host.ws.ping()
+            yield from pong
+
+        try:
+            yield from asyncio.wait_for(ping(), HOST_PING_TIMEOUT)
+            return
+        except asyncio.TimeoutError:
+            self.logger.warn('Host web client did not answer a ping; '
+                             'disconnecting it.')
+        except ConnectionClosed:
+            pass
+
+        if self.web_clients.remove(host.ws) is host:
+            asyncio.ensure_future(host.ws.close())
+
     @asyncio.coroutine
-    def _handle_slave_connection(self, ws, json_dict):
+    def _handle_slave_connection(self, ws, json_dict, codec):
         """Coroutine to handle a WebSocket connection from a slave server.
 
         Args:
@@ -229,38 +441,46 @@ class SpotnetMasterServer(object):
                 slave WebSocket connection.
             json_dict (dict): The JSON-like dict that was sent when this
                 connection was initially open (on the first recv).
+            codec (str): The name of the codec negotiated for the connection.
 
         """
         self.logger.info('Received connection from slave server.')
 
-        slave = SpotnetSlaveClient(ws)
-        self.slave_dict_by_ws[ws] = slave
-        self.slave_dict_by_uuid[slave.uuid] = slave
-
-        self.logger.info('Generated slave with UUID {}.'.format(slave.uuid))
-
-        if self.web_client_host_ws is not None:
-            # need to notify web client of newly connected slave
-            yield from self.web_client_host_ws.add_slave(slave.get_state())
-            self.logger.info('Sent request to web client to add slave.')
+        slave = self.slave_dict_by_token.get(json_dict.get('session-token'))
+        if slave is not None:
+            yield from self._resume_session(slave, ws, codec)
+        else:
+            slave = yield from self._start_session(ws, json_dict, codec)
 
-        while True:
+        # the session moves on if the slave resumes it on another connection
+        while slave.ws is ws:
             resp = yield from slave.recv_json()
+            started = time.perf_counter()
             status = resp.get('status')
 
             if status == 'login-passed':
                 self.logger.info('Login passed on slave with UUID {}.'
                                  .format(slave.uuid))
 
+                metrics = (resp.get('data') or {}).get('mopidy')
+                if metrics is not None:
+                    self.logger.info('mopidy startup on slave with UUID {0}: '
+                                     '{1}'.format(slave.uuid, metrics))
+
                 slave.is_connected = True
 
-                if self.web_client_host_ws is not None:
-                    yield from self.web_client_host_ws.send_login_passed(
+                yield from self.web_clients.subscribed(
+                    ALL_TOPICS, slave_topic(slave.uuid)).send_login_passed(
                         slave.uuid)
-                    self.logger.info('Notified web client of passed login.')
+                self.logger.info('Notified web clients of passed login.')
+
+                yield from self._send_slave_patches(slave.uuid)
 
-                yield from self.web_client_host_ws.send_slave_state(
-                    slave.get_state())
+                # a restored queue is only loaded into mopidy once it can
+                # look up Spotify tracks
+                if slave.track_queue:
+                    self._submit_slave_command(
+                        slave, 'sync-tracklist', slave.sync_tracklist)
             elif status == 'login-failed':
                 self.logger.info('Login failed on slave with UUID {}.'
                                  .format(slave.uuid))
@@ -268,30 +488,641 @@ class SpotnetMasterServer(object):
                 slave.is_connected = False
                 slave.name = None
 
-                if self.web_client_host_ws is not None:
-                    yield from self.web_client_host_ws.send_login_failed(
+                yield from self.web_clients.subscribed(
+                    ALL_TOPICS, slave_topic(slave.uuid)).send_login_failed(
                         slave.uuid)
-                    self.logger.info('Notified web client of failed login.')
+                self.logger.info('Notified web clients of failed login.')
+
+                yield from self._send_slave_patches(slave.uuid)
+            elif status == 'mopidy-restarted':
+                data = resp.get('data') or {}
+                self.logger.warn(
+                    'mopidy was restarted on slave with UUID {0}; restoring '
+                    'playback at {1} ms.'.format(
+                        slave.uuid, data.get('time-position')))
+
+                self._submit_slave_command(
+                    slave, 'restore-playback', slave.restore_playback,
+                    data.get('time-position'))
             elif status == 'track-ended':
                 self.logger.info('Received "track-ended" indication from '
                                  'slave with UUID {}.'.format(slave.uuid))
 
-                yield from slave.remove_track(0, from_transition=True)
-                yield from self._send_slave_state(slave.uuid)
+                data = resp.get('data', {})
+                self._submit_slave_command(
+                    slave, status, self._end_track, slave, data.get('uri'),
+                    data.get('tlid'))
+            elif status == 'ack':
+                slave.resolve_ack(resp['data'])
+            elif status == 'clock-pong':
+                slave.handle_clock_pong(resp['data'])
             elif status is None:
                 raise ValueError('No "status" key in slave request.')
             else:
                 raise ValueError('Invalid "status" key in slave request.')
 
+            _REQUEST_SECONDS.labels('slave', status).observe(
+                time.perf_counter() - started)
+
     @asyncio.coroutine
-    def _send_slave_state(self, uuid):
-        """Coroutine to send slave's state to web client."""
-        slave = self.slave_dict_by_uuid[uuid]
-        yield from self.web_client_host_ws.send_slave_state(
-            slave.get_state())
+    def _start_session(self, ws, json_dict, codec):
+        """Coroutine to register a newly connected slave.
 
-        self.logger.info('Sent updated state back to web client for slave '
-                         'with UUID {}.'.format(uuid))
+        The slave is sent the token with which it can resume its session
+        over a later connection.
+
+        Args:
+            websocket (websockets.server.WebSocketServerProtocol): The open
+                slave WebSocket connection.
+            json_dict (dict): The JSON-like dict that was sent when this
+                connection was initially open (on the first recv).
+            codec (str): The name of the codec negotiated for the connection.
+
+        Returns:
+            SpotnetSlaveClient: The client for the new slave.
+
+        """
+        node_id = json_dict.get('node-id')
+        slave = SpotnetSlaveClient(ws, self.lookahead, node_id)
+        slave.codec = get_codec(codec)
+
+        state = self._attach_slave(node_id)
+        if state is not None:
+            slave.restore(state)
+            self.logger.info('Restored state of slave node {0} with {1} '
+                             'queued track(s).'.format(
+                                 node_id, len(slave.track_queue)))
+        elif node_id is not None:
+            self.state_store.add_slave(node_id, slave.uuid,
+                                       slave.first_connected_at)
+
+        self.slave_dict_by_ws[ws] = slave
+        self.slave_dict_by_uuid[slave.uuid] = slave
+        self.slave_dict_by_token[slave.session_token] = slave
+
+        self.logger.info('Generated slave with UUID {}.'.format(slave.uuid))
+
+        yield from slave.send_json({
+            'status': 'session-started',
+            'sender': 'master',
+            'data': {
+                'uuid': slave.uuid,
+                'token': slave.session_token
+            }})
+
+        slave.start_worker()
+        slave.start_clock_sync()
+
+        # need to notify web clients of newly connected slave
+        yield from self.web_clients.subscribed(ALL_TOPICS).add_slave(
+            slave.get_encoded_state())
+        yield from self.web_clients.subscribed(
+            SUMMARY_TOPIC).send_slave_summary(slave.get_summary())
+        self.logger.info('Sent request to web clients to add slave.')
+
+        return slave
+
+    @asyncio.coroutine
+    def _resume_session(self, slave, ws, codec):
+        """Coroutine to continue a slave's session on a new connection.
+
+        The slave's previous connection may not have been noticed as
+        dropped yet, in which case it is closed and forgotten.
+
+        Args:
+            slave (SpotnetSlaveClient): The slave whose token was presented.
+            ws (websockets.server.WebSocketServerProtocol): The new
+                connection with the slave.
+            codec (str): The name of the codec negotiated for the connection.
+
+        """
+        expiry = self._session_expiries.pop(slave.session_token, None)
+        if expiry is not None:
+            expiry.cancel()
+
+        old_ws = slave.ws
+        if self.slave_dict_by_ws.pop(old_ws, None) is not None:
+            slave.suspend()
+            asyncio.ensure_future(old_ws.close())
+
+        self.slave_dict_by_ws[ws] = slave
+        yield from slave.resume(ws, get_codec(codec))
+
+        self.logger.info('Resumed session of slave with UUID {}.'
+                         .format(slave.uuid))
+
+    @asyncio.coroutine
+    def _expire_session(self, slave):
+        """Coroutine to remove a suspended slave that did not resume."""
+        yield from asyncio.sleep(SESSION_RESUME_TIMEOUT)
+        self._session_expiries.pop(slave.session_token, None)
+
+        self.logger.info('Session of slave with UUID {} expired.'
+                         .format(slave.uuid))
+        yield from self._remove_slave(slave)
+
+    @asyncio.coroutine
+    def _remove_slave(self, slave):
+        """Coroutine to forget a slave whose session ended."""
+        slave.stop_worker()
+        slave.stop_clock_sync()
+
+        self.slave_dict_by_uuid.pop(slave.uuid, None)
+        self.slave_dict_by_token.pop(slave.session_token, None)
+        self.skip_votes.remove_slave(slave.uuid)
+        self._detach_slave(slave)
+
+        # we need to notify the web clients of the disonnected slave
+        yield from self.web_clients.subscribed(
+            ALL_TOPICS, SUMMARY_TOPIC, slave_topic(slave.uuid),
+            queue_topic(slave.uuid)).remove_slave(slave.uuid)
+        self.logger.info('Sent web clients notice to remove slave with uuid '
+                         '{}.'.format(slave.uuid))
+
+    def _submit_slave_command(self, slave, name, coro_func, *args,
+                              trace=None):
+        """Queue a command on a slave's worker, logging its outcome.
+
+        Args:
+            slave (SpotnetSlaveClient): The slave to run the command on.
+            name (str): A name for the command, used in log messages.
+            coro_func (Callable): The coroutine function implementing the
+                command.
+            *args: The arguments to call ``coro_func`` with.
+            trace (Trace): An optional trace to record the command on; it
+                is held until the command is done.
+
+        Returns:
+            asyncio.Future: The future for the submitted command, or None if
+                the slave's command queue was full and the command was
+                dropped.
+
+        """
+        try:
+            future = slave.submit(coro_func, *args, trace=trace)
+        except asyncio.QueueFull:
+            self.logger.warn('Command queue for slave with UUID {0} is full; '
+                             'dropping "{1}" command.'.format(slave.uuid,
+                                                              name))
+            _COMMAND_FAILURES.labels(name, 'dropped').inc()
+            return None
+
+        submitted_at = time.perf_counter()
+        if trace is not None:
+            trace.hold()
+
+        def log_result(future):
+            if future.cancelled():
+                self.logger.info('"{0}" command cancelled on slave with UUID '
+                                 '{1}.'.format(name, slave.uuid))
+                _COMMAND_FAILURES.labels(name, 'cancelled').inc()
+            elif isinstance(future.exception(), asyncio.TimeoutError):
+                self.logger.error('"{0}" command timed out on slave with '
+                                  'UUID {1}.'.format(name, slave.uuid))
+                _COMMAND_FAILURES.labels(name, 'timeout').inc()
+            elif future.exception() is not None:
+                self.logger.error('"{0}" command failed on slave with UUID '
+                                  '{1}: {2}'.format(name, slave.uuid,
+                                                    repr(future.exception())))
+                _COMMAND_FAILURES.labels(name, 'error').inc()
+            else:
+                _COMMAND_SECONDS.labels(name).observe(
+                    time.perf_counter() - submitted_at)
+
+            if trace is not None:
+                trace.release()
+
+        future.add_done_callback(log_result)
+        return future
+
+    @asyncio.coroutine
+    def _run_group_command(self, web_client, data, trace=None):
+        """Coroutine to run a command on a group of slaves concurrently.
+
+        The command is submitted to every slave's command queue at once and
+        the slaves are awaited together, so the whole group finishes in
+        about the time of its slowest member. A single aggregated
+        ``group-command-result`` is then sent back to the web client.
+
+        Only slaves that are logged in and online take part; ``'all'``
+        expands to those, and other requested slaves are reported as
+        failed. Commands not done within the timeout are cancelled and
+        reported as timed out.
+
+        Unless its ``synchronized`` argument is false, a group
+        ``play-audio`` is scheduled to start at a single master clock time,
+        far enough ahead for the directive to reach the slowest slave; each
+        slave waits for that time on its own clock before starting mopidy.
+
+        Args:
+            web_client (SpotnetWebClient): The web client that sent the
+                command, to which the result is reported.
+            data (dict): The ``data`` of the ``group-command`` request, of the
+                form::
+
+                    {
+                        'command': str,
+                        'uuids': List[str] or 'all',
+                        'args': dict,
+                        'timeout': float,
+                        'request-id': any
+                    }
+
+            trace (Trace): An optional trace to record the slaves' commands
+                on.
+
+        """
+        command = data['command']
+        args = data.get('args', {})
+        uuids = data.get('uuids', 'all')
+        if uuids == 'all':
+            uuids = [uuid for uuid, slave in self.slave_dict_by_uuid.items()
+                     if slave.is_connected and slave.is_online]
+
+        if command == 'play-audio' and args.get('synchronized', True):
+            args = dict(args, at=self._schedule_group_start(uuids))
+
+        futures = {}
+        failed = []
+        for uuid in uuids:
+            slave = self.slave_dict_by_uuid.get(uuid)
+            future = None
+            if slave is None:
+                self.logger.warn('No slave with UUID {} for group command.'
+                                 .format(uuid))
+            elif not (slave.is_connected and slave.is_online):
+                self.logger.warn('Slave with UUID {} is not logged in and '
+                                 'online; skipping group command.'
+                                 .format(uuid))
+            else:
+                try:
+                    coro_func, coro_args = self._get_group_command(
+                        slave, command, args)
+                except (KeyError, ValueError) as e:
+                    self.logger.warn('Invalid group command: ' + repr(e))
+                else:
+                    future = self._submit_slave_command(
+                        slave, command, coro_func, *coro_args, trace=trace)
+
+            if future is None:
+                failed.append(uuid)
+            else:
+                futures[future] = uuid
+
+        succeeded = []
+        timed_out = []
+        started_at = []
+        if futures:
+            done, pending = yield from asyncio.wait(
+                futures, timeout=data.get('timeout', GROUP_COMMAND_TIMEOUT))
+
+            for future in done:
+                if future.cancelled():
+                    failed.append(futures[future])
+                elif isinstance(future.exception(), asyncio.TimeoutError):
+                    timed_out.append(futures[future])
+                elif future.exception() is not None:
+                    failed.append(futures[future])
+                else:
+                    succeeded.append(futures[future])
+                    if command == 'play-audio' and future.result() is not None:
+                        started_at.append(future.result())
+
+            # commands still waiting or running are cancelled, so that none
+            # of them takes effect after being reported as timed out
+            for future in pending:
+                future.cancel()
+                timed_out.append(futures[future])
+
+        self.logger.info(
+            'Group "{0}" command finished: {1} succeeded, {2} failed, {3} '
+            'timed out.'.format(command, len(succeeded), len(failed),
+                                len(timed_out)))
+
+        if 'at' in args and len(started_at) > 1:
+            self.last_start_skew = max(started_at) - min(started_at)
+            self.logger.info('Synchronized play started with a skew of '
+                             '{:.1f} ms.'.format(self.last_start_skew * 1000))
+
+        if web_client in self.web_clients:
+            yield from web_client.send_group_command_result(
+                data.get('request-id'), command, succeeded, failed,
+                timed_out)
+
+    def _schedule_group_start(self, uuids):
+        """Return the master clock time at which to start a group play.
+
+        The start is put off by the largest round trip time among the
+        slaves, plus ``SYNC_PLAY_MARGIN`` seconds.
+
+        Args:
+            uuids (List[str]): The UUIDs of the slaves in the group.
+
+        Returns:
+            float: A time on the master's event loop clock.
+
+        """
+        rtts = [self.slave_dict_by_uuid[uuid].clock.rtt for uuid in uuids
+                if uuid in self.slave_dict_by_uuid]
+        return (asyncio.get_event_loop().time() + max(rtts, default=0.0) +
+                SYNC_PLAY_MARGIN)
+
+    def _get_group_command(self, slave, command, args):
+        """Return the coroutine function and args for a group command.
+
+        Args:
+            slave (SpotnetSlaveClient): The slave to run the command on.
+            command (str): One of 'play-audio', 'pause-audio', 'add-track',
+                or 'add-tracks'.
+            args (dict): The command's arguments, keyed as in the
+                corresponding single-slave web client request.
+
+        Returns:
+            Tuple(Callable,tuple): The command's coroutine function and the
+                arguments to call it with.
+
+        Raises:
+            ValueError: If the command is not recognized.
+
+        """
+        if command == 'play-audio':
+            return self._play_audio, (slave, args.get('at'))
+        elif command == 'pause-audio':
+            return self._pause_audio, (slave,)
+        elif command == 'add-track':
+            return self._add_track, (slave, args['track'], args['position'])
+        elif command == 'add-tracks':
+            return self._add_tracks, (slave, args['tracks'], args['position'])
+        else:
+            raise ValueError('Invalid group command "{}".'.format(command))
+
+    @asyncio.coroutine
+    def _send_credentials(self, slave, name, username, password):
+        """Command to send credentials to a slave."""
+        yield from slave.send_credentials(name, username, password)
+
+        self.logger.info(
+            'Sent credentials to slave with UUID {0}, assigning name {1}.'
+            .format(slave.uuid, slave.name))
+
+        yield from self._send_slave_patches(slave.uuid)
+
+    @asyncio.coroutine
+    def _add_track(self, slave, track, position):
+        """Command to add a track to a slave's queue."""
+        yield from slave.add_track(track, position)
+
+        self.logger.info('Added track with uri "{0}" on slave with UUID {1}.'
+                         .format(track['uri'], slave.uuid))
+
+        yield from self._send_slave_patches(slave.uuid)
+
+    @asyncio.coroutine
+    def _add_tracks(self, slave, tracks, position):
+        """Command to add several tracks to a slave's queue at once."""
+        yield from slave.add_tracks(tracks, position)
+
+        self.logger.info('Added {0} tracks on slave with UUID {1}.'
+                         .format(len(tracks), slave.uuid))
+
+        yield from self._send_slave_patches(slave.uuid)
+
+    @asyncio.coroutine
+    def _remove_track(self, slave, position):
+        """Command to remove a track from a slave's queue."""
+        if position >= len(slave.track_queue):
+            self.logger.warn(
+                'Received invalid "position" value {0} from web client when '
+                'attempting to remove track on slave with UUID {1}.'
+                .format(position, slave.uuid))
+            return
+
+        yield from slave.remove_track(position)
+        self.logger.info('Sent "remove-track" request to slave with UUID {}.'
+                         .format(slave.uuid))
+
+        yield from self._send_slave_patches(slave.uuid)
+
+    @asyncio.coroutine
+    def _play_audio(self, slave, at=None):
+        """Command to resume audio playback on a slave.
+
+        Args:
+            slave (SpotnetSlaveClient): The slave to resume playback on.
+            at (float): The master clock time at which to start playback, or
+                None to start it immediately.
+
+        Returns:
+            float: The master clock time at which playback started, if the
+                slave reported it.
+
+        """
+        started_at = yield from slave.send_play(at)
+
+        self.logger.info('Sent play request to slave with UUID {}'
+                         .format(slave.uuid))
+
+        slave.is_paused = False
+        yield from self._send_slave_patches(slave.uuid)
+        return started_at
+
+    @asyncio.coroutine
+    def _pause_audio(self, slave):
+        """Command to pause audio playback on a slave."""
+        yield from slave.send_pause()
+
+        self.logger.info('Sent pause request to slave with UUID {}'
+                         .format(slave.uuid))
+
+        slave.is_paused = True
+        yield from self._send_slave_patches(slave.uuid)
+
+    @asyncio.coroutine
+    def _end_track(self, slave, uri, tlid):
+        """Command to transition a slave past its finished track.
+
+        mopidy also reports a track as ended when it is stopped or removed
+        by a queue edit; such notices name a track other than the head of
+        the queue and are ignored.
+
+        """
+        if not slave.track_queue:
+            return
+        elif not slave.is_current_track(uri, tlid):
+            self.logger.info('Ignoring "track-ended" for non-current track '
+                             'on slave with UUID {}.'.format(slave.uuid))
+            return
+
+        yield from slave.remove_track(0, from_transition=True)
+        yield from self._send_slave_patches(slave.uuid)
+
+    @asyncio.coroutine
+    def _skip_track(self, slave, track):
+        """Command to skip a track that was voted off a slave's queue.
+
+        Args:
+            slave (SpotnetSlaveClient): The slave to skip the track on.
+            track (dict): The track that was voted on; nothing is skipped if
+                it has already left the head of the queue.
+
+        """
+        if not slave.track_queue or slave.track_queue[0] is not track:
+            return
+
+        yield from slave.remove_track(0)
+        self.logger.info('Skipped track with uri "{0}" on slave with UUID '
+                         '{1} after {2} votes.'.format(
+                             track['uri'], slave.uuid, self.votes_for_skip))
+
+        yield from self._send_slave_patches(slave.uuid)
+
+    def _cast_skip_vote(self, web_client, data, trace=None):
+        """Count a web client's vote to skip the current track of a slave.
+
+        Any web client may vote, once per track. The updated tallies are
+        published at most once every ``VOTE_FLUSH_INTERVAL`` seconds, while
+        the vote that reaches ``votes_for_skip`` skips the track right away.
+
+        Args:
+            web_client (SpotnetWebClient): The voting web client.
+            data (dict): The ``data`` of the ``vote-skip`` request, of the
+                form ``{'uuid': str, 'uri': str}``; ``uri`` is optional.
+            trace (Trace): An optional trace to record the skip on.
+
+        """
+        if not self.voting_enabled:
+            self.logger.warn('Ignoring "vote-skip" request with voting '
+                             'disabled.')
+            return
+
+        slave = self.slave_dict_by_uuid.get(data.get('uuid'))
+        if slave is None:
+            self.logger.warn('Received "vote-skip" request for unknown slave '
+                             'with UUID {}.'.format(data.get('uuid')))
+            return
+
+        if self.skip_votes.cast(slave, web_client, data.get('uri')):
+            self._submit_slave_command(slave, 'skip-track', self._skip_track,
+                                       slave, slave.track_queue[0],
+                                       trace=trace)
+
+        if self._vote_flush is None:
+            self._vote_flush = asyncio.ensure_future(self._flush_skip_votes())
+
+    @asyncio.coroutine
+    def _flush_skip_votes(self):
+        """Coroutine to publish the skip vote tallies changed in the last
+        ``VOTE_FLUSH_INTERVAL`` seconds."""
+        yield from asyncio.sleep(VOTE_FLUSH_INTERVAL)
+        self._vote_flush = None
+
+        for uuid, track, count in self.skip_votes.pop_tallies():
+            slave = self.slave_dict_by_uuid.get(uuid)
+            if (slave is None or not slave.track_queue or
+                    slave.track_queue[0] is not track):
+                continue
+
+            slave.counted_votes_for_skip = count
+            yield from self._send_slave_patches(uuid)
+
+    @asyncio.coroutine
+    def _send_slave_patches(self, uuid):
+        """Coroutine to broadcast a slave's pending state patches.
+
+        Web clients subscribed to only the slave's details or only its queue
+        receive just the field or queue patches, respectively, and summary
+        subscribers receive the slave's updated summary instead.
+
+        Patches are always drained from the slave, even when no web client is
+        connected; a web client that connects later receives a full snapshot
+        that already includes them.
+
+        """
+        slave = self.slave_dict_by_uuid.get(uuid)
+        if slave is None:
+            return
+
+        patches = slave.pop_patches()
+        self._persist_patches(slave, patches)
+        if not patches or not self.web_clients:
+            return
+
+        every, fields, queues = self.web_clients.slave_subscribers(uuid)
+        yield from every.send_slave_patches(uuid, patches)
+
+        field_patches = [p for p in patches if p['op'] == 'set-field']
+        if field_patches:
+            yield from fields.send_slave_patches(uuid, field_patches)
+
+        queue_patches = [p for p in patches if p['op'] != 'set-field']
+        if queue_patches:
+            yield from queues.send_slave_patches(uuid, queue_patches)
+
+        yield from self.web_clients.subscribed(
+            SUMMARY_TOPIC).send_slave_summary(slave.get_summary())
+
+        self.logger.info('Sent {0} state patch(es) up to version {1} to {2} '
+                         'web client(s) for slave with UUID {3}.'
+                         .format(len(patches), patches[-1]['version'],
+                                 len(every) + len(fields) + len(queues),
+                                 uuid))
+
+    def _attach_slave(self, node_id):
+        """Return the persisted state for a newly connected slave node.
+
+        Args:
+            node_id (str): The node id the slave reported, or None.
+
+        Returns:
+            dict: The persisted state of the node, or None if it is unknown.
+                A session of the node that has not ended yet is ended, and
+                hands its state over, but not its UUID, which web clients are
+                told to remove.
+
+        """
+        if node_id is None:
+            return None
+
+        for other in list(self.slave_dict_by_uuid.values()):
+            if other.node_id == node_id:
+                other.node_id = None
+                other.stop_worker()
+                state = other.get_persisted_state()
+                del state['uuid']
+
+                expiry = self._session_expiries.pop(other.session_token, None)
+                if expiry is not None:
+                    expiry.cancel()
+                if self.slave_dict_by_ws.pop(other.ws, None) is not None:
+                    asyncio.ensure_future(other.ws.close())
+                asyncio.ensure_future(self._remove_slave(other))
+
+                return state
+
+        return self.detached_states.pop(node_id, None)
+
+    def _detach_slave(self, slave):
+        """Keep the persisted state of a disconnected slave for reuse."""
+        if slave.node_id is None:
+            return
+
+        self._persist_patches(slave, slave.pop_patches())
+        self.detached_states[slave.node_id] = slave.get_persisted_state()
+
+    def _persist_patches(self, slave, patches):
+        """Append a slave's patches to the state store, snapshotting the
+        state of every known slave when the store asks for it."""
+        if slave.node_id is None or not patches:
+            return
+
+        self.state_store.append_patches(slave.node_id, patches)
+        if self.state_store.needs_snapshot:
+            # suspended slaves are only kept in slave_dict_by_uuid
+            states = dict(self.detached_states)
+            states.update((other.node_id, other.get_persisted_state())
+                          for other in self.slave_dict_by_uuid.values()
+                          if other.node_id is not None)
+            self.state_store.write_snapshot(states)
 
     @asyncio.coroutine
     def _advertise(self):
@@ -299,13 +1130,148 @@ class SpotnetMasterServer(object):
         # TODO
         pass
 
+    @asyncio.coroutine
+    def _update_subscription(self, web_client, status, topics):
+        """Coroutine to subscribe or unsubscribe a web client to topics.
+
+        A snapshot of each newly subscribed topic is sent to the web client;
+        invalid topics are ignored.
+
+        Args:
+            web_client (SpotnetWebClient): The web client.
+            status (str): Either 'subscribe' or 'unsubscribe'.
+            topics (List[str]): The topics to subscribe or unsubscribe to.
+
+        """
+        for topic in topics:
+            try:
+                parse_topic(topic)
+            except ValueError as e:
+                self.logger.warn('Ignoring subscription: ' + repr(e))
+                continue
+
+            if status == 'unsubscribe':
+                web_client.topics.discard(topic)
+            elif topic not in web_client.topics:
+                web_client.topics.add(topic)
+                for snapshot in self._get_topic_snapshots(topic):
+                    yield from web_client.send_json(snapshot)
+
+        self.logger.info('Web client is now subscribed to topics {}.'
+                         .format(sorted(web_client.topics)))
+
+    @asyncio.coroutine
+    def _send_queue_range(self, web_client, data):
+        """Coroutine to send a web client a page of a slave's queue.
+
+        Snapshots only include the front of each queue, so web clients
+        request later tracks in ranges of at most ``MAX_QUEUE_RANGE``.
+
+        Args:
+            web_client (SpotnetWebClient): The requesting web client.
+            data (dict): The ``data`` of the ``get-queue-range`` request, of
+                the form ``{'uuid': str, 'start': int, 'end': int}``.
+
+        """
+        slave = self.slave_dict_by_uuid.get(data.get('uuid'))
+        if slave is None:
+            self.logger.warn('Received "get-queue-range" request for unknown '
+                             'slave with UUID {}.'.format(data.get('uuid')))
+            return
+
+        try:
+            start = max(int(data.get('start', 0)), 0)
+            end = min(int(data.get('end', start + MAX_QUEUE_RANGE)),
+                      start + MAX_QUEUE_RANGE)
+        except (TypeError, ValueError):
+            self.logger.warn('Received malformed "get-queue-range" request: '
+                             '{}'.format(data))
+            return
+
+        yield from web_client.send_queue_range(
+            slave.uuid, start, slave.track_queue[start:end],
+            len(slave.track_queue), slave.queue_version)
+
+    @asyncio.coroutine
+    def _send_slave_log(self, web_client, data):
+        """Coroutine to send a web client the recent mopidy output of a
+        slave, for diagnostics.
+
+        Args:
+            web_client (SpotnetWebClient): The requesting web client.
+            data (dict): The ``data`` of the ``get-slave-log`` request, of
+                the form ``{'uuid': str, 'limit': int}``.
+
+        """
+        slave = self.slave_dict_by_uuid.get(data.get('uuid'))
+        if slave is None:
+            self.logger.warn('Received "get-slave-log" request for unknown '
+                             'slave with UUID {}.'.format(data.get('uuid')))
+            return
+
+        try:
+            lines = yield from slave.fetch_mopidy_log(data.get('limit'))
+        except (ConnectionClosed, asyncio.TimeoutError) as e:
+            self.logger.warn('Failed to fetch mopidy log from slave with UUID '
+                             '{0}: {1}'.format(slave.uuid, repr(e)))
+            return
+
+        yield from web_client.send_slave_log(slave.uuid, lines)
+
+    def _get_snapshots(self, web_client):
+        """Return snapshot messages for every topic of a web client."""
+        snapshots = []
+        for topic in sorted(web_client.topics):
+            snapshots.extend(self._get_topic_snapshots(topic))
+        return snapshots
+
+    def _get_topic_snapshots(self, topic):
+        """Return the messages a web client resyncs a topic from.
+
+        Args:
+            topic (str): A valid topic.
+
+        Returns:
+            List[dict]: The snapshot messages; empty if the topic names a
+                slave that is not connected.
+
+        """
+        kind, uuid = parse_topic(topic)
+        if kind == ALL_TOPICS:
+            return [state_message(self._get_state())]
+        elif kind == SUMMARY_TOPIC:
+            return [summary_message([slave.get_summary() for slave in
+                                     self.slave_dict_by_ws.values()])]
+
+        slave = self.slave_dict_by_uuid.get(uuid)
+        if slave is None:
+            return []
+        elif kind == SLAVE_TOPIC_PREFIX:
+            return [slave_state_message(slave.get_details())]
+        elif kind == QUEUE_TOPIC_PREFIX:
+            return [slave_state_message(slave.get_encoded_state())]
+
+    def _get_sync_stats(self):
+        """Return the clock synchronization stats as a JSON-like dict."""
+        return {
+            'last-start-skew-ms': (None if self.last_start_skew is None
+                                   else self.last_start_skew * 1000),
+            'slaves': {uuid: slave.clock.get_stats() for uuid, slave in
+                       self.slave_dict_by_uuid.items()}
+        }
+
     def _get_state(self):
-        """Return the entire state of the system as a JSON-like dict."""
+        """Return the entire state of the system as a JSON-like dict.
+
+        Each slave's state is included in its cached encoded form, so that
+        only the slaves that changed since the last snapshot are encoded.
+
+        """
         return {
             'data': {
                 'voting-enabled': self.voting_enabled,
                 'votes-for-skip': self.votes_for_skip,
-                'slaves': [slave.get_state() for _, slave in
+                'slaves': [slave.get_encoded_state() for _, slave in
                            self.slave_dict_by_ws.items()]
             }
         }
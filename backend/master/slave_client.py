@@ -1,19 +1,74 @@
 """A client implementation for the Spotnet slave server."""
 
 import asyncio
+import bisect
+import collections
 import datetime
 import uuid
 
-from ..utils import WebSocketWrapper
+from websockets.exceptions import ConnectionClosed
 
+from ..utils import PreEncoded, WebSocketWrapper
+from .clock_sync import ClockOffsetEstimator
+from .config import (CLOCK_SYNC_INTERVAL, CLOCK_SYNC_WINDOW, QUEUE_WINDOW_SIZE,
+                     SLAVE_ACK_TIMEOUT, SLAVE_COMMAND_QUEUE_SIZE,
+                     SLAVE_COMMAND_TIMEOUT)
+from .track_queue import TrackQueue
 
-DELAY = 0.1
+
+PLAY_AUDIO = {'status': 'play-audio'}
+PAUSE_AUDIO = {'status': 'pause-audio'}
+CLEAR_TRACKS = {'status': 'clear-tracks'}
+PLAY_HEAD = {'status': 'play-audio', 'data': {'position': 0}}
 
 
 class SpotnetSlaveClient(WebSocketWrapper):
 
     """A client for interacting with a Spotnet slave server.
 
+    Commands for a slave are submitted to its own bounded queue and run in
+    order by a dedicated worker task, so that a slow slave only delays its
+    own commands rather than those of every other slave.
+
+    Playback directives are sent to the slave with an ``id`` and are
+    acknowledged by the slave once mopidy has handled them; directives that
+    must happen in sequence are sent together in a single ``command-batch``
+    message.
+
+    The slave's mopidy tracklist always mirrors the first tracks of
+    ``track_queue``: the current track plus up to ``lookahead`` upcoming
+    ones. mopidy runs in consume mode, so when a track ends it drops the
+    track and moves on to the pre-loaded next one by itself; the master then
+    only updates its bookkeeping and tops the look-ahead back up.
+
+    The master keeps its own copy of the mopidy tracklist, keyed by mopidy
+    tlid. Every queue edit is reconciled against that copy and turned into
+    the fewest tracklist adds, removes, and moves, sent as one batch.
+
+    A slave's session outlives its WebSocket connection: when the
+    connection drops, the slave is ``suspend``-ed until it reconnects with
+    its ``session_token`` and is ``resume``-d on the new connection. While
+    suspended, no new commands are started and the timeouts of the command
+    and directive in flight are put off; every directive that has not been
+    acknowledged is kept in an outbox and sent again on resume, and the
+    slave skips those it has already run.
+
+    While connected, the master pings the slave every
+    ``CLOCK_SYNC_INTERVAL`` seconds to estimate the offset of the slave's
+    clock, so that playback can be scheduled to start at the same master
+    time on several slaves.
+
+    Commands may be submitted with a ``Trace``; the spans of the command's
+    wait in the queue, of its run, and of each directive it sends are
+    recorded on it, and directives carry the trace's id so that the slave
+    reports the spans of its own work with its ack.
+
+    The encoded form of the slave's state sent to web clients is cached by
+    ``get_encoded_state``; it holds only the first ``QUEUE_WINDOW_SIZE``
+    tracks of the queue, and web clients fetch the rest a page at a time.
+    Any recorded patch invalidates it, but the encoded window of the queue
+    is only invalidated by patches to the queue.
+
     Attributes:
         name (str): The user friendly name of the slave node.
         uuid (str): The unique identifier for the slave node.
@@ -21,26 +76,320 @@ class SpotnetSlaveClient(WebSocketWrapper):
             has been connected with Spotfiy credentials.
         is_paused (bool): Boolean indicating whether or not this slave
             instance is paused; instances are initialized with audio paused.
-        track_queue (List[Tuple(str,str)]): A list of tuples containing the
-            Spotify id and uri of each track in the queue for this slave
-            node.
+        track_queue (TrackQueue): The queue of JSON-like dicts containing
+            the Spotify id and uri of each track queued on this slave node.
         counted_votes_for_skip (int): The current number of votes towards
-            skipping the currently playing song.
+            skipping the currently playing song; reset to 0 whenever a
+            different track comes to the head of the queue.
         first_connected_at (str): An isoformat string indicating the time
             tht the slave first made connection with the master server.
+        state_version (int): A monotonically increasing version number for
+            the state of this slave; every recorded patch increments it.
+        queue_version (int): A monotonically increasing version number for
+            the track queue alone, incremented by every queue patch, so that
+            web clients following only the queue can detect missed patches.
+        lookahead (int): The number of upcoming tracks to keep pre-loaded in
+            the slave's mopidy tracklist; 0 disables gapless transitions.
+        clock (ClockOffsetEstimator): The estimate of the offset between the
+            master's event loop clock and the slave's.
+        node_id (str): The identifier the slave node reported for itself,
+            which stays the same across connections and is used to persist
+            its state; None for slaves that report none.
+        session_token (str): The secret with which the slave resumes its
+            session after a dropped connection.
 
     """
 
-    def __init__(self, ws):
+    def __init__(self, ws, lookahead=0, node_id=None):
         super(SpotnetSlaveClient, self).__init__(ws)
 
-        self.name = None
         self.uuid = str(uuid.uuid1())
-        self.is_connected = False
-        self.is_paused = True
-        self.track_queue = []
-        self.counted_votes_for_skip = 0
+        self.node_id = node_id
+        self.session_token = uuid.uuid4().hex
+        self.track_queue = TrackQueue()
         self.first_connected_at = datetime.datetime.now().isoformat()
+        self.state_version = 0
+        self.queue_version = 0
+        self.lookahead = lookahead
+        self.clock = ClockOffsetEstimator(CLOCK_SYNC_WINDOW)
+
+        # the master's copy of the slave's mopidy tracklist, as a list of
+        # {'uri': str, 'tlid': int} dicts; if a reconciliation fails, the
+        # copy is no longer trusted and the next one starts from a cleared
+        # tracklist
+        self._tracklist = []
+        self._tracklist_synced = True
+
+        # set when a different track became the head of the tracklist while
+        # paused, so that the next play starts it rather than resuming, from
+        # the given time position in ms if there is one
+        self._play_head_on_resume = False
+        self._resume_time_position = None
+
+        self._name = None
+        self._is_connected = False
+        self._is_paused = True
+        self._counted_votes_for_skip = 0
+        self._pending_patches = []
+        self._encoded_state = None
+        self._encoded_queue = None
+        self._commands = asyncio.Queue(maxsize=SLAVE_COMMAND_QUEUE_SIZE)
+        self._worker = None
+        self._clock_sync = None
+        self._next_directive_id = 0
+        self._pending_acks = {}
+
+        # the trace of the command being run, if it has one
+        self._trace = None
+
+        # directive id -> spans reported by the slave with its ack
+        self._ack_spans = {}
+
+        # directive id -> message, for every directive not yet acknowledged
+        self._outbox = collections.OrderedDict()
+
+        # set while the slave is connected
+        self._online = asyncio.Event()
+        self._online.set()
+
+    @property
+    def name(self):
+        return self._name
+
+    @name.setter
+    def name(self, value):
+        self._set_field('name', value)
+
+    @property
+    def is_connected(self):
+        return self._is_connected
+
+    @is_connected.setter
+    def is_connected(self, value):
+        self._set_field('is-connected', value)
+
+    @property
+    def is_paused(self):
+        return self._is_paused
+
+    @is_paused.setter
+    def is_paused(self, value):
+        self._set_field('is-paused', value)
+
+    @property
+    def counted_votes_for_skip(self):
+        return self._counted_votes_for_skip
+
+    @counted_votes_for_skip.setter
+    def counted_votes_for_skip(self, value):
+        self._set_field('counted-votes-for-skip', value)
+
+    @property
+    def command_backlog(self):
+        """int: The number of commands waiting to be run."""
+        return self._commands.qsize()
+
+    @property
+    def is_online(self):
+        """bool: Whether the slave's session has a live connection."""
+        return self._online.is_set()
+
+    def suspend(self):
+        """Hold this slave's session after its connection dropped."""
+        self._online.clear()
+        self.stop_clock_sync()
+
+    @asyncio.coroutine
+    def resume(self, ws, codec):
+        """Coroutine to continue this slave's session on a new connection.
+
+        Every directive that is still awaiting an ack is sent again before
+        any new command starts.
+
+        Args:
+            ws (websockets.server.WebSocketServerProtocol): The new
+                connection with the slave.
+            codec: The codec negotiated for the new connection.
+
+        """
+        self.ws = ws
+        self.codec = codec
+
+        yield from self.send_json({
+            'status': 'session-resumed',
+            'sender': 'master',
+            'data': {
+                'uuid': self.uuid
+            }})
+        for msg in list(self._outbox.values()):
+            yield from self.send_json(msg)
+
+        self._online.set()
+        self.start_clock_sync()
+
+    def start_worker(self):
+        """Start the task that runs this slave's queued commands."""
+        if self._worker is None:
+            self._worker = asyncio.ensure_future(self._run_commands())
+
+    def stop_worker(self):
+        """Stop the command worker, cancelling any commands still queued."""
+        if self._worker is not None:
+            self._worker.cancel()
+            self._worker = None
+
+        while not self._commands.empty():
+            future = self._commands.get_nowait()[0]
+            future.cancel()
+
+    def start_clock_sync(self):
+        """Start the task that periodically pings the slave's clock."""
+        if self._clock_sync is None:
+            self._clock_sync = asyncio.ensure_future(self._ping_clock())
+
+    def stop_clock_sync(self):
+        """Stop pinging the slave's clock."""
+        if self._clock_sync is not None:
+            self._clock_sync.cancel()
+            self._clock_sync = None
+
+    def handle_clock_pong(self, pong_data):
+        """Record the timestamps of a ping answered by the slave.
+
+        Args:
+            pong_data (dict): The ``data`` of a ``clock-pong`` message from
+                the slave, of the form ``{'t0': float, 't1': float,
+                't2': float}``.
+
+        """
+        t3 = asyncio.get_event_loop().time()
+        self.clock.add_sample(
+            pong_data['t0'], pong_data['t1'], pong_data['t2'], t3)
+
+    def submit(self, coro_func, *args, trace=None):
+        """Queue a command to be run by this slave's worker.
+
+        Commands submitted to the same slave run one at a time, in the order
+        they were submitted. Cancelling the returned future cancels the
+        command, whether it is still queued or already running.
+
+        Args:
+            coro_func (Callable): A coroutine function implementing the
+                command.
+            *args: The arguments to call ``coro_func`` with.
+            trace (Trace): An optional trace to record the command's spans
+                on.
+
+        Returns:
+            asyncio.Future: A future resolving to the command's result, or to
+                an ``asyncio.TimeoutError`` if the command did not finish
+                within ``SLAVE_COMMAND_TIMEOUT`` seconds of the slave being
+                online.
+
+        Raises:
+            asyncio.QueueFull: If ``SLAVE_COMMAND_QUEUE_SIZE`` commands are
+                already waiting on this slave.
+
+        """
+        future = asyncio.Future()
+        self._commands.put_nowait((future, coro_func, args, trace,
+                                   asyncio.get_event_loop().time()))
+        return future
+
+    @property
+    def command_queue_depth(self):
+        """int: The number of commands waiting to be run."""
+        return self._commands.qsize()
+
+    @asyncio.coroutine
+    def _run_commands(self):
+        """Coroutine to run queued commands until cancelled."""
+        loop = asyncio.get_event_loop()
+        while True:
+            yield from self._online.wait()
+            future, coro_func, args, trace, submitted_at = \
+                yield from self._commands.get()
+            if future.cancelled():
+                continue
+
+            started_at = loop.time()
+            if trace is not None:
+                trace.add_span('master:queue-wait', submitted_at, started_at)
+
+            self._trace = trace
+            task = asyncio.ensure_future(coro_func(*args))
+
+            def cancel_task(future, task=task):
+                if future.cancelled():
+                    task.cancel()
+
+            future.add_done_callback(cancel_task)
+            try:
+                result = yield from self._wait_online(
+                    task, SLAVE_COMMAND_TIMEOUT)
+            except asyncio.CancelledError:
+                if task.cancelled() and future.cancelled():
+                    # the command was cancelled through its future
+                    continue
+                task.cancel()
+                future.cancel()
+                raise
+            except Exception as e:
+                if not future.cancelled():
+                    future.set_exception(e)
+            else:
+                if not future.cancelled():
+                    future.set_result(result)
+            finally:
+                self._trace = None
+                if trace is not None:
+                    trace.add_span(
+                        'master:command:' + coro_func.__name__.lstrip('_'),
+                        started_at, loop.time())
+
+    @asyncio.coroutine
+    def _wait_online(self, future, timeout):
+        """Coroutine to wait for a future, timing out only while online.
+
+        A timeout that runs out while the session is suspended starts over
+        once it resumes.
+
+        Raises:
+            asyncio.TimeoutError: If the future is not done after
+                ``timeout`` seconds online; it is then cancelled.
+
+        """
+        while True:
+            done, _ = yield from asyncio.wait([future], timeout=timeout)
+            if done:
+                return future.result()
+            elif self.is_online:
+                future.cancel()
+                raise asyncio.TimeoutError()
+
+            yield from self._online.wait()
+
+    @asyncio.coroutine
+    def _ping_clock(self):
+        """Coroutine to send a ``clock-ping`` at a fixed interval.
+
+        Pings bypass the command queue, so that a backlog of commands does
+        not delay them; the slave answers each one as soon as it reads it.
+
+        """
+        loop = asyncio.get_event_loop()
+        try:
+            while True:
+                yield from self.send_json({
+                    'status': 'clock-ping',
+                    'sender': 'master',
+                    'data': {
+                        't0': loop.time()
+                    }})
+                yield from asyncio.sleep(CLOCK_SYNC_INTERVAL)
+        except ConnectionClosed:
+            # the connection handler notices the closed socket and cleans up
+            pass
 
     @asyncio.coroutine
     def send_credentials(self, name, username, password):
@@ -65,18 +414,43 @@ class SpotnetSlaveClient(WebSocketWrapper):
     @asyncio.coroutine
     def send_pause(self):
         """Coroutine to tell the slave server to pause audio playback."""
-        yield from self.send_json({
-            'status': 'pause-audio',
-            'sender': 'master'
-        })
+        yield from self._send_directives([PAUSE_AUDIO])
 
     @asyncio.coroutine
-    def send_play(self):
-        """Coroutine to tell the slave server to resume audio playback."""
-        yield from self.send_json({
-            'status': 'play-audio',
-            'sender': 'master'
-        })
+    def send_play(self, at=None):
+        """Coroutine to tell the slave server to resume audio playback.
+
+        Args:
+            at (float): The time on the master's event loop clock at which
+                playback should start, converted to the slave's clock with
+                the current offset estimate; if None, playback starts as soon
+                as the slave receives the directive.
+
+        Returns:
+            float: The master clock time at which the slave reported that
+                playback started, or None if it did not report one.
+
+        """
+        directive = PLAY_HEAD if self._play_head_on_resume else PLAY_AUDIO
+        if self._play_head_on_resume and self._resume_time_position:
+            directive = _play_head_from(self._resume_time_position)
+        if at is not None:
+            data = dict(directive.get('data', {}))
+            data['at'] = self.clock.to_slave_time(at)
+            directive = {'status': directive['status'], 'data': data}
+
+        results = yield from self._send_directives([directive])
+        self._play_head_on_resume = False
+        self._resume_time_position = None
+
+        result = results[0] if results else None
+        if not result or result.get('started-at') is None:
+            return None
+
+        started_at = self.clock.to_master_time(result['started-at'])
+        if at is not None:
+            self.clock.last_start_error = started_at - at
+        return started_at
 
     @asyncio.coroutine
     def add_track(self, track, position):
@@ -87,28 +461,42 @@ class SpotnetSlaveClient(WebSocketWrapper):
             position (str): Either 'current' or 'next'.
 
         """
-        uri = track['uri']
-        if position == 'current':
-            if not self.track_queue:
-                self.track_queue.append(track)
-                yield from self._send_add_track(uri)
-            elif self.is_paused:
-                self.track_queue = [track] + self.track_queue
-                yield from self._send_clear_tracks()
-                yield from self._send_add_track(uri)
-            else:
-                self.track_queue[0] = track
-                yield from self._send_pause_audio()
-                yield from self._send_clear_tracks()
-                yield from self._send_add_track(uri)
-                yield from self._send_play_audio()
+        yield from self.add_tracks([track], position)
+
+    @asyncio.coroutine
+    def add_tracks(self, tracks, position):
+        """Coroutine to add several tracks to the queue in one operation.
+
+        The tracks are inserted in order and recorded as a single patch; any
+        of them that fall within the mopidy look-ahead window are sent to the
+        slave in a single ``add-track`` directive.
+
+        Args:
+            tracks (List[dict]): JSON-like dicts with 'id' and 'uri' keys.
+            position (str): One of 'current', 'next', or 'end'.
+
+        Raises:
+            ValueError: If ``position`` is not recognized.
+
+        """
+        tracks = list(tracks)
+        if not tracks:
+            return
+        elif not self.track_queue:
+            self._insert_tracks(0, tracks)
+        elif position == 'current':
+            if not self.is_paused:
+                # the playing track is replaced rather than pushed back
+                self._remove_track(0)
+            self._insert_tracks(0, tracks)
         elif position == 'next':
-            if not self.track_queue:
-                self.track_queue.append(track)
-                yield from self._send_add_track(uri)
-            else:
-                self.track_queue = (self.track_queue[:1] + [track] +
-                                    self.track_queue[1:])
+            self._insert_tracks(1, tracks)
+        elif position == 'end':
+            self._insert_tracks(len(self.track_queue), tracks)
+        else:
+            raise ValueError('Invalid track position "{}".'.format(position))
+
+        yield from self._sync_tracklist()
 
     @asyncio.coroutine
     def remove_track(self, position, from_transition=False):
@@ -117,81 +505,327 @@ class SpotnetSlaveClient(WebSocketWrapper):
         Args:
             position (int): The position in the queue to remove.
             from_transition (bool): Indicating if this call is resultant from
-                the end of a track into another.
+                the end of a track into another, in which case mopidy has
+                already consumed the track and advanced to any pre-loaded
+                next track.
         """
-        self.track_queue.pop(position)
+        self._remove_track(position)
+        if from_transition and self._tracklist:
+            self._tracklist.pop(0)
 
-        if position == 0:
-            if self.is_paused:
-                yield from self._send_clear_tracks()
-                if self.track_queue:
-                    # send the next uri to be played (but we are still paused)
-                    new_uri = self.track_queue[0]['uri']
-                    yield from self._send_add_track(new_uri)
-            else:
-                # was playing a track
-                if not self.track_queue:
-                    yield from self._send_pause_audio()
-                    self.is_paused = True
-                    yield from self._send_clear_tracks()
-                else:
-                    if from_transition:
-                        yield from self._send_stop_playback()
-                    else:
-                        yield from self._send_pause_audio()
-
-                    yield from self._send_clear_tracks()
-                    new_uri = self.track_queue[0]['uri']
-                    yield from self._send_add_track(new_uri)
-                    yield from self._send_play_audio()
+        if not self.track_queue:
+            self.is_paused = True
 
-    @asyncio.coroutine
-    def _send_play_audio(self):
-        """Coroutine to tell slave to play audio."""
-        yield from asyncio.sleep(DELAY)
-        yield from self.send_json({
-            'status': 'play-audio',
-            'sender': 'master'
+        yield from self._sync_tracklist()
+
+    def is_current_track(self, uri=None, tlid=None):
+        """Return whether a track reported by the slave is the current one.
+
+        Args:
+            uri (str): The uri of the reported track, if known.
+            tlid (int): The mopidy tlid of the reported track, if known.
+
+        Returns:
+            bool: False if the reported track is known not to be the head
+                of the queue.
+
+        """
+        if not self.track_queue:
+            return False
+        elif tlid is not None and self._tracklist_synced and self._tracklist:
+            return self._tracklist[0]['tlid'] == tlid
+        else:
+            return uri is None or uri == self.track_queue[0]['uri']
+
+    def resolve_ack(self, ack_data):
+        """Resolve the pending directive acknowledged by the slave.
+
+        Args:
+            ack_data (dict): The ``data`` of an ``ack`` message from the
+                slave, of the form ``{'id': int, 'ok': bool, 'error': str}``;
+                acks of traced directives also carry the slave's ``spans``.
+
+        """
+        future = self._pending_acks.pop(ack_data.get('id'), None)
+        if future is None or future.done():
+            return
+
+        if 'spans' in ack_data:
+            self._ack_spans[ack_data['id']] = ack_data['spans']
+
+        if ack_data.get('ok'):
+            future.set_result(ack_data.get('results'))
+        else:
+            future.set_exception(RuntimeError(
+                'Slave failed directive: ' + str(ack_data.get('error'))))
+
+    def pop_patches(self):
+        """Return and clear the patches recorded since the last call.
+
+        Each patch is a JSON-like dict carrying the ``version`` it advances
+        this slave's state to, as well as an ``op`` key that is one of
+        ``'queue-insert'``, ``'queue-insert-many'``, ``'queue-remove'``, or
+        ``'set-field'``; queue patches also carry the ``queue-version`` they
+        advance the track queue to::
+
+            {'version': int, 'queue-version': int, 'op': 'queue-insert',
+             'position': int, 'track': {'id': str, 'uri': str}}
+            {'version': int, 'queue-version': int,
+             'op': 'queue-insert-many', 'position': int,
+             'tracks': [{'id': str, 'uri': str}, ...]}
+            {'version': int, 'queue-version': int, 'op': 'queue-remove',
+             'position': int}
+            {'version': int, 'op': 'set-field', 'field': str, 'value': ...}
+
+        Returns:
+            List[dict]: The recorded patches, ordered by version.
+
+        """
+        patches = self._pending_patches
+        self._pending_patches = []
+        return patches
+
+    def _record_patch(self, patch):
+        """Stamp a patch with the next state version and record it."""
+        self._encoded_state = None
+        if patch['op'].startswith('queue-'):
+            if patch['position'] < QUEUE_WINDOW_SIZE:
+                self._encoded_queue = None
+            self.queue_version += 1
+            patch['queue-version'] = self.queue_version
+
+        self.state_version += 1
+        patch['version'] = self.state_version
+        self._pending_patches.append(patch)
+
+    def _set_field(self, field, value):
+        """Set a scalar state field, recording a patch if it changed."""
+        attr = '_' + field.replace('-', '_')
+        if getattr(self, attr) == value:
+            return
+
+        setattr(self, attr, value)
+        self._record_patch({
+            'op': 'set-field',
+            'field': field,
+            'value': value
         })
 
-    @asyncio.coroutine
-    def _send_pause_audio(self):
-        """Coroutine to tell slave to pause audio."""
-        yield from asyncio.sleep(DELAY)
-        yield from self.send_json({
-            'status': 'pause-audio',
-            'sender': 'master'
+    def _insert_track(self, position, track):
+        """Insert a track into the queue, recording a patch."""
+        self.track_queue.insert(position, track)
+        self._record_patch({
+            'op': 'queue-insert',
+            'position': position,
+            'track': track
         })
+        if position == 0:
+            self.counted_votes_for_skip = 0
 
-    @asyncio.coroutine
-    def _send_stop_playback(self):
-        """Coroutine to tell slave to stop playback."""
-        yield from asyncio.sleep(DELAY)
-        yield from self.send_json({
-            'status': 'stop-playback',
-            'sender': 'master'
+    def _insert_tracks(self, position, tracks):
+        """Insert several tracks into the queue, recording a single patch."""
+        if len(tracks) == 1:
+            self._insert_track(position, tracks[0])
+            return
+
+        self.track_queue.insert_many(position, tracks)
+        self._record_patch({
+            'op': 'queue-insert-many',
+            'position': position,
+            'tracks': tracks
         })
+        if position == 0:
+            self.counted_votes_for_skip = 0
 
-    @asyncio.coroutine
-    def _send_clear_tracks(self):
-        """Coroutine to tell slave to clear tracks."""
-        yield from asyncio.sleep(DELAY)
-        yield from self.send_json({
-            'status': 'clear-tracks',
-            'sender': 'master'
+    def _remove_track(self, position):
+        """Remove a track from the queue, recording a patch."""
+        track = self.track_queue.pop(position)
+        self._record_patch({
+            'op': 'queue-remove',
+            'position': position
         })
+        if position == 0:
+            self.counted_votes_for_skip = 0
+        return track
 
     @asyncio.coroutine
-    def _send_add_track(self, uri):
-        """Coroutine to tell slave to add a track by uri."""
-        yield from asyncio.sleep(DELAY)
-        yield from self.send_json({
-            'status': 'add-track',
-            'sender': 'master',
-            'data': {
-                'uri': uri
+    def _sync_tracklist(self, time_position=None):
+        """Coroutine to reconcile the mopidy tracklist with the queue.
+
+        The tracklist should hold the first ``1 + lookahead`` tracks of the
+        queue. If reconciling moved a different track to the head of the
+        tracklist, playback is switched to it, or, if paused, the next play
+        starts it rather than resuming the previous track.
+
+        Args:
+            time_position (int): The position, in ms, to start a new head
+                of the tracklist from; if None, it starts from the beginning.
+
+        """
+        directives = []
+        if not self._tracklist_synced:
+            directives.append(CLEAR_TRACKS)
+            self._tracklist = []
+
+        old_head = self._tracklist[0] if self._tracklist else None
+        target = [track['uri'] for track in
+                  self.track_queue[:1 + self.lookahead]]
+        self._tracklist, edits, added = _diff_tracklist(
+            self._tracklist, target)
+        directives.extend(edits)
+
+        new_head = self._tracklist[0] if self._tracklist else None
+        if new_head is not None and new_head is not old_head:
+            if self.is_paused:
+                self._play_head_on_resume = True
+                self._resume_time_position = time_position
+            elif time_position:
+                directives.append(_play_head_from(time_position))
+            else:
+                directives.append(PLAY_HEAD)
+
+        self._tracklist_synced = False
+        results = yield from self._send_directives(directives)
+
+        added_tlids = [tlid for directive, result in
+                       zip(directives, results or [])
+                       if directive['status'] == 'add-track' and result
+                       for tlid in result]
+        if len(added_tlids) != len(added):
+            return
+
+        for entry, tlid in zip(added, added_tlids):
+            entry['tlid'] = tlid
+        self._tracklist_synced = True
+
+    @asyncio.coroutine
+    def _send_directives(self, directives):
+        """Coroutine to send directives to the slave and await their ack.
+
+        A single directive is sent as-is; multiple directives are sent in one
+        ``command-batch`` message, which the slave runs in order and
+        acknowledges once.
+
+        Args:
+            directives (List[dict]): JSON-like dicts, each with a ``status``
+                key and an optional ``data`` key.
+
+        Returns:
+            List: The slave's result for each directive, in order; for
+                example, the list of tlids of the tracks added by an
+                ``add-track`` directive. None if no directives were sent.
+
+        Raises:
+            asyncio.TimeoutError: If the slave does not acknowledge within
+                ``SLAVE_ACK_TIMEOUT`` seconds of being online.
+            RuntimeError: If the slave reports that a directive failed.
+
+        """
+        if not directives:
+            return None
+
+        self._next_directive_id += 1
+        directive_id = self._next_directive_id
+
+        if len(directives) == 1:
+            msg = dict(directives[0])
+        else:
+            msg = {
+                'status': 'command-batch',
+                'data': {
+                    'directives': directives
+                }
             }
-        })
+        msg['sender'] = 'master'
+        msg['id'] = directive_id
+
+        trace = self._trace
+        if trace is not None:
+            msg['trace-id'] = trace.trace_id
+
+        loop = asyncio.get_event_loop()
+        sent_at = loop.time()
+        future = asyncio.Future()
+        self._pending_acks[directive_id] = future
+        self._outbox[directive_id] = msg
+        try:
+            if self.is_online:
+                try:
+                    yield from self.send_json(msg)
+                except ConnectionClosed:
+                    # sent again if the session is resumed
+                    pass
+            results = yield from self._wait_online(future, SLAVE_ACK_TIMEOUT)
+        finally:
+            self._pending_acks.pop(directive_id, None)
+            self._outbox.pop(directive_id, None)
+            spans = self._ack_spans.pop(directive_id, [])
+            if trace is not None:
+                self._record_directive_spans(trace, msg['status'], sent_at,
+                                             loop.time(), spans)
+
+        return results
+
+    def _record_directive_spans(self, trace, status, sent_at, acked_at,
+                                slave_spans):
+        """Record the spans of a directive on its trace.
+
+        Args:
+            trace (Trace): The trace of the directive.
+            status (str): The ``status`` of the sent message.
+            sent_at (float): The master clock time at which the directive
+                was sent.
+            acked_at (float): The master clock time at which it was
+                acknowledged, or given up on.
+            slave_spans (List[dict]): The spans reported by the slave, of
+                the form ``{'name': str, 'start': float, 'end': float}``,
+                with times on the slave's clock.
+
+        """
+        trace.add_span('master:directive:' + status, sent_at, acked_at)
+        for span in slave_spans:
+            trace.add_span(span['name'],
+                           self.clock.to_master_time(span['start']),
+                           self.clock.to_master_time(span['end']),
+                           node=self.uuid)
+
+    @asyncio.coroutine
+    def fetch_mopidy_log(self, limit=None):
+        """Coroutine to fetch the latest lines of mopidy output from the slave.
+
+        Unlike directives, the request skips the slave's queue of directives,
+        and is not sent again if the session is resumed.
+
+        Args:
+            limit (int): The maximum number of lines to fetch; if None, every
+                line the slave kept is fetched.
+
+        Returns:
+            List[dict]: The lines, oldest first, as dicts of the form
+                ``{'time': float, 'port': int, 'level': str, 'logger': str,
+                'message': str}``.
+
+        Raises:
+            asyncio.TimeoutError: If the slave does not answer within
+                ``SLAVE_ACK_TIMEOUT`` seconds.
+
+        """
+        self._next_directive_id += 1
+        request_id = self._next_directive_id
+
+        future = asyncio.Future()
+        self._pending_acks[request_id] = future
+        try:
+            yield from self.send_json({
+                'status': 'get-mopidy-log',
+                'sender': 'master',
+                'id': request_id,
+                'data': {
+                    'limit': limit
+                }})
+            return (yield from asyncio.wait_for(future, SLAVE_ACK_TIMEOUT))
+        finally:
+            self._pending_acks.pop(request_id, None)
 
     def get_state(self):
         """Return the state of this slave as a JSON-like dict.
@@ -200,11 +834,14 @@ class SpotnetSlaveClient(WebSocketWrapper):
 
             {
                 'uuid': str,
+                'version': int,
+                'queue-version': int,
                 'name': str,
                 'is-connected': bool,
                 'is-paused': bool,
                 'counted-votes-for-skip': int,
                 'first-connected-at': string,
+                'queue-length': int,
                 'track-queue': [
                     {
                         'id': str,
@@ -215,13 +852,293 @@ class SpotnetSlaveClient(WebSocketWrapper):
                 ]
             }
 
+        """
+        state = self.get_details()
+        state.update(self._get_queue_info())
+        state['track-queue'] = self.track_queue.to_list()
+        return state
+
+    def get_persisted_state(self):
+        """Return the state of this slave that survives reconnections.
+
+        Returns:
+            dict: A persisted state, as in ``persistence.new_slave_state``;
+                its ``track-queue`` is this slave's ``TrackQueue`` itself,
+                not a copy.
+
         """
         return {
             'uuid': self.uuid,
+            'first-connected-at': self.first_connected_at,
+            'name': self.name,
+            'version': self.state_version,
+            'queue-version': self.queue_version,
+            'track-queue': self.track_queue
+        }
+
+    def restore(self, state):
+        """Take over the persisted state of an earlier connection.
+
+        The slave is left paused and without Spotify credentials, and its
+        mopidy tracklist is rebuilt from scratch by the next sync.
+
+        Args:
+            state (dict): A persisted state, as from ``get_persisted_state``;
+                the slave keeps its own UUID if the state has none.
+
+        """
+        self.uuid = state.get('uuid', self.uuid)
+        self.first_connected_at = state['first-connected-at']
+        self.state_version = state['version']
+        self.queue_version = state['queue-version']
+        self.track_queue = state['track-queue']
+        self._name = state['name']
+        self._tracklist = []
+        self._tracklist_synced = False
+        self._encoded_state = None
+        self._encoded_queue = None
+
+    @asyncio.coroutine
+    def sync_tracklist(self):
+        """Coroutine to bring the mopidy tracklist in line with the queue."""
+        yield from self._sync_tracklist()
+
+    @asyncio.coroutine
+    def restore_playback(self, time_position):
+        """Coroutine to restore playback after the slave restarted mopidy.
+
+        The new mopidy process starts with an empty tracklist, so it is
+        rebuilt from the queue. The current track is played from where the
+        failed process left it or, if paused, is started from there by the
+        next play.
+
+        Args:
+            time_position (int): The position, in ms, that the slave reached
+                in the current track.
+
+        """
+        self._tracklist_synced = False
+        yield from self._sync_tracklist(time_position)
+
+    def get_details(self):
+        """Return the state of this slave without its track queue.
+
+        Returned dicts have the form of ``get_state``, less the
+        ``queue-version``, ``queue-length`` and ``track-queue`` keys, which
+        only change with queue patches and so would go stale for web clients
+        subscribed to just the slave's details.
+
+        """
+        return {
+            'uuid': self.uuid,
+            'version': self.state_version,
             'name': self.name,
             'is-connected': self.is_connected,
             'is-paused': self.is_paused,
             'counted-votes-for-skip': self.counted_votes_for_skip,
-            'first-connected-at': self.first_connected_at,
-            'track-queue': self.track_queue
+            'first-connected-at': self.first_connected_at
+        }
+
+    def _get_queue_info(self):
+        """Return the ``queue-version`` and ``queue-length`` of the state."""
+        return {
+            'queue-version': self.queue_version,
+            'queue-length': len(self.track_queue)
         }
+
+    def get_summary(self):
+        """Return a compact summary of this slave as a JSON-like dict.
+
+        Returned dicts will have the form::
+
+            {
+                'uuid': str,
+                'version': int,
+                'name': str,
+                'is-connected': bool,
+                'is-paused': bool,
+                'current-track': {'id': str, 'uri': str} or None,
+                'queue-length': int
+            }
+
+        """
+        return {
+            'uuid': self.uuid,
+            'version': self.state_version,
+            'name': self.name,
+            'is-connected': self.is_connected,
+            'is-paused': self.is_paused,
+            'current-track': self.track_queue.head,
+            'queue-length': len(self.track_queue)
+        }
+
+    def get_encoded_state(self):
+        """Return the state of this slave, wrapped for cached encoding.
+
+        Returns:
+            PreEncoded: The value of ``get_state``, with ``track-queue`` cut
+                down to the first ``QUEUE_WINDOW_SIZE`` tracks, whose
+                encoding is reused in every message that includes it until
+                the state changes.
+
+        """
+        if self._encoded_state is None:
+            if self._encoded_queue is None:
+                self._encoded_queue = PreEncoded(
+                    self.track_queue[:QUEUE_WINDOW_SIZE])
+
+            state = self.get_details()
+            state.update(self._get_queue_info())
+            state['track-queue'] = self._encoded_queue
+            self._encoded_state = PreEncoded(state)
+
+        return self._encoded_state
+
+
+def _add_track_directive(uris, position):
+    """Build a directive to add tracks by uri to the mopidy tracklist."""
+    return {
+        'status': 'add-track',
+        'data': {
+            'uris': uris,
+            'position': position
+        }
+    }
+
+
+def _remove_tracks_directive(tlids):
+    """Build a directive to remove tracks by tlid from the mopidy tracklist."""
+    return {
+        'status': 'remove-tracks',
+        'data': {
+            'tlids': tlids
+        }
+    }
+
+
+def _move_track_directive(start, to_position):
+    """Build a directive to move a track within the mopidy tracklist."""
+    return {
+        'status': 'move-track',
+        'data': {
+            'start': start,
+            'end': start + 1,
+            'to-position': to_position
+        }
+    }
+
+
+def _play_head_from(time_position):
+    """Build a directive to play the head of the mopidy tracklist from a time
+    position, in ms."""
+    return {
+        'status': 'play-audio',
+        'data': {
+            'position': 0,
+            'time-position': time_position
+        }
+    }
+
+
+def _diff_tracklist(tracklist, target_uris):
+    """Compute the tracklist edits that turn one list of tracks into another.
+
+    Each target uri is matched to an existing track with the same uri where
+    possible. Unmatched tracks are removed and unmatched uris are added;
+    matched tracks that are already in order relative to each other stay
+    where they are, and the rest are moved into place.
+
+    Args:
+        tracklist (List[dict]): The current tracklist, as a list of
+            ``{'uri': str, 'tlid': int}`` dicts.
+        target_uris (List[str]): The uris the tracklist should hold, in
+            order.
+
+    Returns:
+        Tuple(List[dict],List[dict],List[dict]): The new tracklist, the
+            directives producing it, and the new tracklist entries that were
+            added (whose tlids are not yet known).
+
+    """
+    unused = {}
+    for entry in tracklist:
+        unused.setdefault(entry['uri'], []).append(entry)
+
+    matched = []
+    for uri in target_uris:
+        entries = unused.get(uri)
+        matched.append(entries.pop(0) if entries else None)
+
+    kept = set(id(entry) for entry in matched if entry is not None)
+    removed = [entry['tlid'] for entry in tracklist if id(entry) not in kept]
+    current = [entry for entry in tracklist if id(entry) in kept]
+
+    directives = []
+    if removed:
+        directives.append(_remove_tracks_directive(removed))
+
+    positions = [_index_of(current, entry) for entry in matched
+                 if entry is not None]
+    staying = set(id(current[i]) for i in _increasing_run(positions))
+
+    added = []
+    for i, uri in enumerate(target_uris):
+        entry = matched[i]
+        if entry is not None and id(entry) in staying:
+            continue
+
+        if entry is None:
+            entry = matched[i] = {'uri': uri, 'tlid': None}
+            added.append(entry)
+            start = None
+        else:
+            start = _index_of(current, entry)
+            current.pop(start)
+
+        # place the entry right after the one that precedes it in the target
+        to_position = _index_of(current, matched[i - 1]) + 1 if i else 0
+        current.insert(to_position, entry)
+
+        if start is None:
+            last = directives[-1] if directives else None
+            if (last is not None and last['status'] == 'add-track' and
+                    last['data']['position'] + len(last['data']['uris']) ==
+                    to_position):
+                # consecutive additions go to mopidy in a single call
+                last['data']['uris'].append(uri)
+            else:
+                directives.append(_add_track_directive([uri], to_position))
+        else:
+            directives.append(_move_track_directive(start, to_position))
+
+    return current, directives, added
+
+
+def _index_of(entries, entry):
+    """Return the index of an entry in a list, compared by identity."""
+    for i, other in enumerate(entries):
+        if other is entry:
+            return i
+
+    raise ValueError('Entry not in list.')
+
+
+def _increasing_run(values):
+    """Return the values forming a longest strictly increasing subsequence."""
+    tails = []
+    parents = {}
+    for value in values:
+        i = bisect.bisect_left(tails, value)
+        parents[value] = tails[i - 1] if i else None
+        if i == len(tails):
+            tails.append(value)
+        else:
+            tails[i] = value
+
+    run = []
+    value = tails[-1] if tails else None
+    while value is not None:
+        run.append(value)
+        value = parents[value]
+
+    return run[::-1]
@@ -0,0 +1,174 @@
+"""Traces of the work done across nodes to handle web client requests."""
+
+import asyncio
+import collections
+import json
+import uuid
+
+
+class Trace(object):
+
+    """The spans of work recorded while handling a single request.
+
+    A trace is identified by a correlation id, which is sent along with
+    every directive sent to a slave on its behalf, so that the slave can
+    report the spans of its own work back with its ack.
+
+    Work on a trace may outlive the request that started it, as commands
+    wait in a slave's queue; each piece of such work ``hold``-s the trace
+    and ``release``-s it once done, and the trace is finished when the last
+    hold is released.
+
+    Attributes:
+        trace_id (str): The correlation id of the trace.
+        name (str): What the trace is of, such as ``'web-client:add-track'``.
+        started_at (float): The time on the master's event loop clock at
+            which the trace was started.
+        duration (float): The number of seconds from the start of the trace
+            to its end; None until it is finished.
+        spans (List[dict]): The recorded spans, each of the form::
+
+                {
+                    'name': str,
+                    'node': str,
+                    'start-ms': float,
+                    'duration-ms': float
+                }
+
+            where ``node`` is ``'master'`` or the UUID of a slave, and
+            ``start-ms`` is relative to the start of the trace.
+
+    """
+
+    def __init__(self, trace_id, name, on_finish):
+        self.trace_id = trace_id
+        self.name = name
+        self.started_at = asyncio.get_event_loop().time()
+        self.duration = None
+        self.spans = []
+
+        self._holds = 1
+        self._on_finish = on_finish
+
+    def add_span(self, name, start, end, node='master'):
+        """Record a span of work.
+
+        Args:
+            name (str): What the work was, such as ``'mopidy:core.
+                tracklist.add'``.
+            start (float): The time on the master's event loop clock at
+                which the work started.
+            end (float): The time at which the work ended.
+            node (str): Where the work was done.
+
+        """
+        self.spans.append({
+            'name': name,
+            'node': node,
+            'start-ms': (start - self.started_at) * 1000,
+            'duration-ms': (end - start) * 1000
+        })
+
+    def hold(self):
+        """Keep the trace open until a matching ``release``."""
+        self._holds += 1
+
+    def release(self):
+        """Release a hold on the trace, finishing it if it was the last."""
+        self._holds -= 1
+        if self._holds == 0:
+            self.duration = asyncio.get_event_loop().time() - self.started_at
+            self._on_finish(self)
+
+    def to_dict(self):
+        """Return the trace as a JSON-like dict, with spans in start order.
+
+        Returned dicts will have the form::
+
+            {
+                'trace-id': str,
+                'name': str,
+                'duration-ms': float,
+                'spans': List[dict]
+            }
+
+        """
+        return {
+            'trace-id': self.trace_id,
+            'name': self.name,
+            'duration-ms': (None if self.duration is None else
+                            self.duration * 1000),
+            'spans': sorted(self.spans, key=lambda span: span['start-ms'])
+        }
+
+
+class TraceCollector(object):
+
+    """Starts traces and keeps the most recently finished ones.
+
+    Attributes:
+        max_traces (int): The number of finished traces kept; the oldest
+            ones are dropped first.
+        slow_threshold (float): The number of seconds beyond which a
+            finished trace is logged in full; None to not log any.
+
+    """
+
+    def __init__(self, max_traces, slow_threshold=None, logger=None):
+        self.max_traces = max_traces
+        self.slow_threshold = slow_threshold
+
+        self._logger = logger
+        self._traces = collections.OrderedDict()
+
+    def start(self, name, trace_id=None):
+        """Start a trace, held once by the caller.
+
+        Args:
+            name (str): See the ``name`` attribute of ``Trace``.
+            trace_id (str): The correlation id to use, such as one chosen
+                by the web client; a new one is generated if None.
+
+        Returns:
+            Trace: The started trace.
+
+        """
+        if trace_id is None:
+            trace_id = uuid.uuid4().hex
+        return Trace(str(trace_id), name, self._finish)
+
+    def get_traces(self, trace_id=None, limit=None):
+        """Return finished traces as JSON-like dicts, most recent first.
+
+        Args:
+            trace_id (str): If not None, only the trace with this id is
+                returned, if it is kept.
+            limit (int): The maximum number of traces to return; all of
+                them if None.
+
+        Returns:
+            List[dict]: The traces, in the form returned by
+                ``Trace.to_dict``.
+
+        """
+        if trace_id is not None:
+            trace = self._traces.get(trace_id)
+            return [] if trace is None else [trace.to_dict()]
+
+        traces = list(reversed(self._traces.values()))
+        if limit is not None:
+            traces = traces[:limit]
+        return [trace.to_dict() for trace in traces]
+
+    def _finish(self, trace):
+        """Keep a finished trace, logging it if it was slow."""
+        self._traces.pop(trace.trace_id, None)
+        self._traces[trace.trace_id] = trace
+        while len(self._traces) > self.max_traces:
+            self._traces.popitem(last=False)
+
+        if (self.slow_threshold is not None and self._logger is not None and
+                trace.duration > self.slow_threshold):
+            self._logger.warn('Slow trace {0} took {1:.1f} ms: {2}'.format(
+                trace.trace_id, trace.duration * 1000,
+                json.dumps(trace.to_dict(), separators=(',', ':'))))
@@ -0,0 +1,365 @@
+"""An indexed queue of tracks, built for very large slave queues."""
+
+import itertools
+import random
+
+
+DEFAULT_LOAD = 256
+
+
+class TrackQueue(object):
+
+    """A positional sequence of tracks with fast edits anywhere in it.
+
+    Tracks are stored in a list of blocks, each holding between roughly
+    ``load / 4`` and ``2 * load`` tracks, with a Fenwick tree over the block
+    lengths for finding the block that holds a position. Reading the head of
+    the queue is O(1), and inserting, removing, or moving a track by
+    position is O(log n) for a fixed ``load``.
+
+    Tracks are JSON-like dicts with ``'id'`` and ``'uri'`` keys, as sent by
+    the web client. A count of tracks per id is kept, so checking whether a
+    track is queued is O(1).
+
+    Args:
+        tracks (Iterable[dict]): The tracks to initially fill the queue with.
+        load (int): The target number of tracks per block.
+
+    """
+
+    def __init__(self, tracks=(), load=DEFAULT_LOAD):
+        self._load = load
+        self._min_block = max(load // 4, 1)
+        self._blocks = []
+        self._tree = []
+        self._len = 0
+        self._id_counts = {}
+        self._flat = None
+
+        self.insert_many(0, tracks)
+
+    def __len__(self):
+        return self._len
+
+    def __iter__(self):
+        return itertools.chain.from_iterable(self._blocks)
+
+    def __repr__(self):
+        return 'TrackQueue({!r})'.format(self.to_list())
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(self._len)
+            if step != 1:
+                return self.to_list()[index]
+
+            return self._slice(start, stop)
+
+        if index < 0:
+            index += self._len
+        if index == 0 and self._blocks:
+            return self._blocks[0][0]
+        elif not 0 <= index < self._len:
+            raise IndexError('TrackQueue index out of range.')
+
+        block, offset = self._locate(index)
+        return self._blocks[block][offset]
+
+    @property
+    def head(self):
+        """dict: The track at the front of the queue, or None if empty."""
+        return self._blocks[0][0] if self._blocks else None
+
+    def to_list(self):
+        """Return the tracks as a list.
+
+        The list is cached until the queue is next modified, so repeated
+        serialization of an unchanged queue is free. It must not be mutated.
+
+        """
+        if self._flat is None:
+            self._flat = list(self)
+        return self._flat
+
+    def has_id(self, track_id):
+        """Return whether a track with the specified id is queued."""
+        return track_id in self._id_counts
+
+    def count_id(self, track_id):
+        """Return the number of queued tracks with the specified id."""
+        return self._id_counts.get(track_id, 0)
+
+    def index_of_id(self, track_id, start=0):
+        """Return the position of the first track with the specified id.
+
+        Args:
+            track_id (str): The Spotify id of the track.
+            start (int): The position from which to begin searching.
+
+        Raises:
+            ValueError: If no track with the id is queued at or after
+                ``start``.
+
+        """
+        if track_id in self._id_counts:
+            position = 0
+            for block in self._blocks:
+                if position + len(block) > start:
+                    for i in range(max(start - position, 0), len(block)):
+                        if block[i].get('id') == track_id:
+                            return position + i
+                position += len(block)
+
+        raise ValueError('No track with id {} in queue.'.format(track_id))
+
+    def append(self, track):
+        """Add a track to the end of the queue."""
+        self.insert(self._len, track)
+
+    def insert(self, position, track):
+        """Insert a track before the specified position."""
+        position = self._clamp(position)
+        self._flat = None
+        self._count(track, 1)
+
+        if not self._blocks:
+            self._blocks.append([track])
+            self._len += 1
+            self._reindex()
+            return
+
+        block, offset = self._locate_insert(position)
+        self._blocks[block].insert(offset, track)
+        self._len += 1
+
+        if len(self._blocks[block]) > 2 * self._load:
+            half = len(self._blocks[block]) // 2
+            self._blocks[block:block + 1] = [self._blocks[block][:half],
+                                             self._blocks[block][half:]]
+            self._reindex()
+        else:
+            self._update(block, 1)
+
+    def insert_many(self, position, tracks):
+        """Insert several tracks, in order, before the specified position.
+
+        Returns:
+            int: The number of tracks inserted.
+
+        """
+        tracks = list(tracks)
+        if not tracks:
+            return 0
+        elif len(tracks) == 1:
+            self.insert(position, tracks[0])
+            return 1
+
+        position = self._clamp(position)
+        self._flat = None
+        for track in tracks:
+            self._count(track, 1)
+
+        new_blocks = [tracks[i:i + self._load]
+                      for i in range(0, len(tracks), self._load)]
+        if not self._blocks:
+            self._blocks = new_blocks
+        else:
+            block, offset = self._locate_insert(position)
+            left = self._blocks[block][:offset]
+            right = self._blocks[block][offset:]
+            self._blocks[block:block + 1] = self._merge_small(
+                [b for b in [left] + new_blocks + [right] if b])
+
+        self._len += len(tracks)
+        self._reindex()
+        return len(tracks)
+
+    def pop(self, position=-1):
+        """Remove and return the track at the specified position."""
+        if position < 0:
+            position += self._len
+        if not 0 <= position < self._len:
+            raise IndexError('TrackQueue pop index out of range.')
+
+        block, offset = (0, 0) if position == 0 else self._locate(position)
+        track = self._blocks[block].pop(offset)
+
+        self._flat = None
+        self._count(track, -1)
+        self._len -= 1
+
+        if len(self._blocks[block]) < self._min_block:
+            self._rebalance(block)
+        else:
+            self._update(block, -1)
+
+        return track
+
+    def remove_range(self, start, end):
+        """Remove and return the tracks from ``start`` up to ``end``."""
+        start = self._clamp(start)
+        end = max(self._clamp(end), start)
+        if start == end:
+            return []
+
+        removed = []
+        block, offset = self._locate(start)
+        remaining = end - start
+        while remaining:
+            current = self._blocks[block]
+            taken = current[offset:offset + remaining]
+            del current[offset:offset + remaining]
+            removed.extend(taken)
+            remaining -= len(taken)
+
+            if current:
+                block += 1
+            else:
+                del self._blocks[block]
+            offset = 0
+
+        self._flat = None
+        for track in removed:
+            self._count(track, -1)
+        self._len -= len(removed)
+
+        self._blocks = self._merge_small(self._blocks)
+        self._reindex()
+        return removed
+
+    def move(self, start, to_position):
+        """Move a track to a new position.
+
+        Args:
+            start (int): The current position of the track.
+            to_position (int): The position of the track once moved.
+
+        """
+        self.move_range(start, start + 1, to_position)
+
+    def move_range(self, start, end, to_position):
+        """Move the tracks from ``start`` up to ``end`` to a new position.
+
+        Args:
+            start (int): The position of the first track to move.
+            end (int): The position after the last track to move.
+            to_position (int): The position of the first moved track within
+                the queue once the range has been taken out of it.
+
+        """
+        tracks = self.remove_range(start, end)
+        if len(tracks) == 1:
+            self.insert(to_position, tracks[0])
+        else:
+            self.insert_many(to_position, tracks)
+
+    def shuffle(self, start=0, rng=random):
+        """Shuffle the tracks from the specified position onwards.
+
+        Args:
+            start (int): The position of the first track to shuffle; pass 1
+                to keep the current track in place.
+            rng (random.Random): The random number generator to use.
+
+        """
+        start = self._clamp(start)
+        tracks = self.remove_range(start, self._len)
+        rng.shuffle(tracks)
+        self.insert_many(start, tracks)
+
+    def _clamp(self, position):
+        """Clamp a position into the range [0, len], as list.insert does."""
+        if position < 0:
+            position = max(position + self._len, 0)
+        return min(position, self._len)
+
+    def _count(self, track, delta):
+        """Adjust the count of tracks with the id of the specified track."""
+        track_id = track.get('id')
+        count = self._id_counts.get(track_id, 0) + delta
+        if count > 0:
+            self._id_counts[track_id] = count
+        else:
+            self._id_counts.pop(track_id, None)
+
+    def _slice(self, start, stop):
+        """Return the tracks from ``start`` up to ``stop`` as a list."""
+        if start >= stop:
+            return []
+        elif self._flat is not None:
+            return self._flat[start:stop]
+
+        block, offset = self._locate(start)
+        result = []
+        while len(result) < stop - start:
+            needed = stop - start - len(result)
+            result.extend(self._blocks[block][offset:offset + needed])
+            block += 1
+            offset = 0
+
+        return result
+
+    def _locate(self, position):
+        """Return the block index and offset in it of an existing position."""
+        tree = self._tree
+        block = 0
+        step = 1 << (len(self._blocks).bit_length() - 1)
+        while step:
+            nxt = block + step
+            if nxt <= len(self._blocks) and tree[nxt] <= position:
+                block = nxt
+                position -= tree[nxt]
+            step >>= 1
+
+        return block, position
+
+    def _locate_insert(self, position):
+        """Return the block index and offset at which to insert a track."""
+        if position == self._len:
+            return len(self._blocks) - 1, len(self._blocks[-1])
+
+        return self._locate(position)
+
+    def _update(self, block, delta):
+        """Adjust the length recorded for a block in the Fenwick tree."""
+        i = block + 1
+        while i < len(self._tree):
+            self._tree[i] += delta
+            i += i & -i
+
+    def _reindex(self):
+        """Rebuild the Fenwick tree after blocks were split or merged."""
+        tree = [0] + [len(b) for b in self._blocks]
+        for i in range(1, len(tree)):
+            parent = i + (i & -i)
+            if parent < len(tree):
+                tree[parent] += tree[i]
+        self._tree = tree
+
+    def _rebalance(self, block):
+        """Merge an undersized block into a neighbour and re-index."""
+        if not self._blocks[block]:
+            del self._blocks[block]
+        elif len(self._blocks) > 1:
+            left = block - 1 if block else block
+            merged = self._blocks[left] + self._blocks[left + 1]
+            if len(merged) > 2 * self._load:
+                half = len(merged) // 2
+                self._blocks[left:left + 2] = [merged[:half], merged[half:]]
+            else:
+                self._blocks[left:left + 2] = [merged]
+
+        self._reindex()
+
+    def _merge_small(self, blocks):
+        """Return the blocks with undersized ones merged into a neighbour."""
+        merged = []
+        for block in blocks:
+            if (merged and
+                    min(len(merged[-1]), len(block)) < self._min_block and
+                    len(merged[-1]) + len(block) <= 2 * self._load):
+                merged[-1] = merged[-1] + block
+            else:
+                merged.append(block)
+
+        return merged
@@ -0,0 +1,102 @@
+"""Counting of web client votes to skip the current track of a slave."""
+
+
+class _Ballot(object):
+
+    """The votes cast against a single track at the head of a queue."""
+
+    __slots__ = ('track', 'voters', 'skipped')
+
+    def __init__(self, track):
+        self.track = track
+        self.voters = set()
+        self.skipped = False
+
+
+class SkipVoteCounter(object):
+
+    """Counts votes to skip the track at the head of each slave's queue.
+
+    Each slave has a ballot for its current track, identified by the track
+    dict at the head of its queue rather than by uri, so a track queued
+    twice in a row is voted on twice. A new ballot is started as soon as a
+    different track is at the head of the queue, which discards the votes
+    for the previous one. Each voter is counted at most once per ballot.
+
+    Casting a vote is cheap and does not touch the slave's state; ballots
+    that changed are collected with ``pop_tallies``, so that bursts of votes
+    are published to web clients as a single update.
+
+    Attributes:
+        votes_for_skip (int): The number of votes that skips a track.
+
+    Args:
+        votes_for_skip (int): See the ``votes_for_skip`` attribute.
+
+    """
+
+    def __init__(self, votes_for_skip):
+        self.votes_for_skip = votes_for_skip
+
+        # slave uuid -> ballot for its current track
+        self._ballots = {}
+
+        # uuids of the slaves whose ballots changed since the last pop
+        self._changed = set()
+
+    def cast(self, slave, voter, uri=None):
+        """Cast a vote to skip the current track of a slave.
+
+        Args:
+            slave (SpotnetSlaveClient): The slave whose track is voted on.
+            voter: A hashable identifying the voter.
+            uri (str): The uri of the track the voter meant to skip; a vote
+                naming a track that is no longer current is not counted.
+
+        Returns:
+            bool: True if this vote reached ``votes_for_skip``, in which
+                case the track should be skipped; later votes against the
+                same track never return True again.
+
+        """
+        if not slave.track_queue:
+            return False
+
+        track = slave.track_queue[0]
+        if uri is not None and uri != track['uri']:
+            return False
+
+        ballot = self._ballots.get(slave.uuid)
+        if ballot is None or ballot.track is not track:
+            ballot = self._ballots[slave.uuid] = _Ballot(track)
+        elif voter in ballot.voters:
+            return False
+
+        ballot.voters.add(voter)
+        self._changed.add(slave.uuid)
+
+        if not ballot.skipped and len(ballot.voters) >= self.votes_for_skip:
+            ballot.skipped = True
+            return True
+
+        return False
+
+    def pop_tallies(self):
+        """Return and clear the tallies of the ballots changed since the
+        last call.
+
+        Returns:
+            List[Tuple(str,dict,int)]: The slave UUID, the track voted on,
+                and its number of votes, for each changed ballot.
+
+        """
+        tallies = [(uuid, self._ballots[uuid].track,
+                    len(self._ballots[uuid].voters))
+                   for uuid in self._changed if uuid in self._ballots]
+        self._changed.clear()
+        return tallies
+
+    def remove_slave(self, uuid):
+        """Discard the ballot of a disconnected slave."""
+        self._ballots.pop(uuid, None)
+        self._changed.discard(uuid)
@@ -1,14 +1,108 @@
-"""An implementation for interacting with the Spotnet web client."""
+"""An implementation for interacting with the Spotnet web clients."""
 
 import asyncio
+import collections
 
-from ..utils import WebSocketWrapper
+from websockets.exceptions import ConnectionClosed
 
+from ..utils import PreEncoded, WebSocketWrapper
+from .config import WEB_CLIENT_OUTBOX_SIZE
 
-class SpotnetWebClient(WebSocketWrapper):
 
-    def __init__(self, ws):
-        super(SpotnetWebClient, self).__init__(ws)
+HOST_ROLE = 'host'
+GUEST_ROLE = 'guest'
+
+# the topics a web client may subscribe to; ``ALL_TOPICS`` is the full
+# stream of state updates, which web clients receive unless they ask for
+# something narrower
+ALL_TOPICS = '*'
+SUMMARY_TOPIC = 'summary'
+SLAVE_TOPIC_PREFIX = 'slave:'
+QUEUE_TOPIC_PREFIX = 'queue:'
+
+
+def slave_topic(slave_uuid):
+    """Return the topic for the details of a slave, without its queue."""
+    return SLAVE_TOPIC_PREFIX + slave_uuid
+
+
+def queue_topic(slave_uuid):
+    """Return the topic for the track queue of a slave."""
+    return QUEUE_TOPIC_PREFIX + slave_uuid
+
+
+def parse_topic(topic):
+    """Split a topic into its kind and the UUID of its slave, if any.
+
+    Returns:
+        Tuple(str,str): The topic prefix, or the whole topic if it has no
+            slave, and the slave UUID or None.
+
+    Raises:
+        ValueError: If the topic is not recognized.
+
+    """
+    if topic in (ALL_TOPICS, SUMMARY_TOPIC):
+        return topic, None
+
+    for prefix in (SLAVE_TOPIC_PREFIX, QUEUE_TOPIC_PREFIX):
+        if isinstance(topic, str) and topic.startswith(prefix):
+            return prefix, topic[len(prefix):]
+
+    raise ValueError('Invalid topic "{}".'.format(topic))
+
+
+def state_message(state_json):
+    """Turn a system state dict into a ``send-state`` message."""
+    state_json['status'] = 'send-state'
+    state_json['sender'] = 'master'
+    return state_json
+
+
+def summary_message(summaries):
+    """Build a ``send-summary`` message from per-slave summary dicts."""
+    return {
+        'status': 'send-summary',
+        'sender': 'master',
+        'data': {
+            'slaves': summaries
+        }}
+
+
+def slave_state_message(slave_data):
+    """Build a ``send-slave-state`` message from a slave's state dict."""
+    return {
+        'status': 'send-slave-state',
+        'sender': 'master',
+        'data': {
+            'slave': slave_data
+        }}
+
+
+class WebClientMessages(object):
+
+    """The messages that the master server sends to web clients.
+
+    Subclasses implement ``send_json``, which decides where messages go.
+
+    """
+
+    @asyncio.coroutine
+    def send_json(self, json_dict):
+        """Coroutine to send a message; abstract.
+
+        Every other method of this class builds a message and passes it
+        here, so subclasses only override this method, to write the message
+        to a single web client or queue it for a group of them.
+
+        Args:
+            json_dict: A JSON-like dict, or a ``PreEncoded`` one.
+
+        Raises:
+            NotImplementedError: Always, unless overridden.
+
+        """
+        raise NotImplementedError
 
     @asyncio.coroutine
     def send_state(self, state_json):
@@ -19,9 +113,39 @@ class SpotnetWebClient(WebSocketWrapper):
                 system.
 
         """
-        state_json['status'] = 'send-state'
-        state_json['sender'] = 'master'
-        yield from self.send_json(state_json)
+        yield from self.send_json(state_message(state_json))
+
+    @asyncio.coroutine
+    def send_role(self, role):
+        """Coroutine to tell a web client which role it was assigned.
+
+        Args:
+            role (str): Either ``HOST_ROLE`` or ``GUEST_ROLE``.
+
+        """
+        yield from self.send_json({
+            'status': 'role-assigned',
+            'sender': 'master',
+            'data': {
+                'role': role
+            }})
+
+    @asyncio.coroutine
+    def send_request_denied(self, request_status, reason):
+        """Coroutine to tell a web client that its request was ignored.
+
+        Args:
+            request_status (str): The ``status`` of the ignored request.
+            reason (str): Why the request was ignored.
+
+        """
+        yield from self.send_json({
+            'status': 'request-denied',
+            'sender': 'master',
+            'data': {
+                'request': request_status,
+                'reason': reason
+            }})
 
     @asyncio.coroutine
     def remove_slave(self, slave_uuid):
@@ -44,7 +168,7 @@ class SpotnetWebClient(WebSocketWrapper):
 
         Args:
             slave_data (dict): A JSON-like dict representing the serialized
-                state of a slave node.
+                state of a slave node, or a ``PreEncoded`` wrapping one.
 
         """
         yield from self.send_json({
@@ -62,12 +186,83 @@ class SpotnetWebClient(WebSocketWrapper):
             slave_data (dict): A JSON-like dict representing the serialized
                 state of a slave node.
 
+        """
+        yield from self.send_json(slave_state_message(slave_data))
+
+    @asyncio.coroutine
+    def send_queue_range(self, slave_uuid, start, tracks, queue_length,
+                         queue_version):
+        """Coroutine to send a range of tracks from a slave's queue.
+
+        Args:
+            slave_uuid (str): The UUID of the slave.
+            start (int): The position in the queue of the first track.
+            tracks (List[dict]): The tracks in the range.
+            queue_length (int): The length of the whole queue.
+            queue_version (int): The queue version the range was read at.
+
         """
         yield from self.send_json({
-            'status': 'send-slave-state',
+            'status': 'send-queue-range',
             'sender': 'master',
             'data': {
-                'slave': slave_data
+                'uuid': slave_uuid,
+                'start': start,
+                'tracks': tracks,
+                'queue-length': queue_length,
+                'queue-version': queue_version
+            }})
+
+    @asyncio.coroutine
+    def send_slave_log(self, slave_uuid, lines):
+        """Coroutine to send the latest lines of a slave's mopidy output.
+
+        Args:
+            slave_uuid (str): The UUID of the slave.
+            lines (List[dict]): The lines, as returned by
+                ``SpotnetSlaveClient.fetch_mopidy_log``.
+
+        """
+        yield from self.send_json({
+            'status': 'send-slave-log',
+            'sender': 'master',
+            'data': {
+                'uuid': slave_uuid,
+                'lines': lines
+            }})
+
+    @asyncio.coroutine
+    def send_slave_summary(self, summary):
+        """Coroutine to send the updated summary of a slave.
+
+        Args:
+            summary (dict): The slave's summary, as returned by
+                ``SpotnetSlaveClient.get_summary``.
+
+        """
+        yield from self.send_json({
+            'status': 'send-slave-summary',
+            'sender': 'master',
+            'data': {
+                'slave': summary
+            }})
+
+    @asyncio.coroutine
+    def send_slave_patches(self, slave_uuid, patches):
+        """Coroutine to send versioned patches to the state of a slave.
+
+        Args:
+            slave_uuid (str): The UUID of the patched slave.
+            patches (List[dict]): The patches to send, as returned by
+                ``SpotnetSlaveClient.pop_patches``.
+
+        """
+        yield from self.send_json({
+            'status': 'send-slave-patches',
+            'sender': 'master',
+            'data': {
+                'uuid': slave_uuid,
+                'patches': patches
             }})
 
     @asyncio.coroutine
@@ -100,4 +295,364 @@ class SpotnetWebClient(WebSocketWrapper):
                 'uuid': slave_uuid
             }})
 
+    @asyncio.coroutine
+    def send_group_command_result(self, request_id, command, succeeded,
+                                  failed, timed_out):
+        """Coroutine to send the aggregated result of a group command.
+
+        Args:
+            request_id: The id the web client attached to the group command.
+            command (str): The command that was sent to the group.
+            succeeded (List[str]): UUIDs of the slaves that ran the command.
+            failed (List[str]): UUIDs of the slaves where the command failed,
+                was rejected, or that do not exist.
+            timed_out (List[str]): UUIDs of the slaves that did not finish
+                the command in time; the command is cancelled on them.
+
+        """
+        yield from self.send_json({
+            'status': 'group-command-result',
+            'sender': 'master',
+            'data': {
+                'request-id': request_id,
+                'command': command,
+                'succeeded': succeeded,
+                'failed': failed,
+                'timed-out': timed_out
+            }})
+
+    @asyncio.coroutine
+    def send_sync_stats(self, stats):
+        """Coroutine to send the clock synchronization stats of every slave.
+
+        Args:
+            stats (dict): A JSON-like dict of the form::
+
+                {
+                    'last-start-skew-ms': float,
+                    'slaves': {
+                        str: {
+                            'is-synced': bool,
+                            'offset-ms': float,
+                            'jitter-ms': float,
+                            'rtt-ms': float,
+                            'drift-ppm': float,
+                            'last-start-error-ms': float
+                        },
+
+                        ...
+                    }
+                }
+
+        """
+        yield from self.send_json({
+            'status': 'send-sync-stats',
+            'sender': 'master',
+            'data': stats})
+
+    @asyncio.coroutine
+    def send_traces(self, traces):
+        """Coroutine to send finished request traces.
+
+        Args:
+            traces (List[dict]): The traces, most recent first, as returned
+                by ``TraceCollector.get_traces``.
+
+        """
+        yield from self.send_json({
+            'status': 'send-traces',
+            'sender': 'master',
+            'data': {
+                'traces': traces
+            }})
+
+
+class SpotnetWebClient(WebClientMessages, WebSocketWrapper):
+
+    """A client for a single web client connection.
+
+    Messages are not written to the socket directly, but put in a bounded
+    outbox that a writer task drains, so that a slow web client never holds
+    up the master or the other web clients. If the outbox fills up, the
+    messages in it are dropped and replaced with snapshots of the topics the
+    web client is subscribed to, from which it resyncs.
+
+    Attributes:
+        role (str): ``HOST_ROLE`` for the web client that controls the
+            slaves, or ``GUEST_ROLE`` for a read-only web client.
+        requested_role (str): The role the web client asked for; a guest
+            that asked for ``HOST_ROLE`` may be promoted to it once the host
+            disconnects.
+        topics (Set[str]): The topics the web client is subscribed to.
+        overflows (int): The number of times the outbox has overflowed.
+
+    Args:
+        ws (websockets.server.WebSocketServerProtocol): The open WebSocket
+            connection with the web client.
+        role (str): See the ``role`` attribute.
+        get_snapshots (Callable): Called with this web client; returns the
+            snapshot messages for its topics, for resyncing after an
+            overflow.
+        topics (Iterable[str]): The initial topics; ``ALL_TOPICS`` if None.
+        requested_role (str): See the ``requested_role`` attribute; defaults
+            to ``role``.
+
+    """
+
+    def __init__(self, ws, role=HOST_ROLE, get_snapshots=None, topics=None,
+                 requested_role=None):
+        super(SpotnetWebClient, self).__init__(ws)
+
+        self.role = role
+        self.requested_role = role if requested_role is None else \
+            requested_role
+        self.topics = set([ALL_TOPICS] if topics is None else topics)
+        self.overflows = 0
+
+        self._get_snapshots = get_snapshots
+        self._outbox = asyncio.Queue(maxsize=WEB_CLIENT_OUTBOX_SIZE)
+        self._writer = None
+
+    @asyncio.coroutine
+    def send_json(self, json_dict):
+        """Queue a message to be written to the web client.
+
+        Args:
+            json_dict: A JSON-like dict, or a ``PreEncoded`` one.
+
+        """
+        self.enqueue(json_dict)
+
+    def enqueue(self, message):
+        """Queue a message for the writer task without waiting.
+
+        Args:
+            message: A JSON-like dict, or a ``PreEncoded`` one.
+
+        Returns:
+            bool: False if the outbox was full, in which case its messages,
+                including this one, were replaced with topic snapshots.
+
+        """
+        try:
+            self._outbox.put_nowait(message)
+            return True
+        except asyncio.QueueFull:
+            pass
+
+        self.overflows += 1
+        while not self._outbox.empty():
+            self._outbox.get_nowait()
+        if self._get_snapshots is not None:
+            for snapshot in self._get_snapshots(self):
+                self._outbox.put_nowait(snapshot)
+
+        return False
+
+    def start_writer(self):
+        """Start the task that writes queued messages to the socket."""
+        if self._writer is None:
+            self._writer = asyncio.ensure_future(self._write_messages())
+
+    def stop_writer(self):
+        """Stop the writer task, dropping any messages still queued."""
+        if self._writer is not None:
+            self._writer.cancel()
+            self._writer = None
+
+    @property
+    def outbox_depth(self):
+        """int: The number of messages waiting to be written."""
+        return self._outbox.qsize()
+
+    @asyncio.coroutine
+    def _write_messages(self):
+        """Coroutine to write queued messages until cancelled."""
+        try:
+            while True:
+                message = yield from self._outbox.get()
+                yield from WebSocketWrapper.send_json(self, message)
+        except ConnectionClosed:
+            # the connection handler notices the closed socket and cleans up
+            pass
+
+
+class WebClientGroup(WebClientMessages):
+
+    """A fixed group of web clients that messages are broadcast to.
+
+    Each message is wrapped in a single ``PreEncoded`` value, so it is
+    encoded once per wire format however many web clients receive it, and
+    the same frame is queued for each of them.
+
+    Args:
+        clients (Iterable[SpotnetWebClient]): The web clients in the group.
+
+    """
+
+    def __init__(self, clients):
+        self._clients = list(clients)
+
+    def __len__(self):
+        return len(self._clients)
+
+    def __iter__(self):
+        return iter(self._clients)
+
+    @asyncio.coroutine
+    def send_json(self, json_dict):
+        """Queue a message for every web client in the group.
+
+        Args:
+            json_dict (dict): A JSON-like dict.
+
+        """
+        if not self._clients:
+            return
+
+        message = PreEncoded(json_dict)
+        for client in self._clients:
+            client.enqueue(message)
+
+
+class WebClientRegistry(WebClientMessages):
+
+    """The set of connected web clients.
+
+    Messages sent through the registry are broadcast to every web client,
+    as by ``WebClientGroup``; ``subscribed`` and ``slave_subscribers``
+    return narrower groups, for messages only some topics carry.
+
+    Attributes:
+        host (SpotnetWebClient): The connected web client with the host
+            role, or None if there is none.
+
+    """
+
+    def __init__(self):
+        self.host = None
+
+        # ordered by connection time, so that the longest connected guest
+        # is promoted when the host leaves
+        self._clients = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self._clients)
+
+    def __iter__(self):
+        return iter(list(self._clients.values()))
+
+    def __contains__(self, client):
+        return self._clients.get(client.ws) is client
+
+    def get(self, ws):
+        """Return the web client on a WebSocket, or None."""
+        return self._clients.get(ws)
+
+    def assign_role(self, requested_role):
+        """Return the role to give a new web client.
+
+        The host role is only given if no other web client holds it; every
+        other web client is a guest.
+
+        Args:
+            requested_role (str): The role the web client asked for.
+
+        """
+        if requested_role == HOST_ROLE and self.host is None:
+            return HOST_ROLE
+        return GUEST_ROLE
+
+    def add(self, client):
+        """Register a web client and start its writer task."""
+        self._clients[client.ws] = client
+        if client.role == HOST_ROLE:
+            self.host = client
+        client.start_writer()
+
+    def remove(self, ws):
+        """Unregister the web client on a WebSocket and stop its writer.
+
+        Returns:
+            SpotnetWebClient: The removed web client, or None.
 
+        """
+        client = self._clients.pop(ws, None)
+        if client is None:
+            return None
+
+        client.stop_writer()
+        if client is self.host:
+            self.host = None
+        return client
+
+    def promote_host(self):
+        """Give the host role to a guest, if there is no host.
+
+        The longest connected guest that asked for the host role is
+        promoted.
+
+        Returns:
+            SpotnetWebClient: The promoted web client, or None if there
+                already is a host or no guest asked for the role.
+
+        """
+        if self.host is not None:
+            return None
+
+        for client in self._clients.values():
+            if client.requested_role == HOST_ROLE:
+                client.role = HOST_ROLE
+                self.host = client
+                return client
+
+        return None
+
+    def subscribed(self, *topics):
+        """Return the group of web clients subscribed to any of the topics.
+
+        Only web clients that subscribed to ``ALL_TOPICS`` itself match it;
+        it is not a wildcard for the other topics.
+
+        Returns:
+            WebClientGroup: The matching web clients.
+
+        """
+        topics = set(topics)
+        return WebClientGroup(
+            client for client in self if not client.topics.isdisjoint(topics))
+
+    def slave_subscribers(self, slave_uuid):
+        """Return the groups of web clients following a slave's patches.
+
+        Returns:
+            Tuple(WebClientGroup,WebClientGroup,WebClientGroup): The web
+                clients that want all of the slave's patches, only its field
+                patches, and only its queue patches.
+
+        """
+        details = slave_topic(slave_uuid)
+        queue = queue_topic(slave_uuid)
+
+        every, fields, queues = [], [], []
+        for client in self:
+            if (ALL_TOPICS in client.topics or
+                    details in client.topics and queue in client.topics):
+                every.append(client)
+            elif details in client.topics:
+                fields.append(client)
+            elif queue in client.topics:
+                queues.append(client)
+
+        return (WebClientGroup(every), WebClientGroup(fields),
+                WebClientGroup(queues))
+
+    @asyncio.coroutine
+    def send_json(self, json_dict):
+        """Queue a message for every connected web client.
+
+        Args:
+            json_dict (dict): A JSON-like dict.
+
+        """
+        yield from WebClientGroup(self).send_json(json_dict)
@@ -5,6 +5,7 @@ import sys
 
 from argparse import ArgumentParser, RawTextHelpFormatter
 
+from ..utils import configure_logging
 from .server import SpotnetSlaveServer
 
 
@@ -41,6 +42,36 @@ def get_parsed_args(args=None):
         help='Optional parameter to indicate the address of the master\n'
              'server, used when discovery mode is not enabled.')
 
+    parser.add_argument(
+        '--no-standby',
+        dest='keep_standby',
+        action='store_false',
+        required=False,
+        default=True,
+        help='Flag to disable keeping a second, logged in mopidy process\n'
+             'running, which makes logging in again faster.')
+
+    parser.add_argument(
+        '--metrics-port',
+        dest='metrics_port',
+        action='store',
+        type=int,
+        required=False,
+        default=None,
+        help='Optional port on which to serve metrics, such as mopidy\n'
+             'call latencies, over HTTP at /metrics in the Prometheus\n'
+             'text format.')
+
+    parser.add_argument(
+        '--log-format',
+        dest='log_format',
+        action='store',
+        choices=['text', 'json'],
+        required=False,
+        default='text',
+        help='The format of log output: plain text, or one JSON object\n'
+             'per line.')
+
     if args is None:
         args = sys.argv[1:]
 
@@ -60,11 +91,14 @@ def main():
     """
     try:
         opts = get_parsed_args()
+        configure_logging(json_lines=opts.log_format == 'json')
 
         do_discover = opts.do_discover
         master_address = opts.master_address
 
-        server = SpotnetSlaveServer(do_discover, master_address)
+        server = SpotnetSlaveServer(do_discover, master_address,
+                                    keep_standby=opts.keep_standby,
+                                    metrics_port=opts.metrics_port)
 
         asyncio.get_event_loop().run_until_complete(server.run_forever())
     except Exception as e:
@@ -2,3 +2,35 @@
 
 
 SPOTNET_SLAVE_LOGGER_NAME = 'SPOTNET SLAVE'
+
+# the default number of seconds to wait for mopidy to answer a JSON-RPC call
+MOPIDY_CALL_TIMEOUT = 2.0
+
+# the bounds, in seconds, of the exponential backoff between attempts to
+# reconnect to the master; each delay is drawn at random below the bound
+RECONNECT_MIN_DELAY = 0.5
+RECONNECT_MAX_DELAY = 30.0
+
+# the number of recent directive acks kept, so that directives the master
+# sends again after a dropped connection are acknowledged without re-running
+ACK_CACHE_SIZE = 64
+
+# the number of seconds to wait for a logged in mopidy process to answer on
+# its WebSocket, and the bounds of the growing delay between attempts
+MOPIDY_READY_TIMEOUT = 30.0
+MOPIDY_READY_POLL_MIN = 0.05
+MOPIDY_READY_POLL_MAX = 0.5
+
+# the number of lines of mopidy output kept for diagnostics
+MOPIDY_LOG_LINES = 1000
+
+# the number of mopidy warnings (or worse) forwarded to the slave's log in
+# each interval of the given number of seconds; the rest are counted
+MOPIDY_LOG_FORWARD_BURST = 10
+MOPIDY_LOG_FORWARD_INTERVAL = 10.0
+
+# the bounds, in seconds, of the exponential backoff between attempts to
+# restart a failed mopidy process; each delay is drawn at random below the
+# bound
+MOPIDY_RESTART_MIN_DELAY = 0.5
+MOPIDY_RESTART_MAX_DELAY = 30.0
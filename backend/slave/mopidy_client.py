@@ -0,0 +1,245 @@
+"""A JSON-RPC client for the mopidy WebSocket API."""
+
+import asyncio
+
+from ..utils import REGISTRY, WebSocketWrapper
+from .config import MOPIDY_CALL_TIMEOUT
+
+
+_CALL_SECONDS = REGISTRY.histogram(
+    'spotnet_mopidy_call_seconds',
+    'Latency of answered mopidy JSON-RPC calls, by method.', ('method',))
+_CALL_FAILURES = REGISTRY.counter(
+    'spotnet_mopidy_call_failures_total',
+    'mopidy JSON-RPC calls that timed out or were answered with an error, '
+    'by method and reason.', ('method', 'reason'))
+
+
+class MopidyRpcError(Exception):
+
+    """Raised when mopidy answers a JSON-RPC call with an error."""
+
+
+class MopidyCallStats(object):
+
+    """Latency statistics for calls to a single mopidy method.
+
+    Attributes:
+        count (int): The number of calls that received a response.
+        errors (int): The number of calls answered with an error.
+        timeouts (int): The number of calls that received no response in
+            time.
+        total_latency (float): The sum, in seconds, of all response
+            latencies.
+        max_latency (float): The largest response latency, in seconds.
+
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+
+    def record(self, latency):
+        """Record the latency of an answered call."""
+        self.count += 1
+        self.total_latency += latency
+        if latency > self.max_latency:
+            self.max_latency = latency
+
+    def to_dict(self):
+        """Return these stats as a JSON-like dict, with latencies in ms."""
+        mean = self.total_latency / self.count if self.count else 0.0
+        return {
+            'count': self.count,
+            'errors': self.errors,
+            'timeouts': self.timeouts,
+            'mean-latency-ms': mean * 1000,
+            'max-latency-ms': self.max_latency * 1000
+        }
+
+
+class MopidyRpcClient(WebSocketWrapper):
+
+    """A client multiplexing JSON-RPC calls over a mopidy WebSocket.
+
+    Every call is sent with a unique request id and resolved by a future
+    when the response with the matching id arrives, so any number of calls
+    may be in flight at once. A single reader task owns the socket; messages
+    without an id are mopidy events, and are delivered in order through
+    ``next_event``, or to ``event_handler`` if one is given.
+
+    Attributes:
+        call_timeout (float): The default number of seconds to wait for a
+            response to a call.
+        call_stats (Dict{str:MopidyCallStats}): Latency statistics, keyed by
+            mopidy method name.
+        spans (List[dict]): If not None, a span of the form ``{'name': str,
+            'start': float, 'end': float}`` is appended to it for every
+            call, with times on the event loop clock; set while running a
+            traced directive.
+
+    Args:
+        call_timeout (float): See the ``call_timeout`` attribute.
+        event_handler (Callable): An optional callable, invoked from the
+            reader task with each event dict, or with the exception that
+            stopped the reader.
+
+    """
+
+    def __init__(self, call_timeout=MOPIDY_CALL_TIMEOUT, event_handler=None):
+        super(MopidyRpcClient, self).__init__()
+
+        self.call_timeout = call_timeout
+        self.call_stats = {}
+        self.spans = None
+
+        self._events = asyncio.Queue()
+        self._event_handler = event_handler or self._events.put_nowait
+        self._next_id = 0
+        self._pending = {}
+        self._reader = None
+
+    @asyncio.coroutine
+    def open_ws(self, address):
+        """Coroutine to open the mopidy WebSocket and start reading it.
+
+        Args:
+            address (str): The address to connect to.
+
+        """
+        yield from super(MopidyRpcClient, self).open_ws(address)
+
+        if self._reader is None:
+            self._reader = asyncio.ensure_future(self._read_forever())
+
+    @asyncio.coroutine
+    def close_ws(self):
+        """Coroutine to stop reading and close the mopidy WebSocket."""
+        if self._reader is not None:
+            self._reader.cancel()
+            self._reader = None
+
+        self._fail_pending(ConnectionError('mopidy WebSocket closed.'))
+        yield from super(MopidyRpcClient, self).close_ws()
+
+    @asyncio.coroutine
+    def call(self, method, params=None, timeout=None):
+        """Coroutine to call a mopidy method and await its result.
+
+        Args:
+            method (str): The mopidy method to call, e.g.
+                ``'core.playback.play'``.
+            params (dict): Optional keyword parameters for the method.
+            timeout (float): The number of seconds to wait for a response;
+                defaults to ``call_timeout``.
+
+        Returns:
+            The ``result`` of mopidy's response.
+
+        Raises:
+            MopidyRpcError: If mopidy answers with an error.
+            asyncio.TimeoutError: If mopidy does not answer in time.
+
+        """
+        self._next_id += 1
+        request_id = self._next_id
+
+        request = {
+            'jsonrpc': '2.0',
+            'id': request_id,
+            'method': method
+        }
+        if params is not None:
+            request['params'] = params
+
+        stats = self.call_stats.get(method)
+        if stats is None:
+            stats = self.call_stats[method] = MopidyCallStats()
+
+        loop = asyncio.get_event_loop()
+        future = asyncio.Future()
+        self._pending[request_id] = future
+        started_at = loop.time()
+        try:
+            yield from self.send_json(request)
+            resp = yield from asyncio.wait_for(
+                future, self.call_timeout if timeout is None else timeout)
+        except asyncio.TimeoutError:
+            stats.timeouts += 1
+            _CALL_FAILURES.labels(method, 'timeout').inc()
+            raise
+        finally:
+            self._pending.pop(request_id, None)
+            if self.spans is not None:
+                self.spans.append({
+                    'name': 'mopidy:' + method,
+                    'start': started_at,
+                    'end': loop.time()
+                })
+
+        latency = loop.time() - started_at
+        stats.record(latency)
+        _CALL_SECONDS.labels(method).observe(latency)
+
+        error = resp.get('error')
+        if error is not None:
+            stats.errors += 1
+            _CALL_FAILURES.labels(method, 'error').inc()
+            raise MopidyRpcError('{0} failed: {1}'.format(
+                method, error.get('message', error)))
+
+        return resp.get('result')
+
+    @asyncio.coroutine
+    def next_event(self):
+        """Coroutine to receive the next event published by mopidy.
+
+        Returns:
+            dict: The JSON-like event dict, with an ``event`` key.
+
+        Raises:
+            Exception: The error that stopped the reader task, once all
+                events received before it have been consumed.
+
+        """
+        event = yield from self._events.get()
+        if isinstance(event, Exception):
+            raise event
+
+        return event
+
+    def get_call_stats(self):
+        """Return the per-method latency stats as a JSON-like dict."""
+        return {method: stats.to_dict()
+                for method, stats in self.call_stats.items()}
+
+    @asyncio.coroutine
+    def _read_forever(self):
+        """Coroutine to route every incoming message until the socket fails."""
+        try:
+            while True:
+                msg = yield from self.recv_json()
+                request_id = msg.get('id')
+
+                if request_id is None:
+                    self._event_handler(msg)
+                    continue
+
+                future = self._pending.get(request_id)
+                if future is not None and not future.done():
+                    future.set_result(msg)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self._fail_pending(e)
+            self._event_handler(e)
+
+    def _fail_pending(self, exc):
+        """Fail every in-flight call with the specified exception."""
+        for future in self._pending.values():
+            if not future.done():
+                future.set_exception(exc)
+        self._pending.clear()
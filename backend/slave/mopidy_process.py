@@ -0,0 +1,505 @@
+"""Management of the mopidy processes that a slave plays audio through."""
+
+import asyncio
+import collections
+import logging
+import re
+import time
+
+from ..utils import get_configured_logger
+from .config import (MOPIDY_LOG_FORWARD_BURST, MOPIDY_LOG_FORWARD_INTERVAL,
+                     MOPIDY_LOG_LINES, MOPIDY_READY_POLL_MAX,
+                     MOPIDY_READY_POLL_MIN, MOPIDY_READY_TIMEOUT,
+                     SPOTNET_SLAVE_LOGGER_NAME)
+from .mopidy_client import MopidyRpcClient
+
+
+# the console format mopidy is run with, and the pattern that parses it
+MOPIDY_LOG_FORMAT = '%(levelname)-8s [%(name)s] %(message)s'
+MOPIDY_LOG_PATTERN = re.compile(
+    r'^(DEBUG|INFO|WARNING|ERROR|CRITICAL)\s+(?:\[([^\]]*)\]\s)?(.*)$')
+
+
+class MopidyLog(object):
+
+    """A bounded record of the output of mopidy processes.
+
+    Each line is parsed into its log level, logger name and message, and
+    kept in a ring buffer of the latest ``max_lines`` lines. Lines that do
+    not parse, such as those of a traceback, take the level and logger of
+    the line before them from the same process.
+
+    Lines at ``WARNING`` or above are also forwarded to the slave's logger,
+    at most ``forward_burst`` of them every ``forward_interval`` seconds;
+    the number of lines held back is logged when the interval ends.
+
+    Attributes:
+        lines (collections.deque): The latest lines, as dicts of the form
+            ``{'time': float, 'port': int, 'level': str, 'logger': str,
+            'message': str}``, where ``time`` is a UNIX timestamp.
+        forward_burst (int): See the class description.
+        forward_interval (float): See the class description.
+        logger (logging.Logger): The logger lines are forwarded to.
+
+    """
+
+    def __init__(self, max_lines=MOPIDY_LOG_LINES,
+                 forward_burst=MOPIDY_LOG_FORWARD_BURST,
+                 forward_interval=MOPIDY_LOG_FORWARD_INTERVAL):
+        self.lines = collections.deque(maxlen=max_lines)
+        self.forward_burst = forward_burst
+        self.forward_interval = forward_interval
+        self.logger = get_configured_logger(SPOTNET_SLAVE_LOGGER_NAME)
+
+        # port -> (level, logger) of the last parsed line of each process
+        self._last = {}
+
+        self._window_start = 0.0
+        self._forwarded = 0
+        self._suppressed = 0
+
+    def append(self, port, line):
+        """Record a line of output of the mopidy process on a port."""
+        match = MOPIDY_LOG_PATTERN.match(line)
+        if match is not None:
+            level, logger, message = match.groups()
+            self._last[port] = (level, logger)
+        else:
+            level, logger = self._last.get(port, ('INFO', None))
+            message = line
+
+        self.lines.append({
+            'time': time.time(),
+            'port': port,
+            'level': level,
+            'logger': logger,
+            'message': message
+        })
+
+        if logging.getLevelName(level) >= logging.WARNING:
+            self._forward(port, level, message)
+
+    def get_lines(self, limit=None):
+        """Return the latest ``limit`` lines, or all of them, oldest
+        first."""
+        if limit is None or limit >= len(self.lines):
+            return list(self.lines)
+        return list(self.lines)[len(self.lines) - max(limit, 0):]
+
+    def _forward(self, port, level, message):
+        """Log a line to the slave's logger, unless over the rate limit."""
+        now = time.monotonic()
+        if now - self._window_start >= self.forward_interval:
+            if self._suppressed:
+                self.logger.warn('Suppressed {} lines of mopidy output.'
+                                 .format(self._suppressed))
+            self._window_start = now
+            self._forwarded = 0
+            self._suppressed = 0
+
+        if self._forwarded < self.forward_burst:
+            self._forwarded += 1
+            self.logger.log(logging.getLevelName(level),
+                            'mopidy on port {0}: {1}'.format(port, message))
+        else:
+            self._suppressed += 1
+
+
+class MopidyProcess(object):
+
+    """A single mopidy process, logged in to Spotify with one account.
+
+    Readiness is not assumed after a fixed delay: once mopidy reports the
+    Spotify login, its WebSocket endpoint is polled with short, growing
+    pauses until it answers a JSON-RPC call.
+
+    Mopidy's output is read for as long as the process runs, so that it
+    never blocks on a full pipe, and is recorded in a ``MopidyLog``.
+
+    Attributes:
+        port (int): The port of mopidy's HTTP server.
+        username (str): The Spotify username the process logs in with.
+        spawned_at (float): The event loop time at which it was spawned.
+        logged_in_at (float): The event loop time at which it reported the
+            Spotify login; None until then.
+        ready_at (float): The event loop time at which its WebSocket first
+            answered; None until then.
+
+    Args:
+        port (int): See the ``port`` attribute.
+        username (str): See the ``username`` attribute.
+        password (str): The Spotify password to log in with.
+        log (MopidyLog): The log to record the process's output in.
+
+    """
+
+    def __init__(self, port, username, password, log):
+        self.port = port
+        self.username = username
+        self.spawned_at = None
+        self.logged_in_at = None
+        self.ready_at = None
+
+        self._password = password
+        self._log = log
+        self._proc = None
+        self._drain = None
+        self._login = asyncio.Future()
+
+    @property
+    def address(self):
+        """str: The address of mopidy's WebSocket endpoint."""
+        return 'localhost:{}/mopidy/ws'.format(self.port)
+
+    @property
+    def is_running(self):
+        """bool: Whether the process has been spawned and not exited."""
+        return self._proc is not None and self._proc.returncode is None
+
+    @property
+    def returncode(self):
+        """int: The process's return code; None while it is running."""
+        return None if self._proc is None else self._proc.returncode
+
+    @property
+    def is_ready(self):
+        """bool: Whether the process is running and has answered."""
+        return self.is_running and self.ready_at is not None
+
+    def has_credentials(self, username, password):
+        """Return whether the process logs in with the given credentials."""
+        return self.username == username and self._password == password
+
+    @asyncio.coroutine
+    def spawn(self):
+        """Coroutine to spawn the mopidy process."""
+        args = ['mopidy', '-o', 'http/port={}'.format(self.port),
+                          '-o', 'mpd/enabled=false',
+                          '-o', 'logging/console_format=' + MOPIDY_LOG_FORMAT,
+                          '-o', 'spotify/username={}'.format(self.username),
+                          '-o', 'spotify/password={}'.format(self._password)]
+
+        self.spawned_at = asyncio.get_event_loop().time()
+        self._proc = yield from asyncio.create_subprocess_exec(
+            *args,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.STDOUT)
+        self._drain = asyncio.ensure_future(self._drain_stdout())
+
+    @asyncio.coroutine
+    def wait_for_login(self):
+        """Coroutine to wait for mopidy to report the Spotify login.
+
+        Returns:
+            bool: Whether the login passed; False if it failed or mopidy
+                exited first.
+
+        """
+        return (yield from asyncio.shield(self._login))
+
+    @asyncio.coroutine
+    def wait_until_ready(self, timeout=MOPIDY_READY_TIMEOUT):
+        """Coroutine to poll mopidy's WebSocket until it answers a call.
+
+        Raises:
+            asyncio.TimeoutError: If mopidy does not answer within
+                ``timeout`` seconds.
+            RuntimeError: If mopidy exits first.
+
+        """
+        loop = asyncio.get_event_loop()
+        deadline = loop.time() + timeout
+        delay = MOPIDY_READY_POLL_MIN
+
+        while True:
+            if not self.is_running:
+                raise RuntimeError('mopidy exited before it was ready.')
+
+            probe = MopidyRpcClient(call_timeout=delay)
+            try:
+                yield from probe.open_ws(self.address)
+                yield from probe.call('core.get_version')
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                # the connection is refused, or the call fails or times out,
+                # until mopidy's HTTP frontend and core have started
+                if loop.time() + delay > deadline:
+                    raise asyncio.TimeoutError(
+                        'mopidy not ready after {} seconds.'.format(timeout))
+            else:
+                self.ready_at = loop.time()
+                return
+            finally:
+                try:
+                    yield from probe.close_ws()
+                except Exception:
+                    pass
+
+            yield from asyncio.sleep(delay)
+            delay = min(delay * 2, MOPIDY_READY_POLL_MAX)
+
+    @asyncio.coroutine
+    def wait_exit(self):
+        """Coroutine to wait for the process to exit.
+
+        Returns:
+            int: The process's return code.
+
+        """
+        return (yield from self._proc.wait())
+
+    @asyncio.coroutine
+    def terminate(self):
+        """Coroutine to terminate the process, if it is running."""
+        if self.is_running:
+            self._proc.terminate()
+            yield from self._proc.wait()
+
+        if self._drain is not None:
+            self._drain.cancel()
+            self._drain = None
+
+    def get_metrics(self):
+        """Return the startup timings of the process as a JSON-like dict,
+        in seconds from spawning."""
+        def since_spawn(t):
+            return None if t is None else t - self.spawned_at
+
+        return {
+            'port': self.port,
+            'login-s': since_spawn(self.logged_in_at),
+            'ready-s': since_spawn(self.ready_at)
+        }
+
+    @asyncio.coroutine
+    def _drain_stdout(self):
+        """Coroutine to read mopidy's output until it exits, recording each
+        line and resolving the login status."""
+        loop = asyncio.get_event_loop()
+        try:
+            while True:
+                try:
+                    line = yield from self._proc.stdout.readline()
+                except ValueError:
+                    # a line over the stream's limit is dropped
+                    continue
+
+                if not line:
+                    break
+
+                text = line.decode('utf-8', 'replace').rstrip()
+                self._log.append(self.port, text)
+
+                if self._login.done():
+                    continue
+                elif 'Spotify login error' in text:
+                    self._login.set_result(False)
+                elif 'Logged in to Spotify in online mode' in text:
+                    self.logged_in_at = loop.time()
+                    self._login.set_result(True)
+        finally:
+            if not self._login.done():
+                self._login.set_result(False)
+
+
+class MopidyProcessManager(object):
+
+    """Keeps a mopidy process ready for playback, with a warm standby.
+
+    The active process plays audio. Once it is ready, a standby process is
+    started with the same credentials on the other port and kept ready, so
+    that it can take over at once. Asking for the credentials of the active
+    process is immediate, and for those of the standby promotes it; any
+    other credentials cold-start a process on the free port, while the
+    active one keeps running until the new one is ready or fails to log in.
+
+    Attributes:
+        ports (Tuple(int,int)): The two ports mopidy processes run on.
+        keep_standby (bool): Whether to keep a standby process running.
+        active (MopidyProcess): The process playing audio, or None.
+        standby (MopidyProcess): The warm standby process, or None.
+        cold_starts (int): The number of processes started on demand.
+        warm_starts (int): The number of times a running process was used.
+        last_time_to_ready (float): The seconds from the last request for
+            a process to it being ready; None before the first.
+        log (MopidyLog): The recent output of every mopidy process.
+        logger (logging.Logger): A logger instance for this manager.
+
+    Args:
+        ports (Tuple(int,int)): See the ``ports`` attribute.
+        keep_standby (bool): See the ``keep_standby`` attribute.
+
+    """
+
+    def __init__(self, ports, keep_standby=True):
+        self.ports = ports
+        self.keep_standby = keep_standby
+        self.active = None
+        self.standby = None
+        self.cold_starts = 0
+        self.warm_starts = 0
+        self.last_time_to_ready = None
+        self.log = MopidyLog()
+        self.logger = get_configured_logger(SPOTNET_SLAVE_LOGGER_NAME)
+
+        self._standby_task = None
+
+        # the (username, password) of the last successful login
+        self._credentials = None
+
+    @asyncio.coroutine
+    def start(self, username, password):
+        """Coroutine to make a process logged in with credentials active.
+
+        Returns:
+            bool: Whether the login passed; if not, the previously active
+                process, if any, is left as it was.
+
+        Raises:
+            asyncio.TimeoutError: If a new process logs in but does not
+                become ready in time.
+            RuntimeError: If a new process exits before it is ready.
+            OSError: If a new process cannot be spawned.
+
+        Whatever the error, a new process that did not become active is
+        terminated.
+
+        """
+        loop = asyncio.get_event_loop()
+        requested_at = loop.time()
+
+        if (self.active is not None and self.active.is_ready and
+                self.active.has_credentials(username, password)):
+            self.warm_starts += 1
+            self.last_time_to_ready = 0.0
+            return True
+
+        yield from self._stop_standby(
+            keep=self.standby is not None and self.standby.is_ready and
+            self.standby.has_credentials(username, password))
+
+        if self.standby is not None:
+            self.warm_starts += 1
+            proc, self.standby = self.standby, None
+        else:
+            self.cold_starts += 1
+            proc = MopidyProcess(self._free_port(), username, password,
+                                 self.log)
+            try:
+                yield from proc.spawn()
+                did_login = yield from proc.wait_for_login()
+                if not did_login:
+                    yield from proc.terminate()
+                    self._keep_standby()
+                    return False
+
+                yield from proc.wait_until_ready()
+            except:
+                yield from proc.terminate()
+                self._keep_standby()
+                raise
+
+        old, self.active = self.active, proc
+        if old is not None:
+            yield from old.terminate()
+        self._credentials = (username, password)
+
+        self.last_time_to_ready = loop.time() - requested_at
+        self.logger.info('mopidy ready on port {0} in {1:.2f} seconds.'
+                         .format(proc.port, self.last_time_to_ready))
+
+        self._keep_standby()
+        return True
+
+    @asyncio.coroutine
+    def restart(self):
+        """Coroutine to replace the active process after it failed.
+
+        The new process logs in with the credentials of the last successful
+        login; the standby is promoted if it is ready.
+
+        Returns:
+            bool: Whether the login passed.
+
+        Raises:
+            asyncio.TimeoutError: If a new process logs in but does not
+                become ready in time.
+
+        """
+        if self.active is not None:
+            yield from self.active.terminate()
+            self.active = None
+
+        return (yield from self.start(*self._credentials))
+
+    @asyncio.coroutine
+    def stop(self):
+        """Coroutine to terminate every mopidy process."""
+        yield from self._stop_standby()
+        if self.active is not None:
+            yield from self.active.terminate()
+            self.active = None
+
+    def get_metrics(self):
+        """Return startup metrics of the mopidy processes as a JSON-like
+        dict, with times in seconds."""
+        return {
+            'cold-starts': self.cold_starts,
+            'warm-starts': self.warm_starts,
+            'last-time-to-ready-s': self.last_time_to_ready,
+            'active': (None if self.active is None else
+                       self.active.get_metrics()),
+            'standby-ready': self.standby is not None and
+                             self.standby.is_ready
+        }
+
+    def _keep_standby(self):
+        """Start a standby process like the active one, if there is none."""
+        if (self.keep_standby and self.active is not None and
+                self.standby is None and self._standby_task is None):
+            self._standby_task = asyncio.ensure_future(self._start_standby())
+
+    @asyncio.coroutine
+    def _start_standby(self):
+        """Coroutine to start a standby process like the active one."""
+        proc = self.standby = MopidyProcess(
+            self._free_port(), self.active.username, self.active._password,
+            self.log)
+        try:
+            yield from proc.spawn()
+            did_login = yield from proc.wait_for_login()
+            if did_login:
+                yield from proc.wait_until_ready()
+                self.logger.info('Standby mopidy ready on port {0} in {1:.2f} '
+                                 'seconds.'.format(
+                                     proc.port, proc.get_metrics()['ready-s']))
+                self._standby_task = None
+                return
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.logger.warn('Failed to start standby mopidy: ' + repr(e))
+
+        if self.standby is proc:
+            self.standby = None
+            self._standby_task = None
+        yield from proc.terminate()
+
+    @asyncio.coroutine
+    def _stop_standby(self, keep=False):
+        """Coroutine to stop any standby process, or only its start-up if
+        ``keep`` is set."""
+        if self._standby_task is not None:
+            self._standby_task.cancel()
+            self._standby_task = None
+
+        if self.standby is not None and not keep:
+            yield from self.standby.terminate()
+            self.standby = None
+
+    def _free_port(self):
+        """Return the port that the active process is not running on."""
+        if self.active is not None and self.active.port == self.ports[0]:
+            return self.ports[1]
+        return self.ports[0]
@@ -1,12 +1,20 @@
 """The Spotnet slave server implementation."""
 
 import asyncio
+import collections
 import json
+import random
+import uuid
 
 from websockets.exceptions import ConnectionClosed
 
-from ..utils import get_configured_logger, WebSocketWrapper
-from .config import SPOTNET_SLAVE_LOGGER_NAME
+from ..utils import (available_codecs, get_codec, get_configured_logger,
+                     serve_metrics, WebSocketWrapper)
+from .config import (ACK_CACHE_SIZE, MOPIDY_RESTART_MAX_DELAY,
+                     MOPIDY_RESTART_MIN_DELAY, RECONNECT_MAX_DELAY,
+                     RECONNECT_MIN_DELAY, SPOTNET_SLAVE_LOGGER_NAME)
+from .mopidy_client import MopidyRpcClient
+from .mopidy_process import MopidyProcessManager
 
 
 class SpotnetSlaveServer(object):
@@ -18,7 +26,14 @@ class SpotnetSlaveServer(object):
         is_connected (bool): Boolean indicating whether this slave has
             successfully set up its Spotify credentials and is ready for
             playback.
-        mopidy_port (int): The port on which to run the mopidy process.
+        mopidy_port (int): The port on which to run the mopidy process; the
+            port after it is used for the standby process.
+        mopidy (MopidyProcessManager): The manager of the mopidy processes.
+        metrics_port (int): The port on which to serve metrics over HTTP, in
+            the Prometheus text format; None to not serve them.
+        node_id (str): An identifier for this node that stays the same
+            across runs, derived from its hardware address, so that the
+            master can restore its state when it reconnects.
         logger (logging.Logger): A logger instance for this server.
 
     Raises:
@@ -27,14 +42,42 @@ class SpotnetSlaveServer(object):
 
     """
 
-    def __init__(self, do_discover, master_address=None, mopidy_port=8888):
+    def __init__(self, do_discover, master_address=None, mopidy_port=8888,
+                 keep_standby=True, metrics_port=None):
         self.is_connected = False
+        self.metrics_port = metrics_port
         self.mopidy_port = mopidy_port
+        self.mopidy = MopidyProcessManager((mopidy_port, mopidy_port + 1),
+                                           keep_standby=keep_standby)
+        self.node_id = '{:012x}'.format(uuid.getnode())
         self.logger = get_configured_logger(SPOTNET_SLAVE_LOGGER_NAME)
 
         self._master_ws = WebSocketWrapper()
-        self._mopidy_ws = WebSocketWrapper()
-        self._mopidy_proc = None
+        self._mopidy_ws = MopidyRpcClient(event_handler=self._on_mopidy_event)
+
+        # the supervisor of the active mopidy process, which is told of a
+        # failed mopidy WebSocket through ``_mopidy_lost``; directives from
+        # the master wait for ``_mopidy_ready`` while mopidy is restarted
+        self._supervisor = None
+        self._mopidy_lost = asyncio.Event()
+        self._mopidy_ready = asyncio.Event()
+        self._mopidy_ready.set()
+
+        # the playback position last reported in a mopidy event, as a
+        # (time position in ms, event loop time, is playing) tuple
+        self._playback_position = (0, 0.0, False)
+
+        # a single queue of (source, message) pairs, fed by one long-lived
+        # reader task per socket and consumed by the dispatcher in ``_run``
+        self._inbox = asyncio.Queue()
+        self._master_reader = None
+
+        # the token with which the session with the master is resumed after
+        # a dropped connection, the acks of recent directives (by id), and
+        # the reports that could not be sent while disconnected
+        self._session_token = None
+        self._acks = collections.OrderedDict()
+        self._unsent_reports = []
 
         if do_discover:
             self.master_address = self._discover_master_server()
@@ -46,27 +89,47 @@ class SpotnetSlaveServer(object):
 
     @asyncio.coroutine
     def run_forever(self):
-        """Run the slave server."""
-        self.logger.info('Beginning execution of Spotnet slave server.')
+        """Run the slave server.
 
-        try:
-            yield from self._master_ws.open_ws(self.master_address)
-            self.logger.info('Established WebSocket with master server.')
+        A dropped connection with the master is re-established after a
+        random delay below an exponentially growing bound, and the session
+        is resumed with the token the master issued, so mopidy keeps running
+        and stays logged in.
 
-            # send message to master to join the network
-            yield from self._master_ws.send_json({
-                'status': 'request-connect',
-                'sender': 'slave'})
+        """
+        self.logger.info('Beginning execution of Spotnet slave server.')
 
-            # wait for credentials
-            while not self.is_connected:
-                yield from self._await_connected()
+        if self.metrics_port is not None:
+            self.logger.info('Serving metrics on port {}.'
+                             .format(self.metrics_port))
+            yield from serve_metrics(self.metrics_port)
 
+        attempt = 0
+        try:
             while True:
-                yield from self._run()
-        except ConnectionClosed as e:
-            self.logger.warn('Master server unexpectedly closed WebSocket '
-                             'connection.')
+                try:
+                    yield from self._connect_master()
+                    attempt = 0
+
+                    # wait for credentials
+                    while not self.is_connected:
+                        yield from self._await_connected()
+
+                    while True:
+                        yield from self._run()
+                except (ConnectionClosed, OSError) as e:
+                    self.logger.warn('Lost connection with master server: ' +
+                                     repr(e))
+
+                yield from self._close_master()
+
+                delay = random.uniform(0, min(
+                    RECONNECT_MAX_DELAY,
+                    RECONNECT_MIN_DELAY * 2 ** min(attempt, 16)))
+                attempt += 1
+                self.logger.info('Reconnecting to master server in {:.1f} '
+                                 'seconds.'.format(delay))
+                yield from asyncio.sleep(delay)
         except ValueError as e:
             self.logger.error('Invalid message received: ' + repr(e))
         except Exception as e:
@@ -74,19 +137,122 @@ class SpotnetSlaveServer(object):
         finally:
             self.logger.info('Closing open WebSocket connections and '
                              'terminating spawned mopidy process.')
+            if self._master_reader is not None:
+                self._master_reader.cancel()
+                self._master_reader = None
+            self._stop_supervisor()
+
             yield from asyncio.wait(
                 [self._master_ws.close_ws(),
                  self._mopidy_ws.close_ws(),
-                 self._terminate_mopidy_proc()],
+                 self.mopidy.stop()],
                 return_when=asyncio.ALL_COMPLETED)
             self.logger.info('Done running.')
 
+    @asyncio.coroutine
+    def _connect_master(self):
+        """Coroutine to connect to the master and start or resume a session.
+
+        Raises:
+            ValueError: If the master does not answer with a session.
+
+        """
+        yield from self._master_ws.open_ws(self.master_address)
+        self.logger.info('Established WebSocket with master server.')
+
+        self._master_reader = asyncio.ensure_future(self._read_master())
+
+        # send message to master to join the network
+        request = {
+            'status': 'request-connect',
+            'sender': 'slave',
+            'node-id': self.node_id,
+            'codecs': available_codecs()}
+        if self._session_token is not None:
+            request['session-token'] = self._session_token
+        yield from self._master_ws.send_json(request)
+
+        # mopidy events received in the meantime are kept for the dispatcher
+        deferred = []
+        while True:
+            source, resp = yield from self._next_inbound()
+            if source == 'master':
+                break
+            deferred.append((source, resp))
+        for item in deferred:
+            self._inbox.put_nowait(item)
+
+        status = resp.get('status')
+        if status == 'session-resumed':
+            self.logger.info('Resumed session with master server.')
+
+            reports = self._unsent_reports
+            self._unsent_reports = []
+            for report in reports:
+                yield from self._send_report(report)
+        elif status == 'session-started':
+            self.logger.info('Started new session with master server.')
+
+            self._session_token = resp['data']['token']
+            self._acks.clear()
+            self._unsent_reports = []
+
+            if self.is_connected:
+                # the master has no record of the login; mopidy is kept
+                # running, so logging in again with the same credentials
+                # does not wait for it to start
+                self._stop_supervisor()
+                yield from self._mopidy_ws.close_ws()
+                self.is_connected = False
+        else:
+            raise ValueError('Invalid "status" received when connecting to '
+                             'master.')
+
+    @asyncio.coroutine
+    def _close_master(self):
+        """Coroutine to tear down a dropped connection with the master.
+
+        Messages from the master that were not handled are discarded; the
+        master sends the directives among them again on resume.
+
+        """
+        if self._master_reader is not None:
+            self._master_reader.cancel()
+            self._master_reader = None
+
+        try:
+            yield from self._master_ws.close_ws()
+        except Exception:
+            pass
+
+        pending = []
+        while not self._inbox.empty():
+            pending.append(self._inbox.get_nowait())
+        for source, msg in pending:
+            if source == 'mopidy':
+                self._inbox.put_nowait((source, msg))
+
+    @asyncio.coroutine
+    def _send_report(self, report):
+        """Coroutine to send a report to the master, keeping it to send
+        again on resume if the connection is down."""
+        try:
+            yield from self._master_ws.send_json(report)
+        except ConnectionClosed:
+            self._unsent_reports.append(report)
+            raise
+
     @asyncio.coroutine
     def _await_connected(self):
-        """Coroutine to perform the slave connection flow."""
+        """Coroutine to perform the slave connection flow.
+
+        The master is told the login failed whether mopidy rejected the
+        credentials or could not be started with them.
+
+        """
         # wait for credentials to be sent from the master server
         self.logger.info('Awaiting credentials from master server.')
-        resp = yield from self._master_ws.recv_json()
+        resp = yield from self._recv_master()
 
         status = resp.get('status')
         if status != 'send-credentials':
@@ -102,43 +268,25 @@ class SpotnetSlaveServer(object):
         self.logger.info('Received Spotify username "{}" from master; not '
                          'displaying password here.'.format(username))
 
-        args = ['mopidy', '-o', 'http/port={}'.format(self.mopidy_port),
-                          '-o', 'spotify/username={}'.format(username),
-                          '-o', 'spotify/password={}'.format(password)]
-
-        self._mopidy_proc = yield from asyncio.create_subprocess_exec(
-            *args,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.STDOUT)
-
-        self.logger.info('Spawned mopidiy subprocess; awaiting login status.')
-
-        did_login = False
-        while True:
-            line = yield from self._mopidy_proc.stdout.readline()
-            print(line)
-            if b'Spotify login error' in line:
-                break
-            elif b'Logged in to Spotify in online mode' in line:
-                did_login = True
-                break
+        try:
+            did_login = yield from self.mopidy.start(username, password)
+        except (asyncio.TimeoutError, RuntimeError, OSError) as e:
+            self.logger.error('Failed to start mopidy: ' + repr(e))
+            did_login = False
 
         if did_login:
-            self.logger.info('Login passed; notifiying master.')
+            yield from self._open_mopidy_ws()
 
+            self.logger.info('Login passed; notifiying master.')
             yield from self._master_ws.send_json({
                 'status': 'login-passed',
-                'sender': 'slave'})
-
-            addr = 'localhost:{}/mopidy/ws'.format(self.mopidy_port)
-            self.logger.info('Attempting to open WebSocket with mopidy at '
-                             'address ws://{}'.format(addr))
-
-            yield from asyncio.sleep(3)
-            yield from self._mopidy_ws.open_ws(addr)
+                'sender': 'slave',
+                'data': {'mopidy': self.mopidy.get_metrics()}})
 
-            self.logger.info('mopidy WebSocket successfully opened.')
             self.is_connected = True
+            if self._supervisor is None:
+                self._supervisor = asyncio.ensure_future(
+                    self._supervise_mopidy())
         else:
             self.logger.info('Login failed; notifying master.')
 
@@ -146,145 +294,536 @@ class SpotnetSlaveServer(object):
                 'status': 'login-failed',
                 'sender': 'slave'})
 
-            self.logger.info('Terminating mopidy process.')
-            yield from self._terminate_mopidy_proc()
             self.is_connected = False
 
     @asyncio.coroutine
-    def _terminate_mopidy_proc(self):
-        """Terminate the spawned mopidy process."""
-        if self._mopidy_proc is not None:
-            self._mopidy_proc.terminate()
-            yield from self._mopidy_proc.wait()
-            self._mopidy_proc = None
+    def _open_mopidy_ws(self):
+        """Coroutine to open the WebSocket with the active mopidy process
+        and prepare its tracklist."""
+        yield from self._mopidy_ws.close_ws()
+
+        addr = self.mopidy.active.address
+        self.logger.info('Opening WebSocket with mopidy at address '
+                         'ws://{}'.format(addr))
+        yield from self._mopidy_ws.open_ws(addr)
+
+        # a process kept running from an earlier login may still hold its
+        # tracks; the master loads the queue it restores
+        yield from self._mopidy_ws.call('core.playback.stop')
+        yield from self._mopidy_ws.call('core.tracklist.clear')
+
+        # consume mode drops each track from the tracklist once it has
+        # played, so mopidy moves straight on to any pre-loaded next track
+        yield from self._mopidy_ws.call(
+            'core.tracklist.set_consume', {'value': True})
+
+        self._mopidy_lost.clear()
+        self._playback_position = (0, 0.0, False)
+
+    @asyncio.coroutine
+    def _supervise_mopidy(self):
+        """Coroutine to restart mopidy whenever it fails, until cancelled.
+
+        mopidy has failed when its process exits or its WebSocket stops.
+        It is then restarted with the credentials of the last login, after a
+        random delay below an exponentially growing bound if restarting
+        fails, and the master is sent the position that playback had
+        reached, so that it can restore the queue and playback.
+
+        """
+        while True:
+            proc = self.mopidy.active
+            exited = asyncio.ensure_future(proc.wait_exit())
+            lost = asyncio.ensure_future(self._mopidy_lost.wait())
+            try:
+                yield from asyncio.wait([exited, lost],
+                                        return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                exited.cancel()
+                lost.cancel()
+
+            time_position = self._get_time_position()
+            if proc.returncode is not None:
+                self.logger.error('mopidy on port {0} exited with code {1}; '
+                                  'restarting it.'.format(
+                                      proc.port, proc.returncode))
+            else:
+                self.logger.error('Lost WebSocket with mopidy on port {}; '
+                                  'restarting it.'.format(proc.port))
+
+            self._mopidy_ready.clear()
+            try:
+                yield from self._restart_mopidy()
+            finally:
+                self._mopidy_ready.set()
+
+            try:
+                yield from self._send_report({
+                    'status': 'mopidy-restarted',
+                    'sender': 'slave',
+                    'data': {
+                        'time-position': time_position,
+                        'mopidy': self.mopidy.get_metrics()
+                    }})
+            except ConnectionClosed:
+                # sent again once the session is resumed
+                pass
+
+    @asyncio.coroutine
+    def _restart_mopidy(self):
+        """Coroutine to restart mopidy, retrying with backoff until it is
+        ready and its WebSocket is open."""
+        yield from self._mopidy_ws.close_ws()
+
+        attempt = 0
+        while True:
+            try:
+                did_login = yield from self.mopidy.restart()
+                if did_login:
+                    yield from self._open_mopidy_ws()
+                    self.logger.info('Restarted mopidy on port {}.'
+                                     .format(self.mopidy.active.port))
+                    return
+
+                self.logger.error('Login failed when restarting mopidy.')
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.logger.error('Failed to restart mopidy: ' + repr(e))
+
+            delay = random.uniform(0, min(
+                MOPIDY_RESTART_MAX_DELAY,
+                MOPIDY_RESTART_MIN_DELAY * 2 ** min(attempt, 16)))
+            attempt += 1
+            yield from asyncio.sleep(delay)
+
+    def _stop_supervisor(self):
+        """Stop supervising mopidy."""
+        if self._supervisor is not None:
+            self._supervisor.cancel()
+            self._supervisor = None
+        self._mopidy_ready.set()
+
+    def _on_mopidy_event(self, event):
+        """Handle an event from the mopidy WebSocket's reader.
+
+        Events are queued for the dispatcher, after noting any playback
+        position they report; the error that stopped the reader is passed
+        to the supervisor instead.
+
+        """
+        if isinstance(event, Exception):
+            self.logger.warn('mopidy WebSocket failed: ' + repr(event))
+            self._mopidy_lost.set()
+            return
+
+        now = asyncio.get_event_loop().time()
+        name = event.get('event')
+        _, _, is_playing = self._playback_position
+        if name == 'track_playback_started':
+            self._playback_position = (0, now, True)
+        elif name in ('track_playback_paused', 'track_playback_ended'):
+            self._playback_position = (event.get('time_position', 0), now,
+                                       False)
+        elif name == 'track_playback_resumed':
+            self._playback_position = (event.get('time_position', 0), now,
+                                       True)
+        elif name == 'seeked':
+            self._playback_position = (event.get('time_position', 0), now,
+                                       is_playing)
+
+        self._inbox.put_nowait(('mopidy', event))
+
+    def _get_time_position(self):
+        """Return the estimated position, in ms, of playback in the current
+        track."""
+        time_position, at, is_playing = self._playback_position
+        if is_playing:
+            time_position += (asyncio.get_event_loop().time() - at) * 1000
+        return int(time_position)
+
+    @asyncio.coroutine
+    def _read_master(self):
+        """Coroutine to feed every message from the master into the inbox.
+
+        The error that stops the reader is queued as well, so that the
+        dispatcher raises it after handling everything received before it.
+
+        The master's codec selection is applied here, before any message
+        encoded with it is read. Clock pings are answered here rather than
+        queued, so that the timestamps in the reply are not skewed by
+        directives waiting ahead of them. Requests for mopidy's recent output
+        are answered here too, so that they are answered while waiting for
+        credentials or for a stuck mopidy.
+
+        Traced directives are stamped with the time they were read, so that
+        their wait in the inbox is reported to the master.
+
+        """
+        loop = asyncio.get_event_loop()
+        try:
+            while True:
+                msg = yield from self._master_ws.recv_json()
+                if msg.get('status') == 'codec-selected':
+                    codec = msg['data']['codec']
+                    self._master_ws.codec = get_codec(codec)
+                    self.logger.info('Master selected "{}" codec.'
+                                     .format(codec))
+                    continue
+                elif msg.get('status') == 'clock-ping':
+                    t1 = loop.time()
+                    yield from self._master_ws.send_json({
+                        'status': 'clock-pong',
+                        'sender': 'slave',
+                        'data': {
+                            't0': msg['data']['t0'],
+                            't1': t1,
+                            't2': loop.time()
+                        }})
+                    continue
+                elif msg.get('status') == 'get-mopidy-log':
+                    limit = (msg.get('data') or {}).get('limit')
+                    yield from self._send_ack({
+                        'id': msg.get('id'),
+                        'ok': True,
+                        'results': self.mopidy.log.get_lines(limit)})
+                    continue
+                elif 'trace-id' in msg:
+                    msg['received-at'] = loop.time()
+
+                self._inbox.put_nowait(('master', msg))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self._inbox.put_nowait(('master', e))
+
+    @asyncio.coroutine
+    def _next_inbound(self):
+        """Coroutine to get the next (source, message) pair from the inbox.
+
+        Raises:
+            Exception: The error that stopped the reader of either socket.
+
+        """
+        source, msg = yield from self._inbox.get()
+        if isinstance(msg, Exception):
+            raise msg
+
+        return source, msg
+
+    @asyncio.coroutine
+    def _recv_master(self):
+        """Coroutine to receive the next message from the master server.
+
+        mopidy events received in the meantime are discarded.
+
+        """
+        while True:
+            source, msg = yield from self._next_inbound()
+            if source == 'master':
+                return msg
+
+            self.logger.info('Discarding "{}" event from mopidy.'
+                             .format(msg.get('event')))
 
     @asyncio.coroutine
     def _run(self):
-        """Coroutine to run the slave server's main functionality."""
-        mopidy_recv = asyncio.async(self._mopidy_ws.recv_json())
-        master_recv = asyncio.async(self._master_ws.recv_json())
-        done, pending = yield from asyncio.wait(
-                            [mopidy_recv, master_recv],
-                            return_when=asyncio.FIRST_COMPLETED)
-
-        if mopidy_recv in done:
-            # received something from the mopidy process
-            master_recv.cancel()
-            resp = mopidy_recv.result()
+        """Coroutine to dispatch the next message from the master or mopidy."""
+        source, resp = yield from self._next_inbound()
+
+        if source == 'mopidy':
             event = resp.get('event')
 
-            if event is not None:
-                self.logger.info('Received "{}" event from mopidy'
-                                 .format(event))
+            self.logger.info('Received "{}" event from mopidy'.format(event))
+
+            if event == 'track_playback_ended':
+                self.logger.info('Current track has finished; notifying '
+                                 'master server.')
+
+                tl_track = resp.get('tl_track') or {}
+                yield from self._send_report({
+                    'status': 'track-ended',
+                    'sender': 'slave',
+                    'data': {
+                        'uri': tl_track.get('track', {}).get('uri'),
+                        'tlid': tl_track.get('tlid')
+                    }
+                })
+        else:
+            # directives wait while mopidy is restarted
+            yield from self._mopidy_ready.wait()
+            yield from self._handle_master_directive(resp)
 
-                if event == 'track_playback_ended':
-                    self.logger.info('Current track has finished; notifying '
-                                     'master server.')
+    @asyncio.coroutine
+    def _handle_master_directive(self, resp):
+        """Coroutine to run a directive from the master and acknowledge it.
 
-                    yield from self._master_ws.send_json({
-                        'status': 'track-ended',
-                        'sender': 'slave'
-                    })
+        Directives carrying an ``id`` are acknowledged with an ``ack``
+        message once mopidy has answered them, reporting whether they
+        succeeded. A ``command-batch`` directive runs each of its
+        directives in order and is acknowledged once. Successful acks carry
+        the result of each directive, such as the tlids of added tracks.
+
+        Recent acks are kept, so that a directive the master sends again
+        after a dropped connection is acknowledged without running twice.
+
+        The acks of directives carrying a ``trace-id`` also carry ``spans``
+        of the directive's wait in the inbox, of each directive run, and of
+        each mopidy call made for it, timed on this slave's clock.
+
+        Args:
+            resp (dict): The JSON-like dict received from the master.
+
+        """
+        status = resp['status']
+        directive_id = resp.get('id')
+
+        if directive_id is not None and directive_id in self._acks:
+            self.logger.info('Acknowledging repeated directive {} again.'
+                             .format(directive_id))
+            yield from self._send_ack(self._acks[directive_id])
+            return
+
+        loop = asyncio.get_event_loop()
+        spans = None
+        if 'trace-id' in resp:
+            now = loop.time()
+            spans = [{'name': 'slave:inbox',
+                      'start': resp.get('received-at', now),
+                      'end': now}]
+            self._mopidy_ws.spans = spans
+
+        try:
+            if status == 'command-batch':
+                directives = resp['data']['directives']
+                self.logger.info('Received batch of {} directives.'
+                                 .format(len(directives)))
+            else:
+                directives = [resp]
+
+            results = []
+            for directive in directives:
+                started_at = loop.time()
+                result = yield from self._run_directive(directive)
+                results.append(result)
+                if spans is not None:
+                    spans.append({'name': 'slave:' + directive['status'],
+                                  'start': started_at,
+                                  'end': loop.time()})
+        except Exception as e:
+            self.logger.error('Failed to run "{0}" directive{1}: {2}'.format(
+                status, '' if spans is None else
+                ' of trace {}'.format(resp['trace-id']), repr(e)))
+            ack = {'id': directive_id, 'ok': False, 'error': repr(e)}
         else:
-            # received something from the master server
-            mopidy_recv.cancel()
-            resp = master_recv.result()
-
-            status = resp['status']
-            if status == 'play-audio':
-                self.logger.info('Received "play-audio" directive; passing '
-                                 'it on to mopidy and updating state.')
-
-                yield from self._send_play_playback()
-            elif status == 'pause-audio':
-                self.logger.info('Received "pause-audio" directive; passing '
-                                 'it on to mopidy and updating state.')
-
-                yield from self._send_pause_playback()
-            elif status == 'stop-playback':
-                self.logger.info('Received "stop-playback" directive; '
-                                 'passing it on to mopidy.')
-
-                yield from self._send_stop_playback()
-            elif status == 'add-track':
-                data = resp['data']
-                uri = data['uri']
-
-                self.logger.info('Received request to add track with uri {}.'
-                                 .format(uri))
-
-                yield from self._send_uri(uri)
-            elif status == 'clear-tracks':
-                self.logger.info('Received request to clear mopidy tracklist.')
-                yield from self._send_clear_tracklist()
+            ack = {'id': directive_id, 'ok': True, 'results': results}
+        finally:
+            self._mopidy_ws.spans = None
+
+        if spans is not None:
+            ack['spans'] = spans
+
+        if directive_id is not None:
+            self._acks[directive_id] = ack
+            while len(self._acks) > ACK_CACHE_SIZE:
+                self._acks.popitem(last=False)
+
+            yield from self._send_ack(ack)
+
+    @asyncio.coroutine
+    def _send_ack(self, ack):
+        """Coroutine to acknowledge a directive to the master."""
+        yield from self._master_ws.send_json({
+            'status': 'ack',
+            'sender': 'slave',
+            'data': ack
+        })
+
+    @asyncio.coroutine
+    def _run_directive(self, directive):
+        """Coroutine to pass a single master directive on to mopidy.
+
+        Args:
+            directive (dict): A JSON-like dict with a ``status`` key and an
+                optional ``data`` key.
+
+        Returns:
+            The JSON-like result of the directive: the list of tlids added
+                for ``add-track``, ``{'started-at': float}`` for
+                ``play-audio``, and None otherwise.
+
+        Raises:
+            ValueError: If the directive's status is not recognized.
+
+        """
+        status = directive['status']
+        if status == 'play-audio':
+            self.logger.info('Received "play-audio" directive; passing '
+                             'it on to mopidy and updating state.')
+
+            data = directive.get('data', {})
+            started_at = yield from self._send_play_playback(
+                data.get('position'), data.get('at'),
+                data.get('time-position'))
+            return {'started-at': started_at}
+        elif status == 'pause-audio':
+            self.logger.info('Received "pause-audio" directive; passing '
+                             'it on to mopidy and updating state.')
+
+            yield from self._send_pause_playback()
+        elif status == 'stop-playback':
+            self.logger.info('Received "stop-playback" directive; '
+                             'passing it on to mopidy.')
+
+            yield from self._send_stop_playback()
+        elif status == 'add-track':
+            data = directive['data']
+            uris = data['uris']
+            position = data.get('position', 0)
+
+            self.logger.info('Received request to add {0} track(s) at '
+                             'position {1}.'.format(len(uris), position))
+
+            tl_tracks = yield from self._send_uris(uris, position)
+            return [tl_track['tlid'] for tl_track in tl_tracks]
+        elif status == 'remove-tracks':
+            tlids = directive['data']['tlids']
+
+            self.logger.info('Received request to remove tracks with tlids '
+                             '{}.'.format(tlids))
+
+            yield from self._send_remove_tlids(tlids)
+        elif status == 'move-track':
+            data = directive['data']
+
+            self.logger.info('Received request to move track at position '
+                             '{0} to position {1}.'
+                             .format(data['start'], data['to-position']))
+
+            yield from self._send_move_tracks(
+                data['start'], data['end'], data['to-position'])
+        elif status == 'clear-tracks':
+            self.logger.info('Received request to clear mopidy tracklist.')
+            yield from self._send_clear_tracklist()
+        else:
+            raise ValueError('Invalid "status" key "{}" in master directive.'
+                             .format(status))
 
     @asyncio.coroutine
     def _send_next_track(self):
         """Coroutine to tell mopidy to go to the next track."""
-        yield from self._mopidy_ws.send_json({
-            'jsonrpc': '2.0',
-            'id': 1,
-            'method': 'core.playback.next'
-        })
+        yield from self._mopidy_ws.call('core.playback.next')
 
     @asyncio.coroutine
     def _send_stop_playback(self):
         """Coroutine to tell mopidy to stop playback."""
-        yield from self._mopidy_ws.send_json({
-            'jsonrpc': '2.0',
-            'id': 1,
-            'method': 'core.playback.stop'
-        })
+        yield from self._mopidy_ws.call('core.playback.stop')
 
     @asyncio.coroutine
     def _send_pause_playback(self):
         """Coroutine to tell mopidy to pause playback."""
-        yield from self._mopidy_ws.send_json({
-            'jsonrpc': '2.0',
-            'id': 1,
-            'method': 'core.playback.pause'
+        yield from self._mopidy_ws.call('core.playback.pause')
+
+    @asyncio.coroutine
+    def _send_play_playback(self, position=None, at=None,
+                            time_position=None):
+        """Coroutine to tell mopidy to play playback.
+
+        Args:
+            position (int): The position in the mopidy list of the track to
+                play; if None, the current track is resumed or started.
+            at (float): The time on this slave's event loop clock at which
+                to start playback; if None, playback starts immediately.
+            time_position (int): The position, in ms, to seek to once the
+                track is playing; if None, the track is not seeked.
+
+        Returns:
+            float: The event loop time at which mopidy reported that
+                playback had started.
+
+        """
+        loop = asyncio.get_event_loop()
+
+        tlid = None
+        if position is not None:
+            tl_tracks = yield from self._mopidy_ws.call(
+                'core.tracklist.slice',
+                {'start': position, 'end': position + 1})
+            if tl_tracks:
+                tlid = tl_tracks[0]['tlid']
+
+        if at is not None:
+            delay = at - loop.time()
+            if delay > 0:
+                yield from asyncio.sleep(delay)
+            else:
+                self.logger.warn('Scheduled play arrived {:.1f} ms late.'
+                                 .format(-delay * 1000))
+
+        yield from self._mopidy_ws.call('core.playback.play', {
+            'tl_track': None,
+            'tlid': tlid
         })
+        started_at = loop.time()
+
+        if time_position:
+            yield from self._mopidy_ws.call('core.playback.seek', {
+                'time_position': time_position
+            })
+        return started_at
 
     @asyncio.coroutine
-    def _send_play_playback(self):
-        """Coroutine to tell mopidy to play playback."""
-        yield from self._mopidy_ws.send_json({
-            'jsonrpc': '2.0',
-            'id': 1,
-            'method': 'core.playback.play',
-            'params': {
-                'tl_track': None,
-                'tlid': None
+    def _send_uris(self, uris, position=0):
+        """Coroutine to send uris to a position in the mopidy list.
+
+        Args:
+            uris (List[str]): The uris of the tracks to add, in order.
+            position (int): The position at which to add the tracks.
+
+        Returns:
+            List[dict]: The tracklist tracks that mopidy added.
+
+        """
+        return (yield from self._mopidy_ws.call('core.tracklist.add', {
+            'uris': uris,
+            'at_position': position
+        }))
+
+    @asyncio.coroutine
+    def _send_remove_tlids(self, tlids):
+        """Coroutine to remove tracks from the mopidy list by tlid.
+
+        Args:
+            tlids (List[int]): The tlids of the tracks to remove.
+
+        """
+        yield from self._mopidy_ws.call('core.tracklist.remove', {
+            'criteria': {
+                'tlid': tlids
             }
         })
 
     @asyncio.coroutine
-    def _send_uri(self, uri):
-        """Coroutine to send a uri to the first position in the mopidy list.
+    def _send_move_tracks(self, start, end, to_position):
+        """Coroutine to move a slice of tracks within the mopidy list.
 
         Args:
-            uri (str): The uri of the track to add.
-            position (int): The position at which to add the track.
+            start (int): The position of the first track to move.
+            end (int): The position after the last track to move.
+            to_position (int): The position to move the tracks to, within the
+                list with the tracks taken out.
 
         """
-        yield from self._mopidy_ws.send_json({
-            'jsonrpc': '2.0',
-            'id': 1,
-            'method': 'core.tracklist.add',
-            'params': {
-                'uris': [uri],
-                'at_position': 0
-            }
+        yield from self._mopidy_ws.call('core.tracklist.move', {
+            'start': start,
+            'end': end,
+            'to_position': to_position
         })
 
     @asyncio.coroutine
     def _send_clear_tracklist(self):
         """Coroutine to tell mopidy to clear the tracklist."""
-        yield from self._mopidy_ws.send_json({
-            'jsonrpc': '2.0',
-            'id': 1,
-            'method': 'core.tracklist.clear'
-        })
+        yield from self._mopidy_ws.call('core.tracklist.clear')
 
     def _discover_master_server(self):
         """Run service discovery to get the master server address.
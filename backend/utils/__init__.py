@@ -1,2 +1,5 @@
-from .logging import get_configured_logger  # noqa
+from .logging import configure_logging, get_configured_logger  # noqa
+from .metrics import MetricsRegistry, REGISTRY, serve_metrics  # noqa
+from .wire_codecs import (available_codecs, get_codec,  # noqa
+                          negotiate_codec, PreEncoded)
 from .ws_wrapper import WebSocketWrapper  # noqa
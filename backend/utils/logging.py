@@ -1,14 +1,195 @@
-"""Utilities for logging."""
+"""Utilities for logging.
 
-import sys
+Loggers configured here do not write to stdout themselves: records are put
+on a queue by a ``QueueHandler`` and written by a ``QueueListener`` on a
+background thread, so that logging from the event loop never blocks on a
+slow console. Records are rate limited per call site before they are
+queued.
+
+"""
+
+import atexit
+import copy
+import json
 import logging
+import queue
+import sys
+import threading
+import time
 
 from logging import Formatter, getLogger, StreamHandler
+from logging.handlers import QueueHandler, QueueListener
+
+from .metrics import REGISTRY
+
+
+TEXT_FORMAT = '[%(asctime)s|%(name)s|%(levelname)s] - %(message)s'
+
+# the number of records that may wait to be written; records logged while
+# the queue is full are dropped and counted
+LOG_QUEUE_SIZE = 10000
+
+# the number of records each call site may log per interval of the given
+# number of seconds, and the share of the records beyond that which are
+# still logged
+RATE_LIMIT_BURST = 20
+RATE_LIMIT_INTERVAL = 1.0
+RATE_LIMIT_SAMPLE_EVERY = 100
+
+_DROPPED_RECORDS = REGISTRY.counter(
+    'spotnet_log_records_dropped_total',
+    'Log records dropped because the queue of records waiting to be '
+    'written was full.').labels()
+
+# formats the tracebacks of records before they are queued
+_EXC_FORMATTER = Formatter()
+
+_lock = threading.Lock()
+_handler = None
+_listener = None
+_stream_handler = None
+
+
+class JsonLinesFormatter(Formatter):
+
+    """Formats each record as a single line of JSON, for log collectors."""
+
+    def format(self, record):
+        entry = {
+            'time': record.created,
+            'logger': record.name,
+            'level': record.levelname,
+            'message': record.getMessage()
+        }
+        # records from the queue carry their traceback already formatted
+        if record.exc_text:
+            entry['exc'] = record.exc_text
+        elif record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+
+        return json.dumps(entry, separators=(',', ':'))
+
+
+class RateLimitFilter(logging.Filter):
+
+    """Limits how many records each call site logs, sampling the excess.
+
+    Records are keyed by the source line that logged them, so each kind of
+    message, such as the line logged for every ``track-ended`` report or
+    vote, is limited on its own. A call site may log ``burst`` records in
+    each interval of ``interval`` seconds; beyond that, only one record in
+    every ``sample_every`` is logged, noting how many were dropped since
+    the last one. Records at ``ERROR`` and above are never dropped.
+
+    Attributes:
+        burst (int): See the class description.
+        interval (float): See the class description.
+        sample_every (int): See the class description.
+
+    """
+
+    def __init__(self, burst=RATE_LIMIT_BURST, interval=RATE_LIMIT_INTERVAL,
+                 sample_every=RATE_LIMIT_SAMPLE_EVERY):
+        super(RateLimitFilter, self).__init__()
+        self.burst = burst
+        self.interval = interval
+        self.sample_every = sample_every
+
+        # (pathname, lineno) -> [window start, count in window, dropped]
+        self._sites = {}
+
+    def filter(self, record):
+        if record.levelno >= logging.ERROR:
+            return True
+
+        now = time.monotonic()
+        key = (record.pathname, record.lineno)
+        site = self._sites.get(key)
+        if site is None or now - site[0] >= self.interval:
+            dropped = site[2] if site is not None else 0
+            site = self._sites[key] = [now, 0, dropped]
+
+        site[1] += 1
+        if site[1] > self.burst and \
+                (site[1] - self.burst) % self.sample_every:
+            site[2] += 1
+            return False
+
+        if site[2]:
+            record.msg = '{0} [{1} similar records dropped]'.format(
+                record.getMessage(), site[2])
+            record.args = None
+            site[2] = 0
+
+        return True
+
+
+class _DroppingQueueHandler(QueueHandler):
+
+    """A ``QueueHandler`` that drops records while its queue is full.
+
+    Dropped records are counted in the ``spotnet_log_records_dropped_total``
+    metric.
+
+    """
+
+    def prepare(self, record):
+        """Return a copy of a record that is safe to queue.
+
+        Unlike the base implementation, the traceback of the record is kept
+        apart from its message, in ``exc_text``, so that the formatter on
+        the writer's side can place it.
+
+        """
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = _EXC_FORMATTER.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            _DROPPED_RECORDS.inc()
+
+
+def configure_logging(json_lines=False):
+    """Start the background writer of log records, if it is not running,
+    and select the format it writes in.
+
+    Calling this more than once only changes the format.
+
+    Args:
+        json_lines (bool): Whether to write each record as a line of JSON,
+            rather than as text.
+
+    """
+    global _handler, _listener, _stream_handler
+
+    with _lock:
+        if _listener is None:
+            _stream_handler = StreamHandler(stream=sys.stdout)
+
+            _handler = _DroppingQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+            _handler.addFilter(RateLimitFilter())
+
+            _listener = QueueListener(_handler.queue, _stream_handler)
+            _listener.start()
+            atexit.register(_listener.stop)
+
+        _stream_handler.setFormatter(
+            JsonLinesFormatter() if json_lines else Formatter(TEXT_FORMAT))
 
 
 def get_configured_logger(logger_name):
     """Get a configured Logger instance.
 
+    Loggers are only configured once, so repeated calls with the same name
+    return the same logger without adding handlers to it.
+
     Args:
         logger_name (str): The name to pass to ``logging.getLogger`` to
             retrieve the logger instance.
@@ -17,13 +198,14 @@ def get_configured_logger(logger_name):
         logging.Logger: The configured Logger instance.
 
     """
-    handler = StreamHandler(stream=sys.stdout)
-    formatter = Formatter('[%(asctime)s|%(name)s|%(levelname)s] - %(message)s')
+    if _listener is None:
+        configure_logging()
 
     logger = getLogger(logger_name)
     logger.setLevel(logging.INFO)
 
-    handler.setFormatter(formatter)
-    logger.addHandler(handler)
+    with _lock:
+        if _handler not in logger.handlers:
+            logger.addHandler(_handler)
 
     return logger
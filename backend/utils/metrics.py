@@ -0,0 +1,299 @@
+"""An in-process registry of metrics, served in the Prometheus text format.
+
+Metrics are grouped in families, each with a name, a help string and
+optional label names. A family hands out one child per combination of
+label values; callers on hot paths look their children up once and keep
+them, so that recording a value is a single attribute update, or a bisect
+of the bucket bounds for histograms.
+
+"""
+
+import asyncio
+import bisect
+import math
+
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# the default upper bounds of histogram buckets, in seconds
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Counter(object):
+
+    """A value that only goes up."""
+
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        """Increase the counter by ``amount``."""
+        self.value += amount
+
+
+class Gauge(object):
+
+    """A value that goes up and down."""
+
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0
+
+    def set(self, value):
+        """Set the gauge to ``value``."""
+        self.value = value
+
+    def inc(self, amount=1):
+        """Increase the gauge by ``amount``."""
+        self.value += amount
+
+    def dec(self, amount=1):
+        """Decrease the gauge by ``amount``."""
+        self.value -= amount
+
+
+class Histogram(object):
+
+    """Counts observed values in buckets with fixed upper bounds.
+
+    Attributes:
+        bounds (Tuple[float]): The upper bounds of the buckets, ascending;
+            values above the last bound fall in an implicit ``+Inf`` bucket.
+        counts (List[int]): The number of values observed in each bucket,
+            not cumulative; one longer than ``bounds``.
+        sum (float): The sum of every observed value.
+
+    """
+
+    __slots__ = ('bounds', 'counts', 'sum')
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        """Record a value."""
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+
+class MetricFamily(object):
+
+    """The metrics sharing a name, one for each set of label values.
+
+    Attributes:
+        name (str): The metric name.
+        kind (str): One of ``'counter'``, ``'gauge'`` or ``'histogram'``.
+        help (str): A description of the metric.
+        label_names (Tuple[str]): The names of the labels.
+
+    """
+
+    def __init__(self, name, kind, help, label_names=(), buckets=None):
+        self.name = name
+        self.kind = kind
+        self.help = help
+        self.label_names = tuple(label_names)
+
+        self._buckets = buckets
+        self._children = {}
+
+        if not self.label_names:
+            self.labels()
+
+    def labels(self, *values):
+        """Return the metric for the given label values, in the order of
+        ``label_names``, creating it if needed."""
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.label_names):
+                raise ValueError('Metric "{0}" takes labels {1}.'.format(
+                    self.name, self.label_names))
+
+            if self.kind == 'counter':
+                child = Counter()
+            elif self.kind == 'gauge':
+                child = Gauge()
+            else:
+                child = Histogram(self._buckets)
+            self._children[values] = child
+
+        return child
+
+    def samples(self):
+        """Return the samples of every child, as (suffix, labels, value)
+        tuples, where labels is a list of (name, value) pairs."""
+        samples = []
+        for values, child in sorted(self._children.items()):
+            labels = list(zip(self.label_names, values))
+            if self.kind != 'histogram':
+                samples.append(('', labels, child.value))
+                continue
+
+            cumulative = 0
+            for bound, count in zip(child.bounds + (math.inf,),
+                                    child.counts):
+                cumulative += count
+                samples.append(('_bucket', labels + [('le', bound)],
+                                cumulative))
+            samples.append(('_sum', labels, child.sum))
+            samples.append(('_count', labels, cumulative))
+
+        return samples
+
+
+class _CallbackFamily(object):
+
+    """A gauge whose value is read from a callable when rendered."""
+
+    def __init__(self, name, help, func):
+        self.name = name
+        self.kind = 'gauge'
+        self.help = help
+        self._func = func
+
+    def samples(self):
+        return [('', [], self._func())]
+
+
+class MetricsRegistry(object):
+
+    """A collection of metric families, rendered together.
+
+    Registering a family under a name that is already taken returns the
+    existing family, so modules may register the metrics they record at
+    import time.
+
+    """
+
+    def __init__(self):
+        self._families = {}
+
+    def counter(self, name, help, labels=()):
+        """Return the counter family with the given name."""
+        return self._register(name, 'counter', help, labels)
+
+    def gauge(self, name, help, labels=()):
+        """Return the gauge family with the given name."""
+        return self._register(name, 'gauge', help, labels)
+
+    def histogram(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        """Return the histogram family with the given name.
+
+        Args:
+            buckets (Tuple[float]): The ascending upper bounds of the
+                buckets.
+
+        """
+        return self._register(name, 'histogram', help, labels,
+                              tuple(buckets))
+
+    def gauge_callback(self, name, help, func):
+        """Register a gauge whose value is ``func()`` at render time,
+        replacing any gauge registered under the same name."""
+        self._families[name] = _CallbackFamily(name, help, func)
+
+    def render(self):
+        """Return every metric in the Prometheus text exposition format."""
+        lines = []
+        for name, family in sorted(self._families.items()):
+            lines.append('# HELP {0} {1}'.format(
+                name, family.help.replace('\\', r'\\').replace('\n', r'\n')))
+            lines.append('# TYPE {0} {1}'.format(name, family.kind))
+
+            for suffix, labels, value in family.samples():
+                if labels:
+                    lines.append('{0}{1}{{{2}}} {3}'.format(
+                        name, suffix,
+                        ','.join('{0}="{1}"'.format(k, _format_label(v))
+                                 for k, v in labels),
+                        _format_value(value)))
+                else:
+                    lines.append('{0}{1} {2}'.format(
+                        name, suffix, _format_value(value)))
+
+        return '\n'.join(lines) + '\n'
+
+    def _register(self, name, kind, help, labels, buckets=None):
+        """Return the family with a name, creating it if needed."""
+        family = self._families.get(name)
+        if family is None:
+            family = self._families[name] = MetricFamily(
+                name, kind, help, labels, buckets)
+        elif family.kind != kind:
+            raise ValueError('Metric "{0}" is already a {1}.'.format(
+                name, family.kind))
+
+        return family
+
+
+def _format_label(value):
+    """Format a label value, escaped for the text format."""
+    if isinstance(value, float):
+        return _format_value(value)
+    return (str(value).replace('\\', r'\\').replace('"', r'\"')
+            .replace('\n', r'\n'))
+
+
+def _format_value(value):
+    """Format a sample value for the text format."""
+    if value == math.inf:
+        return '+Inf'
+    elif isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+# the registry that every module of a process records its metrics in
+REGISTRY = MetricsRegistry()
+
+
+@asyncio.coroutine
+def serve_metrics(port, registry=REGISTRY):
+    """Coroutine to serve a registry's metrics over HTTP.
+
+    Any ``GET`` request for ``/metrics`` is answered with the rendered
+    metrics; other requests are answered with a 404.
+
+    Args:
+        port (int): The port to listen on.
+        registry (MetricsRegistry): The registry to serve.
+
+    Returns:
+        asyncio.AbstractServer: The listening server.
+
+    """
+    @asyncio.coroutine
+    def handle(reader, writer):
+        try:
+            request_line = yield from reader.readline()
+            while True:
+                line = yield from reader.readline()
+                if line in (b'\r\n', b'\n', b''):
+                    break
+
+            parts = request_line.decode('latin-1').split()
+            if (len(parts) >= 2 and parts[0] == 'GET' and
+                    parts[1].split('?')[0] == '/metrics'):
+                status = '200 OK'
+                body = registry.render().encode('utf-8')
+            else:
+                status = '404 Not Found'
+                body = b'Not Found\n'
+
+            writer.write(
+                'HTTP/1.0 {0}\r\nContent-Type: {1}\r\nContent-Length: {2}'
+                '\r\n\r\n'.format(status, CONTENT_TYPE, len(body))
+                .encode('latin-1') + body)
+            yield from writer.drain()
+        except (ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    return (yield from asyncio.start_server(handle, None, port))
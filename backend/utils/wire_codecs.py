@@ -0,0 +1,250 @@
+"""Wire codecs for the messages exchanged over Spotnet WebSockets.
+
+Peers agree on a codec when a connection opens: the connecting side lists
+the codecs it supports, in a ``codecs`` key of its first message, and the
+master answers with a ``codec-selected`` message naming the one both sides
+will use from then on. Peers that list no codecs keep using plain JSON.
+
+Messages in the negotiated codec are sent in binary frames, while JSON is
+always sent in text frames; text frames are therefore decoded as JSON
+whatever codec is in use, so the switch is safe in either direction.
+
+Parts of a message that are sent repeatedly, such as the state of a slave,
+may be wrapped in ``PreEncoded``; each of their encodings is then computed
+once and spliced into every message that includes them.
+
+"""
+
+import collections
+import json
+import zlib
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import ujson as fast_json
+except ImportError:
+    fast_json = None
+
+
+DEFAULT_CODEC = 'json'
+
+# the zlib compression level of the deflate codecs
+DEFLATE_LEVEL = 6
+
+# the four bytes that end every sync-flushed deflate block; they are
+# stripped from each message and restored before inflating, as in the
+# permessage-deflate WebSocket extension
+_DEFLATE_TAIL = b'\x00\x00\xff\xff'
+
+# stands in for each ``PreEncoded`` value while the rest of a message is
+# encoded, and is then replaced by the value's cached encoding
+_FRAGMENT_MARK = '\x00spotnet-pre-encoded\x00'
+
+
+class PreEncoded(object):
+
+    """A JSON-like value whose encoding is cached for each wire format.
+
+    The value must not be modified once wrapped; wrap the new value instead.
+    Values may contain further ``PreEncoded`` values, whose own cached
+    encodings are reused when this one is first encoded.
+
+    Attributes:
+        value: The wrapped JSON-like value.
+
+    """
+
+    def __init__(self, value):
+        self.value = value
+        self._encoded = {}
+
+    def encoded(self, codec):
+        """Return the value encoded by a non-compressing codec, cached."""
+        fragment = self._encoded.get(codec.format)
+        if fragment is None:
+            fragment = self._encoded[codec.format] = codec.encode(self.value)
+        return fragment
+
+
+def _splice(codec, encode, mark, obj):
+    """Encode an object, splicing in the encodings of ``PreEncoded`` values.
+
+    Args:
+        codec: The non-compressing codec doing the encoding.
+        encode (Callable): Encodes a JSON-like object, calling the
+            ``default`` callable it is given for unknown types.
+        mark: The encoding of ``_FRAGMENT_MARK`` under ``encode``.
+        obj: The JSON-like object to encode.
+
+    """
+    if isinstance(obj, PreEncoded):
+        # the same cached frame is shared by every message sending it
+        return obj.encoded(codec)
+
+    fragments = []
+
+    def default(value):
+        if isinstance(value, PreEncoded):
+            fragments.append(value.encoded(codec))
+            return _FRAGMENT_MARK
+        raise TypeError('{!r} is not serializable.'.format(value))
+
+    data = encode(obj, default)
+    if not fragments:
+        return data
+
+    # the marks appear in the order that the encoder met the values
+    parts = data.split(mark)
+    spliced = [parts[0]]
+    for fragment, part in zip(fragments, parts[1:]):
+        spliced.append(fragment)
+        spliced.append(part)
+    return data[:0].join(spliced)
+
+
+class JsonCodec(object):
+
+    """Encodes messages as compact JSON text.
+
+    ``ujson`` is used for decoding when it is installed. Encoding always
+    uses the standard library, which can splice in ``PreEncoded`` values.
+
+    """
+
+    name = 'json'
+    format = 'json'
+
+    def encode(self, obj):
+        """Return a JSON-like object encoded as a str."""
+        return _splice(self, self._dumps, _JSON_MARK, obj)
+
+    @staticmethod
+    def _dumps(obj, default):
+        """Encode an object as compact JSON, as ``_splice`` expects."""
+        return json.dumps(obj, separators=(',', ':'), default=default)
+
+    def decode(self, payload):
+        """Return the JSON-like object encoded in a str or bytes payload."""
+        if isinstance(payload, bytes):
+            payload = payload.decode('utf-8')
+        if fast_json is not None:
+            return fast_json.loads(payload)
+        return json.loads(payload)
+
+
+class MsgpackCodec(object):
+
+    """Encodes messages as MessagePack; requires the ``msgpack`` package."""
+
+    name = 'msgpack'
+    format = 'msgpack'
+
+    def encode(self, obj):
+        """Return a JSON-like object encoded as bytes."""
+        return _splice(self, self._packb, msgpack.packb(_FRAGMENT_MARK), obj)
+
+    @staticmethod
+    def _packb(obj, default):
+        """Encode an object as MessagePack, as ``_splice`` expects."""
+        return msgpack.packb(obj, use_bin_type=True, default=default)
+
+    def decode(self, payload):
+        """Return the JSON-like object encoded in a bytes payload."""
+        return msgpack.unpackb(payload, raw=False)
+
+
+class DeflateCodec(object):
+
+    """Compresses the output of another codec with deflate.
+
+    The compression context is kept across messages, so the keys repeated
+    in every state update cost only a few bits after their first use.
+    Instances are therefore tied to a single connection, and messages must
+    be decoded in the order they were encoded; each ``send_json`` encodes
+    its frame only once it holds the socket's send lock, and hands it to
+    the socket before releasing the lock, which guarantees this for a
+    single socket.
+
+    Args:
+        inner: The codec whose output is compressed.
+        level (int): The zlib compression level.
+
+    """
+
+    def __init__(self, inner, level=DEFLATE_LEVEL):
+        self.inner = inner
+        self.name = inner.name + '+deflate'
+        self._compressor = zlib.compressobj(
+            level, zlib.DEFLATED, -zlib.MAX_WBITS)
+        self._decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+
+    def encode(self, obj):
+        """Return a JSON-like object encoded and compressed as bytes."""
+        data = self.inner.encode(obj)
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+
+        data = (self._compressor.compress(data) +
+                self._compressor.flush(zlib.Z_SYNC_FLUSH))
+        return data[:-len(_DEFLATE_TAIL)]
+
+    def decode(self, payload):
+        """Return the JSON-like object in a compressed bytes payload."""
+        return self.inner.decode(
+            self._decompressor.decompress(payload + _DEFLATE_TAIL))
+
+
+_JSON_MARK = json.dumps(_FRAGMENT_MARK)
+
+
+# codec names mapped to factories, in order of preference
+_CODEC_FACTORIES = collections.OrderedDict()
+if msgpack is not None:
+    _CODEC_FACTORIES['msgpack+deflate'] = (
+        lambda: DeflateCodec(MsgpackCodec()))
+    _CODEC_FACTORIES['msgpack'] = MsgpackCodec
+_CODEC_FACTORIES['json+deflate'] = lambda: DeflateCodec(JsonCodec())
+_CODEC_FACTORIES['json'] = JsonCodec
+
+
+def available_codecs():
+    """Return the names of the codecs usable here, most preferred first."""
+    return list(_CODEC_FACTORIES)
+
+
+def get_codec(name):
+    """Return a new instance of the named codec.
+
+    Raises:
+        ValueError: If the codec is unknown or its dependency is not
+            installed.
+
+    """
+    factory = _CODEC_FACTORIES.get(name)
+    if factory is None:
+        raise ValueError('Unsupported codec "{}".'.format(name))
+
+    return factory()
+
+
+def negotiate_codec(offered):
+    """Return the most preferred codec that the other side offered.
+
+    Args:
+        offered (List[str]): The codec names listed by the other side, or
+            None if it listed none.
+
+    Returns:
+        str: The name of the selected codec; ``DEFAULT_CODEC`` if no offered
+            codec is available here.
+
+    """
+    for name in _CODEC_FACTORIES:
+        if name in (offered or ()):
+            return name
+
+    return DEFAULT_CODEC
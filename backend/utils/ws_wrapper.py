@@ -1,9 +1,28 @@
 """A class for wrapping a WebSocket."""
 
 import asyncio
-import json
 import websockets
 
+from .metrics import REGISTRY
+from .wire_codecs import DEFAULT_CODEC, JsonCodec, get_codec
+
+
+# text frames are always JSON, whatever codec a connection negotiated
+_TEXT_CODEC = JsonCodec()
+
+_MESSAGES_SENT = REGISTRY.counter(
+    'spotnet_ws_messages_sent_total',
+    'Messages sent over WebSocket connections.').labels()
+_BYTES_SENT = REGISTRY.counter(
+    'spotnet_ws_bytes_sent_total',
+    'Encoded bytes sent over WebSocket connections.').labels()
+_MESSAGES_RECEIVED = REGISTRY.counter(
+    'spotnet_ws_messages_received_total',
+    'Messages received over WebSocket connections.').labels()
+_BYTES_RECEIVED = REGISTRY.counter(
+    'spotnet_ws_bytes_received_total',
+    'Encoded bytes received over WebSocket connections.').labels()
+
 
 class WebSocketWrapper(object):
 
@@ -13,11 +32,23 @@ class WebSocketWrapper(object):
         ws (websockets.client.WebSocketClientProtocol): The websocket object
             representing the WebSocket wrapped by this class. This attribute
             will be set to None when a WebSocket connection is not open.
+        codec: The codec used to encode sent messages and decode received
+            binary frames; text frames are always decoded as JSON. See
+            ``utils.wire_codecs``.
+
+    Sends are serialized, so that several tasks may send over the same
+    WebSocket; concurrent sends on the underlying connection may each wait
+    on it to drain, which fails once the transport pauses for backpressure.
+    Each message is encoded only after its send acquires the lock, so that a
+    send cancelled while waiting never consumes codec state.
 
     """
 
     def __init__(self, ws=None):
         self.ws = ws
+        self.codec = get_codec(DEFAULT_CODEC)
+
+        self._send_lock = asyncio.Lock()
 
     @asyncio.coroutine
     def open_ws(self, address):
@@ -40,9 +71,12 @@ class WebSocketWrapper(object):
         """Coroutine to close the current WebSocket connection."""
         if self.ws is None:
             return
-        else:
+
+        try:
             yield from self.ws.close()
+        finally:
             self.ws = None
+            self.codec = get_codec(DEFAULT_CODEC)
 
     @asyncio.coroutine
     def send_json(self, json_dict):
@@ -52,8 +86,17 @@ class WebSocketWrapper(object):
             json_dict (dict): A JSON-like dict.
 
         """
-        json_payload = json.dumps(json_dict)
-        yield from self.ws.send(json_payload)
+        yield from self._send_lock.acquire()
+        try:
+            # encoded only once the lock is held, as a stateful codec's
+            # frames must be written in the order they were encoded
+            payload = self.codec.encode(json_dict)
+            yield from self.ws.send(payload)
+        finally:
+            self._send_lock.release()
+
+        _MESSAGES_SENT.value += 1
+        _BYTES_SENT.value += len(payload)
 
     @asyncio.coroutine
     def recv_json(self):
@@ -64,5 +107,10 @@ class WebSocketWrapper(object):
 
         """
         resp = yield from self.ws.recv()
-        json_resp = json.loads(resp)
-        return json_resp
+
+        _MESSAGES_RECEIVED.value += 1
+        _BYTES_RECEIVED.value += len(resp)
+
+        if isinstance(resp, str):
+            return _TEXT_CODEC.decode(resp)
+        return self.codec.decode(resp)
@@ -11,27 +11,96 @@ export default Ember.Component.extend({
    */
   slave: null,
 
+  /**
+   * The number of tracks loaded at a time, both from the master server and
+   * from the Spotify Web API, which looks up at most 50 tracks by id per
+   * request.
+   */
+  pageSize: 50,
+
   isLoadingTracks: false,
 
+  isLoadingMoreTracks: false,
+
+  /**
+   * Track models for the loaded front of the slave's queue, in queue order;
+   * null for tracks the Spotify Web API could not find.
+   */
   loadedTracks: null,
 
+  /**
+   * Track models already looked up, keyed by id, so that changes to the
+   * queue only look up the tracks new to it.
+   */
+  trackCache: null,
+
+  /**
+   * Incremented for each lookup of tracks, so that a lookup finishing after
+   * a newer one started is ignored.
+   */
+  trackRequest: 0,
+
+  /**
+   * The uri of the track this web client last voted to skip, as the master
+   * server counts only one vote per web client per track.
+   */
+  votedSkipUri: null,
+
+  /**
+   * Whether the latest lines of the slave's mopidy output are shown.
+   */
+  isShowingLog: false,
+
+  /**
+   * The number of lines of mopidy output requested at a time.
+   */
+  logLimit: 100,
+
   currentTrack: Ember.computed('loadedTracks', function() {
     const loadedTracks = this.get('loadedTracks');
-    return loadedTracks ? loadedTracks.objectAt(0) : null;
+    return loadedTracks ? loadedTracks[0] : null;
   }),
 
+  /**
+   * The loaded tracks after the current one, as objects of the form
+   * {track: track model, position: number}, where position is the track's
+   * absolute position in the slave's queue.
+   */
   comingUpTracks: Ember.computed('loadedTracks', function() {
     const loadedTracks = this.get('loadedTracks');
-    if (loadedTracks.get('length') < 1) {
+    if (!loadedTracks || loadedTracks.length < 2) {
       return null;
     }
 
-    return loadedTracks.slice(1);
+    return loadedTracks.slice(1).map((track, index) => {
+      return { track: track, position: index + 1 };
+    }).filter((entry) => entry.track);
+  }),
+
+  /**
+   * Computed property indicating whether this web client already voted to
+   * skip the slave's current track.
+   */
+  hasVotedSkip: Ember.computed('votedSkipUri', 'slave.trackQueue.[]',
+                               function() {
+    const votedSkipUri = this.get('votedSkipUri');
+    return votedSkipUri !== null &&
+           votedSkipUri === this.get('slave.trackQueue.firstObject.uri');
+  }),
+
+  /**
+   * Computed property indicating whether the slave's queue holds tracks past
+   * the loaded front of it.
+   */
+  hasMoreTracks: Ember.computed('slave.trackQueue.[]', 'slave.queueLength',
+                                function() {
+    return this.get('slave.trackQueue.length') < this.get('slave.queueLength');
   }),
 
   init() {
     this._super(...arguments);
 
+    this.set('trackCache', {});
     this.loadTrackData();
   },
 
@@ -62,22 +131,56 @@ export default Ember.Component.extend({
     });
   },
 
+  /**
+   * Look up the tracks in the loaded front of the slave's queue, a page of
+   * ids at a time, skipping those already looked up.
+   */
   loadTrackData() {
     const trackQueue = this.get('slave.trackQueue');
     if (!(trackQueue.length)) {
-      this.set('loadedTracks', null);
+      this.setProperties({
+        loadedTracks: null,
+        isLoadingMoreTracks: false
+      });
       return;
     }
 
-    this.set('isLoadingTracks', true);
+    if (!this.get('loadedTracks')) {
+      this.set('isLoadingTracks', true);
+    }
+
+    const cache = this.get('trackCache');
+    const pageSize = this.get('pageSize');
+    const missingIds = trackQueue.mapBy('id').filter((id) => {
+      return !cache.hasOwnProperty(id);
+    }).uniq();
+
+    const lookups = [];
+    for (let i = 0; i < missingIds.length; i += pageSize) {
+      lookups.push(this.get('store').query('track', {
+        tracksFrom: 'ids',
+        ids: missingIds.slice(i, i + pageSize).join(',')
+      }));
+    }
+
+    const request = this.incrementProperty('trackRequest');
+    Ember.RSVP.all(lookups).then((pages) => {
+      pages.forEach((tracks) => {
+        tracks.forEach((track) => {
+          cache[track.get('id')] = track;
+        });
+      });
+
+      if (this.get('isDestroyed') || request !== this.get('trackRequest')) {
+        return;
+      }
 
-    this.get('store').query('track', {
-      tracksFrom: 'ids',
-      ids: trackQueue.mapBy('id').join(',')
-    }).then((tracks) => {
       this.setProperties({
-        loadedTracks: tracks,
-        isLoadingTracks: false
+        loadedTracks: this.get('slave.trackQueue').map((entry) => {
+          return cache[entry.id] || null;
+        }),
+        isLoadingTracks: false,
+        isLoadingMoreTracks: false
       });
     });
   },
@@ -97,13 +200,48 @@ export default Ember.Component.extend({
     },
 
     /**
-     * Remove the track. Note that the `trackIndex` argument is the position
-     * of the track to remove in the `comingUpTracks` array, so we must
-     * increment it by 1 to properly remove the track from the slave's
-     * `trackQueue` attribute.
+     * Vote to skip the slave's current track.
+     */
+    voteSkip() {
+      const slave = this.get('slave');
+      const uri = Ember.get(slave, 'trackQueue.firstObject.uri');
+
+      this.set('votedSkipUri', uri);
+      this.get('spotnet').voteSkip(Ember.get(slave, 'uuid'), uri);
+    },
+
+    /**
+     * Fetch the latest lines of the slave's mopidy output and show them.
+     */
+    refreshLog() {
+      this.set('isShowingLog', true);
+      this.get('spotnet').requestSlaveLog(this.get('slave.uuid'),
+                                          this.get('logLimit'));
+    },
+
+    hideLog() {
+      this.set('isShowingLog', false);
+    },
+
+    /**
+     * Load the next page of the slave's queue from the master server; the
+     * tracks are looked up once they extend the slave's `trackQueue`.
+     */
+    loadMoreTracks() {
+      const slave = this.get('slave');
+      const start = Ember.get(slave, 'trackQueue.length');
+
+      this.set('isLoadingMoreTracks', true);
+      this.get('spotnet').requestQueueRange(
+        Ember.get(slave, 'uuid'), start, start + this.get('pageSize'));
+    },
+
+    /**
+     * Remove the track at the specified absolute position in the slave's
+     * queue.
      */
-    removeTrack(slaveUuid, trackIndex) {
-      this.get('spotnet').sendRemoveTrack(slaveUuid, trackIndex);
+    removeTrack(slaveUuid, position) {
+      this.get('spotnet').sendRemoveTrack(slaveUuid, position);
     }
 
   }
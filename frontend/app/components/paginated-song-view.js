@@ -2,6 +2,14 @@ import Ember from 'ember';
 
 export default Ember.Component.extend({
 
+  spotnet: Ember.inject.service(),
+
+  /**
+   * Array of selected slave UUIDs on which to queue the page of songs,
+   * modified by the dropdown.
+   */
+  selectedSlaves: null,
+
   /**
    * The current page number.
    */
@@ -19,6 +27,24 @@ export default Ember.Component.extend({
 
   actions: {
 
+    /**
+     * Add every Spotify track on the current page to the end of the queue of
+     * each selected slave, in a single request per slave.
+     */
+    queuePage() {
+      const selectedSlaves = this.get('selectedSlaves');
+      const tracks = this.get('songs').filterBy('isSpotifyTrack');
+      if (!selectedSlaves || !tracks.length) {
+        return;
+      }
+
+      const spotnet = this.get('spotnet');
+      selectedSlaves.forEach((slaveUuid) => {
+        spotnet.sendAddTracks(slaveUuid, 'end', tracks);
+      });
+      this.set('selectedSlaves', null);
+    },
+
     /**
      * Increment the page number, if it is within the allowed bounds.
      */
@@ -61,7 +61,7 @@ export default Ember.Component.extend({
   actions: {
 
     openModal() {
-      if (!this.get('song.isSpotifyTrack')) {
+      if (!this.get('song.isSpotifyTrack') || !this.get('spotnet.isHost')) {
         return;
       }
 
@@ -4,6 +4,16 @@ export default Ember.Controller.extend({
 
   spotnet: Ember.inject.service(),
 
+  /**
+   * Whether the request traces fetched from the master server are shown.
+   */
+  isShowingTraces: false,
+
+  /**
+   * The number of recent traces requested at a time.
+   */
+  traceLimit: 10,
+
   spotnetHadError: Ember.observer('spotnet.wasConnectionError', function() {
     if (this.get('spotnet.wasConnectionError')) {
       this.transitionToRoute('index', {
@@ -12,6 +22,46 @@ export default Ember.Controller.extend({
         }
       });
     }
-  })
+  }),
+
+  actions: {
+
+    /**
+     * Play audio on every connected slave at once.
+     */
+    playAll() {
+      this.get('spotnet').sendGroupCommand('all', 'play-audio');
+    },
+
+    /**
+     * Pause audio on every connected slave at once.
+     */
+    pauseAll() {
+      this.get('spotnet').sendGroupCommand('all', 'pause-audio');
+    },
+
+    /**
+     * Fetch the most recent request traces from the master server.
+     */
+    showRecentTraces() {
+      this.set('isShowingTraces', true);
+      this.get('spotnet').requestTraces(null, this.get('traceLimit'));
+    },
+
+    /**
+     * Fetch the trace of the last request sent before this one; the trace id
+     * is read before sending, as every request gets a new one.
+     */
+    showLastTrace() {
+      const spotnet = this.get('spotnet');
+      this.set('isShowingTraces', true);
+      spotnet.requestTraces(spotnet.get('lastTraceId'));
+    },
+
+    hideTraces() {
+      this.set('isShowingTraces', false);
+    }
+
+  }
 
 });
@@ -0,0 +1,12 @@
+import Ember from 'ember';
+
+/**
+ * Format a number of milliseconds to one decimal place, or '-' if it is not
+ * a number.
+ */
+export function formatMs(params) {
+  const ms = params[0];
+  return (typeof ms === 'number') ? ms.toFixed(1) + ' ms' : '-';
+}
+
+export default Ember.Helper.helper(formatMs);
@@ -29,13 +29,20 @@ export default Ember.Service.extend({
    * An array of objects representing slave nodes, of the form:
    * {
    *   "uuid": string,
+   *   "version": number,
    *   "countedVotesForSkip": number,
    *   "isConnected": boolean,
    *   "loginStatus": string, one of {'idle', 'failed', 'loading'},
    *   "name": string,
    *   "firstConnectedAt": isoformat string,
-   *   "trackQueue": [{id: 'some id', uri: 'some uri'}, ...]
+   *   "trackQueue": [{id: 'some id', uri: 'some uri'}, ...],
+   *   "queueLength": number,
+   *   "queueVersion": number
    * }
+   *
+   * The master only sends the front of each queue with the slave's state, so
+   * `trackQueue` holds the first tracks of the queue and may be shorter than
+   * `queueLength`; later tracks are loaded with `requestQueueRange`.
    */
   slaves: [],
 
@@ -70,9 +77,78 @@ export default Ember.Service.extend({
    */
   wasConnectionError: false,
 
+  /**
+   * The last clock synchronization stats sent by the master server, keyed
+   * as in the 'send-sync-stats' message; null until requested.
+   */
+  syncStats: null,
+
+  /**
+   * The role the master server assigned this web client: 'host' for the
+   * client allowed to control the slaves, or 'guest' for a read-only one.
+   * Only one web client at a time is the host.
+   */
+  role: null,
+
+  /**
+   * Computed property indicating whether this web client is the host, and so
+   * may control the slaves; controls are hidden or disabled for guests.
+   */
+  isHost: Ember.computed.equal('role', 'host'),
+
+  /**
+   * The last request the master server ignored, as in the 'request-denied'
+   * message; null if none was.
+   */
+  deniedRequest: null,
+
+  /**
+   * Compact per-slave summaries (name, pause state, current track and queue
+   * length), keyed by slave uuid; only filled in while subscribed to the
+   * 'summary' topic.
+   */
+  slaveSummaries: null,
+
+  /**
+   * The topics of state updates this web client is subscribed to; see
+   * `subscribe`.
+   */
+  topics: null,
+
+  /**
+   * The result of the last group command, as in the 'group-command-result'
+   * message; see `sendGroupCommand`.
+   */
+  groupCommandResult: null,
+
+  /**
+   * The latest lines of mopidy output of each slave, keyed by slave uuid;
+   * only filled in for slaves requested with `requestSlaveLog`.
+   */
+  slaveLogs: null,
+
+  /**
+   * The most recent traces of requests sent to the master, as in the
+   * 'send-traces' message; only filled in by `requestTraces`.
+   */
+  traces: null,
+
+  /**
+   * The trace id sent with the last request, with which the master traces
+   * the request through to the slaves.
+   */
+  lastTraceId: null,
+
   init() {
     this._super(...arguments);
 
+    this.setProperties({
+      slaveSummaries: {},
+      topics: ['*'],
+      slaveLogs: {},
+      traces: []
+    });
+
     this.initSocket();
   },
 
@@ -121,12 +197,51 @@ export default Ember.Service.extend({
       case 'send-slave-state':
         this.loadSlave(data.slave);
         break;
+      case 'send-slave-patches':
+        this.applySlavePatches(data.uuid, data.patches);
+        break;
+      case 'send-queue-range':
+        this.loadQueueRange(data);
+        break;
       case 'add-slave':
         this.addSlave(data.slave);
         break;
       case 'remove-slave':
         this.removeSlave(data.uuid);
         break;
+      case 'group-command-result':
+        Ember.Logger.log('Group "' + data.command + '" command: ' +
+                         data.succeeded.length + ' succeeded, ' +
+                         data.failed.length + ' failed, ' +
+                         data['timed-out'].length + ' timed out.');
+        this.set('groupCommandResult', data);
+        break;
+      case 'send-summary':
+        this.set('slaveSummaries', {});
+        data.slaves.forEach((summary) => {
+          this.set('slaveSummaries.' + summary.uuid, summary);
+        });
+        break;
+      case 'send-slave-summary':
+        this.set('slaveSummaries.' + data.slave.uuid, data.slave);
+        break;
+      case 'role-assigned':
+        this.set('role', data.role);
+        break;
+      case 'request-denied':
+        Ember.Logger.log('Master server ignored "' + data.request +
+                         '" request: ' + data.reason);
+        this.set('deniedRequest', data);
+        break;
+      case 'send-sync-stats':
+        this.set('syncStats', data);
+        break;
+      case 'send-slave-log':
+        this.set('slaveLogs.' + data.uuid, data.lines);
+        break;
+      case 'send-traces':
+        this.set('traces', data.traces);
+        break;
       case 'login-passed':
         slave = this.get('slaves').findBy('uuid', data.uuid);
         Ember.set(slave, 'loginStatus', 'idle');
@@ -164,10 +279,15 @@ export default Ember.Service.extend({
   },
 
   /**
-   * Send a JSON object over this service's WebSocket connection. Expects
-   * socketRef to be properly initialized and non-null.
+   * Send a JSON object over this service's WebSocket connection, tagged with
+   * a new trace id. Expects socketRef to be properly initialized and
+   * non-null.
    */
   wsSend(jsonObj) {
+    const traceId = Date.now().toString(36) +
+      Math.random().toString(36).slice(2, 10);
+    this.set('lastTraceId', traceId);
+    jsonObj['trace-id'] = traceId;
     this.get('socketRef').send(JSON.stringify(jsonObj));
   },
 
@@ -191,6 +311,133 @@ export default Ember.Service.extend({
     });
   },
 
+  /**
+   * Request the clock synchronization stats of every slave (offset, jitter,
+   * round trip time, and the skew of the last synchronized group play).
+   */
+  requestSyncStats() {
+    this.wsSend({
+      status: 'request-sync-stats',
+      sender: 'web-client'
+    });
+  },
+
+  /**
+   * Request the latest lines of a slave's mopidy output, for diagnostics.
+   * Only the host may request them.
+   */
+  requestSlaveLog(uuid, limit) {
+    this.wsSend({
+      status: 'get-slave-log',
+      sender: 'web-client',
+      data: {
+        uuid: uuid,
+        limit: limit === undefined ? null : limit
+      }
+    });
+  },
+
+  /**
+   * Request the most recent request traces from the master, or only the one
+   * with the given trace id, such as `lastTraceId`.
+   */
+  requestTraces(traceId, limit) {
+    this.wsSend({
+      status: 'get-traces',
+      sender: 'web-client',
+      data: {
+        'trace-id': traceId === undefined ? null : traceId,
+        limit: limit === undefined ? null : limit
+      }
+    });
+  },
+
+  /**
+   * Subscribe to, or unsubscribe from, topics of state updates. Topics are
+   * '*' for every update (the default), 'summary' for per-slave summaries,
+   * 'slave:<uuid>' for a slave's details without its queue, and
+   * 'queue:<uuid>' for a slave's queue.
+   */
+  subscribe(topics) {
+    this.get('topics').addObjects(topics);
+    this.wsSend({
+      status: 'subscribe',
+      sender: 'web-client',
+      data: {
+        topics: topics
+      }
+    });
+  },
+
+  unsubscribe(topics) {
+    this.get('topics').removeObjects(topics);
+    this.wsSend({
+      status: 'unsubscribe',
+      sender: 'web-client',
+      data: {
+        topics: topics
+      }
+    });
+  },
+
+  /**
+   * Vote to skip the current track, with the specified uri, of the slave with
+   * the specified uuid. Each web client's vote is counted once per track.
+   */
+  voteSkip(uuid, uri) {
+    this.wsSend({
+      status: 'vote-skip',
+      sender: 'web-client',
+      data: {
+        uuid: uuid,
+        uri: uri
+      }
+    });
+  },
+
+  /**
+   * Request the tracks from position `start` up to `end` in the queue of the
+   * slave with the specified uuid. The master caps the size of each range.
+   */
+  requestQueueRange(uuid, start, end) {
+    this.wsSend({
+      status: 'get-queue-range',
+      sender: 'web-client',
+      data: {
+        uuid: uuid,
+        start: start,
+        end: end
+      }
+    });
+  },
+
+  /**
+   * Extend the loaded front of a slave's queue with a range of tracks sent
+   * from the master server. A range read at a newer queue version than the
+   * loaded one is requested again once the patches in between arrive.
+   */
+  loadQueueRange(data) {
+    const slave = this.get('slaves').findBy('uuid', data.uuid);
+    if (!slave) {
+      return;
+    }
+
+    if (data['queue-version'] !== Ember.get(slave, 'queueVersion')) {
+      Ember.set(slave, 'pendingQueueRange', {
+        start: data.start,
+        end: data.start + data.tracks.length
+      });
+      return;
+    }
+
+    const trackQueue = Ember.get(slave, 'trackQueue');
+    const loaded = trackQueue.length;
+    if (data.start <= loaded) {
+      trackQueue.pushObjects(data.tracks.slice(loaded - data.start));
+    }
+    Ember.set(slave, 'queueLength', data['queue-length']);
+  },
+
   /**
    * Load the entire system state from a Spotnet data object sent from the
    * master server.
@@ -236,6 +483,10 @@ export default Ember.Service.extend({
     this.set('slaves', slaves.filter((slave) => {
       return Ember.get(slave, 'uuid') !== uuid;
     }));
+
+    const summaries = Ember.copy(this.get('slaveSummaries'));
+    delete summaries[uuid];
+    this.set('slaveSummaries', summaries);
   },
 
   /**
@@ -246,19 +497,156 @@ export default Ember.Service.extend({
   },
 
   /**
-   * Update / load a slave into the array of slaves.
+   * Update / load a slave into the array of slaves. A slave followed only
+   * through its own topics is created by its first snapshot; a snapshot of
+   * only its details leaves its queue empty until its queue is followed too.
    */
   loadSlave(slaveObj) {
     const slave = this.normalizeSlaveObj(slaveObj);
     const { uuid } = slave;
     const toUpdate = this.get('slaves').findBy('uuid', uuid);
 
+    if (!toUpdate) {
+      if (!slave.trackQueue) {
+        slave.trackQueue = [];
+      }
+      if (slave.queueVersion === undefined) {
+        slave.queueLength = 0;
+        slave.queueVersion = 0;
+      }
+      this.get('slaves').addObject(slave);
+      return;
+    }
+
     Ember.set(toUpdate, 'countedVotesForSkip', slave.countedVotesForSkip);
     Ember.set(toUpdate, 'isConnected', slave.isConnected);
     Ember.set(toUpdate, 'isPaused', slave.isPaused);
     Ember.set(toUpdate, 'name', slave.name);
     Ember.set(toUpdate, 'firstConnectedAt', slave.firstConnectedAt);
-    Ember.set(toUpdate, 'trackQueue', slave.trackQueue);
+    if (slave.trackQueue) {
+      Ember.set(toUpdate, 'trackQueue', slave.trackQueue);
+    }
+    if (slave.queueVersion !== undefined) {
+      Ember.set(toUpdate, 'queueLength', slave.queueLength);
+      Ember.set(toUpdate, 'queueVersion', slave.queueVersion);
+    }
+    Ember.set(toUpdate, 'version', slave.version);
+  },
+
+  /**
+   * Apply an ordered list of versioned patches to the slave with the
+   * specified uuid. Patches at or below the slave's current version are
+   * stale and skipped; a gap in versions means an update was missed, so the
+   * entire system state is requested again.
+   *
+   * A web client following only a slave's queue receives only its queue
+   * patches, so gaps are found in their queue versions instead; one
+   * following only the slave's details cannot tell a gap from the patches it
+   * was not sent, and applies every newer patch.
+   */
+  applySlavePatches(uuid, patches) {
+    const slave = this.get('slaves').findBy('uuid', uuid);
+    if (!slave) {
+      this.requestState();
+      return;
+    }
+
+    const followsAll = this.followsAllPatches(uuid);
+    for (let i = 0; i < patches.length; i++) {
+      const patch = patches[i];
+      const version = Ember.get(slave, 'version');
+      const queueVersion = Ember.get(slave, 'queueVersion');
+
+      let missed = false;
+      if (followsAll) {
+        if (patch.version <= version) {
+          continue;
+        }
+        missed = patch.version !== version + 1;
+      } else if (patch['queue-version'] !== undefined) {
+        if (patch['queue-version'] <= queueVersion) {
+          continue;
+        }
+        missed = patch['queue-version'] !== queueVersion + 1;
+      } else if (patch.version <= version) {
+        continue;
+      }
+
+      if (missed) {
+        Ember.Logger.log('Missed state patch for slave ' + uuid +
+                         '; requesting full state.');
+        this.requestState();
+        return;
+      }
+
+      this.applySlavePatch(slave, patch);
+      Ember.set(slave, 'version', patch.version);
+    }
+
+    const pending = Ember.get(slave, 'pendingQueueRange');
+    if (pending) {
+      Ember.set(slave, 'pendingQueueRange', null);
+      this.requestQueueRange(uuid, pending.start, pending.end);
+    }
+  },
+
+  /**
+   * Whether this web client receives every patch of the slave with the
+   * specified uuid, rather than only its field or only its queue patches.
+   */
+  followsAllPatches(uuid) {
+    const topics = this.get('topics');
+    return topics.indexOf('*') !== -1 ||
+      (topics.indexOf('slave:' + uuid) !== -1 &&
+       topics.indexOf('queue:' + uuid) !== -1);
+  },
+
+  /**
+   * Apply a single patch to a slave object. Queue patches only change the
+   * loaded front of the queue where they fall within (or directly after) it,
+   * but always update the queue's length and version.
+   */
+  applySlavePatch(slave, patch) {
+    const fieldNames = {
+      'name': 'name',
+      'is-connected': 'isConnected',
+      'is-paused': 'isPaused',
+      'counted-votes-for-skip': 'countedVotesForSkip'
+    };
+    const trackQueue = Ember.get(slave, 'trackQueue');
+
+    if (patch['queue-version'] !== undefined) {
+      Ember.set(slave, 'queueVersion', patch['queue-version']);
+    }
+
+    switch (patch.op) {
+      case 'queue-insert':
+        if (patch.position <= trackQueue.length) {
+          trackQueue.insertAt(patch.position, patch.track);
+        }
+        Ember.set(slave, 'queueLength', Ember.get(slave, 'queueLength') + 1);
+        break;
+      case 'queue-insert-many':
+        if (patch.position <= trackQueue.length) {
+          trackQueue.replace(patch.position, 0, patch.tracks);
+        }
+        Ember.set(slave, 'queueLength',
+                  Ember.get(slave, 'queueLength') + patch.tracks.length);
+        break;
+      case 'queue-remove':
+        if (patch.position < trackQueue.length) {
+          trackQueue.removeAt(patch.position);
+        }
+        Ember.set(slave, 'queueLength', Ember.get(slave, 'queueLength') - 1);
+        break;
+      case 'set-field':
+        if (fieldNames[patch.field]) {
+          Ember.set(slave, fieldNames[patch.field], patch.value);
+        }
+        break;
+      default:
+        Ember.Logger.log('Received invalid state patch op ' + patch.op);
+    }
   },
 
   /**
@@ -281,6 +669,28 @@ export default Ember.Service.extend({
     });
   },
 
+  /**
+   * Add several tracks at once to the slave with the specified uuid, at the
+   * specified position ('current', 'next', or 'end') in its queue. Note that
+   * the tracks argument is an array of track models.
+   */
+  sendAddTracks(slaveUuid, position, tracks) {
+    this.wsSend({
+      status: 'add-tracks',
+      sender: 'web-client',
+      data: {
+        uuid: slaveUuid,
+        position: position,
+        tracks: tracks.map((track) => {
+          return {
+            id: track.get('id'),
+            uri: track.get('spotifyUri')
+          };
+        })
+      }
+    });
+  },
+
   /**
    * Remove a track from the slave with the specified uuid, at the specified
    * position.
@@ -316,19 +726,41 @@ export default Ember.Service.extend({
     });
   },
 
+  /**
+   * Send a command to several slaves at once. The uuids argument is either an
+   * array of slave uuids or the string 'all'; command is one of
+   * 'play-audio', 'pause-audio', 'add-track', or 'add-tracks', and args holds
+   * the same data as the corresponding single-slave request (minus the
+   * uuid).
+   */
+  sendGroupCommand(uuids, command, args) {
+    this.wsSend({
+      status: 'group-command',
+      sender: 'web-client',
+      data: {
+        uuids: uuids,
+        command: command,
+        args: args || {}
+      }
+    });
+  },
+
   /**
    * Normalize a raw slave object sent from the master server.
    */
   normalizeSlaveObj(slaveObj) {
     return {
         uuid: slaveObj.uuid,
+        version: slaveObj.version,
         countedVotesForSkip: slaveObj['counted-votes-for-skip'],
         isConnected: slaveObj['is-connected'],
         loginStatus: 'idle',
         isPaused: slaveObj['is-paused'],
         name: slaveObj.name,
         firstConnectedAt: slaveObj['first-connected-at'],
-        trackQueue: slaveObj['track-queue']
+        trackQueue: slaveObj['track-queue'],
+        queueLength: slaveObj['queue-length'],
+        queueVersion: slaveObj['queue-version']
       };
   }
 
@@ -0,0 +1,9 @@
+import { formatMs } from 'frontend/helpers/format-ms';
+import { module, test } from 'qunit';
+
+module('Unit | Helper | format ms');
+
+test('it works', function(assert) {
+  assert.equal(formatMs([12.345]), '12.3 ms');
+  assert.equal(formatMs([null]), '-');
+});